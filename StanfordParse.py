@@ -1,22 +1,228 @@
 # Run stanford parser ParseDemo on utf-8 text file.
 # Be sure to compile ~/lib/standford-parser*/custom/Parser
+#
+# Starting a JVM and loading the models takes much longer than processing one article. If start_workers is called,
+# tokenize and parse send the files to long-lived JVM processes (custom/BatchTokenizer and custom/BatchParser) instead
+# of starting a new one for every file. tokenize_many and parse_many process many files on all the workers at once.
+#
+# The batch protocol: the worker reads the names of the files from stdin, one per line. For every file it does the same
+# as the single-file program (the tokenizer writes textfile.tok, the parser prints the parse to stdout) and then prints
+# a line that consists of DONE_MARKER. If the file could not be processed, it prints a line that starts with
+# FAILED_MARKER followed by the description of the error instead. The worker exits when stdin is closed.
+# standinworker.py speaks the same protocol without Java, so that the workers can be checked on any machine.
 
 import subprocess
 import sys
+import threading
 
 import classpaths as path
+import toolrunner
+
+is_py2 = sys.version[0] == '2'
+if is_py2:
+    import Queue as queue
+else:
+    import queue
+
+DONE_MARKER = '@@DONE@@'  # the line that the worker prints after every processed file
+FAILED_MARKER = '@@FAILED@@'  # the beginning of the line that the worker prints if a file could not be processed
+PARSER_HEAP = '-Xmx8000m'  # the maximum heap size of a parser JVM
+PROCESSES = 1  # the number of JVMs that tokenize_many and parse_many start at once if start_workers was not called.
+# Every one of them processes one file
 
 
 def parse(textfile):
-    '''Run parser and return all output as a string.'''
+    '''Run parser and return all output as a (unicode) string. The output is decoded the same way whether the parser
+    runs in a worker or not'''
+    if 'parser' in _pools:
+        return _pools['parser'].process(textfile)
     #subprocess.call(['java','-cp',CLASSPATH,PROG,MODELS,textfile],shell=False)
     #    output = subprocess.check_output(['java','-cp',CLASSPATH,'-Xmx8000m',,PROG,MODELS,textfile],shell=False)
-    output = subprocess.check_output(['java','-cp',path.CLASSPATH,'-Xmx8000m',path.PARSERPROG,path.MODELS,textfile],shell=False)
-    return output
+    output = subprocess.check_output(_command('parser', textfile),shell=False)
+    return output.decode('utf-8')
 
 def tokenize(textfile):
     '''Run tokenizer.  Output in textfile.tok'''
-    output = subprocess.check_output(['java','-cp',path.CLASSPATH,path.TOKENIZERPROG,textfile],shell=False)
+    if 'tokenizer' in _pools:
+        _pools['tokenizer'].process(textfile)
+        return
+    output = subprocess.check_output(_command('tokenizer', textfile),shell=False)
+
+
+def _command(kind, textfile):
+    '''Return the command that starts a new JVM to process one file'''
+    if kind == 'parser':
+        return ['java','-cp',path.CLASSPATH,PARSER_HEAP,path.PARSERPROG,path.MODELS,textfile]
+    return ['java','-cp',path.CLASSPATH,path.TOKENIZERPROG,textfile]
+
+
+def parse_many(textfiles):
+    '''
+    Run parser on many files. If start_workers was called, the files are processed by all the parser workers at once,
+    otherwise PROCESSES files are parsed at once
+    :return: the list with the output of the parser for every file, or the exception if the file could not be parsed
+    '''
+    return _process_many(parse, 'parser', textfiles)
+
+
+def tokenize_many(textfiles):
+    '''
+    Run tokenizer on many files. Output in textfile.tok for every textfile. If start_workers was not called, PROCESSES
+    files are tokenized at once
+    :return: the list with None for every file that was tokenized, or the exception if the file could not be tokenized
+    '''
+    return _process_many(tokenize, 'tokenizer', textfiles)
+
+
+def _process_many(function, kind, textfiles):
+    '''Call function for every file, on all the workers of the given kind at once if they were started'''
+    results = [None] * len(textfiles)
+    def run(i):
+        try:
+            results[i] = function(textfiles[i])
+        except Exception as e:
+            results[i] = e
+    if kind not in _pools:  # a new JVM for every file, PROCESSES of them at once
+        jobs = toolrunner.run_all([_command(kind, textfile) for textfile in textfiles], PROCESSES)
+        for i in range(len(jobs)):
+            if not jobs[i].ok():
+                results[i] = subprocess.CalledProcessError(jobs[i].returncode, jobs[i].command, jobs[i].error)
+            elif kind == 'parser':
+                results[i] = jobs[i].stdout
+        return results
+    tasks = queue.Queue()
+    for i in range(len(textfiles)):
+        tasks.put(i)
+    def work():
+        while True:
+            try:
+                i = tasks.get_nowait()
+            except queue.Empty:
+                return
+            run(i)
+    threads = [threading.Thread(target=work) for i in range(min(_pools[kind].size, len(textfiles)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class WorkerError(Exception):
+
+    """ the worker could not process the file or died """
+
+
+class Worker(object):
+
+    """ one long-lived process that speaks the batch protocol """
+
+    def __init__(self, command):
+        '''
+        :param command: the command that starts the worker (list of strings)
+        '''
+        self.command = command
+        self.process = None
+
+    def start(self):
+        '''Start the process if it is not running'''
+        if (self.process is None) or (self.process.poll() is not None):
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, shell=False)
+
+    def process_file(self, textfile):
+        '''
+        Send the name of the file to the worker and wait until it is processed
+        :return: everything the worker printed for this file, except for the marker
+        '''
+        self.start()
+        try:
+            self.process.stdin.write((textfile + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (IOError, OSError) as e:
+            self.close()
+            raise WorkerError('the worker died: ' + str(e))
+        output = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:  # the worker died. It will be started again for the next file
+                self.close()
+                raise WorkerError('the worker died while processing ' + textfile)
+            line = line.decode('utf-8')
+            if line.rstrip('\r\n') == DONE_MARKER:
+                return ''.join(output)
+            if line.startswith(FAILED_MARKER):
+                raise WorkerError(line[len(FAILED_MARKER):].strip())
+            output.append(line)
+
+    def close(self):
+        '''Close stdin of the worker, so that it exits, and wait for it'''
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        self.process = None
+
+
+class WorkerPool(object):
+
+    """ a fixed number of workers. Every file is sent to the first worker that is free """
+
+    def __init__(self, command, size):
+        '''
+        :param command: the command that starts a worker (list of strings)
+        :param size:    the number of workers
+        '''
+        self.size = size
+        self.workers = [Worker(command) for i in range(size)]
+        self.free = queue.Queue()
+        for worker in self.workers:
+            worker.start()
+            self.free.put(worker)
+
+    def process(self, textfile):
+        '''Process the file on the first free worker (see Worker.process_file). Can be called from many threads'''
+        worker = self.free.get()
+        try:
+            return worker.process_file(textfile)
+        finally:
+            self.free.put(worker)
+
+    def close(self):
+        '''Stop all the workers'''
+        for worker in self.workers:
+            worker.close()
+
+
+_pools = {}  # 'tokenizer' and 'parser' WorkerPools, if start_workers was called
+
+
+def start_workers(tokenizers=1, parsers=0, tokenizerCommand=None, parserCommand=None):
+    '''
+    Start long-lived workers, so that tokenize and parse use them instead of starting a JVM for every file
+    :param tokenizers:       the number of tokenizer workers
+    :param parsers:          the number of parser workers. Every one of them takes PARSER_HEAP of memory
+    :param tokenizerCommand: the command that starts a tokenizer worker. By default, BATCH_TOKENIZERPROG is started
+    :param parserCommand:    same for the parser. By default, BATCH_PARSERPROG is started
+    :return: None
+    '''
+    stop_workers()
+    if tokenizerCommand is None:
+        tokenizerCommand = ['java', '-cp', path.CLASSPATH, path.BATCH_TOKENIZERPROG]
+    if parserCommand is None:
+        parserCommand = ['java', '-cp', path.CLASSPATH, PARSER_HEAP, path.BATCH_PARSERPROG, path.MODELS]
+    if tokenizers > 0:
+        _pools['tokenizer'] = WorkerPool(tokenizerCommand, tokenizers)
+    if parsers > 0:
+        _pools['parser'] = WorkerPool(parserCommand, parsers)
+
+
+def stop_workers():
+    '''Stop all the workers. After that, tokenize and parse start a JVM for every file again'''
+    for kind in list(_pools.keys()):
+        _pools.pop(kind).close()
 
 
 def main():
@@ -24,6 +230,6 @@ def main():
     print (parse(textfile))
     #tokenize(textfile)
 
-        
+
 if __name__ == "__main__":
     main()
@@ -13,6 +13,18 @@ relp(int sent, boolean inFirstArticle): inverse of absp
 calculate_cosine_similarity(v0, v1): calculate the cosine similarity between two given vectors
 
 
+calculate_block_similarity(vectors0, vectors1): calculate the cosine similarities between every sentence given by
+vectors0 and every sentence given by vectors1 at once. Return the matrix of these similarities
+
+
+fill_block_similarity(sent0, sent1, v0, v1): calculate all the entries of sentSim that represent the similarities
+between the given sentences and were not calculated previously
+
+
+missing_block_similarity(sent0, sent1, v0, v1): same as fill_block_similarity, but return the block of similarities
+instead of writing it to sentSim
+
+
 rel_sent_sim(int p0, int s0, int p1, int s1, v0, v1): calculate the cosine similarity between two given sentences,
 if it was not calculated previously. Return the calculated value. Use relative sentence coordinates.
 
@@ -28,6 +40,14 @@ build_tf_idf(rawVectors, parFq, totalW): get the TF vectors for some set of sent
 that contains all these sentences. Return the TF-IDF vectors
 
 
+paragraph_tf_idf(article, pars): return the TF-IDF vectors for the sentences of the given (conceptually concatenated)
+paragraphs. The vectors are built once for every group of paragraphs
+
+
+invalidate_tf_idf(article, pars): forget the TF-IDF vectors built for the groups of paragraphs that overlap with a
+group of paragraphs that was just merged
+
+
 paragraph_similarity(ind0, ind1): calculate the similarity between two given paragraphs if it was not calculated
 previously. Return the calculated value.
 
@@ -43,6 +63,9 @@ align_sentences(sent0, sent1, v0, v1): Takes an array with sentence indexes and
 sentence_function(last, next, pars): Function used in euclidean.closest for sentence alignment.
 
 
+sentence_batch_function(last, next0, next1, pars): vectorized version of sentence_function. Used in euclidean.closest
+
+
 pars_to_sents(pars, sentInd): receive the list of paragraphs' indexes and convert it to an array of absolute
 indexes of sentences that appear in these paragraphs
 
@@ -51,7 +74,10 @@ clean_sent_matrix(list_of_ints pars0, list_of_ints pars1): delete all previously
 matrix if they represent similarities between the sentences from given paragraphs
 
 
-add_freq(indexes, originals): add together the entries at the same positions in the parFreq arrays. Conceptually,
+word_frequency(parFq, words): look up the number of times each of the given words appears in the paragraph(s)
+
+
+add_freq(indexes, originals): add together the frequencies of the same words in the parFreq arrays. Conceptually,
 it merges the term frequency statistics of a set of paragraphs so that the whole set can be perceived as one paragraph.
 
 
@@ -66,6 +92,9 @@ If this is one-to-one alignment - call align_sentences method.
 paragraph_function(last, next):Function used in euclidean.closest for paragraph alignment
 
 
+paragraph_batch_function(last, next0, next1, pars): vectorized version of paragraph_function. Used in euclidean.closest
+
+
 align_paragraphs(int a0, int a1): aligns paragraphs using the Vicinity-Driven Paragraph Alignment algorithm.
 
 
@@ -81,8 +110,12 @@ set_up(a0, a1): get the text of the two articles and set up all the arrays and
 lists that will be needed later during the alignment.
 
 
+set_up_levels(features, lo, hi): same as set_up, but takes the arrays that describe the articles from a SlugFeatures
+object, which processes every level of a slug only once
+
+
 write_result(slug, loLevel, hiLevel, allParagraphs): print the results of the alignment
-to the files in the output directory
+to the files in the output directory or to the binary store (see OUTPUT_FORMAT)
 
 
 def extract_results(): converts the results of the paragraphs' alignment from the matrix to a list
@@ -100,16 +133,40 @@ about the articles and process n slugs by comparing the levels as specified in t
 
 align_particular(slugs, levels = [(0, 1, 2), (1, 2, 2), (2, 3, 2), (3, 4, 2), (4, 5, 2)]):  Does the same as
 align_first_n but only for specified slugs
+
+
+align_slugs(groups, levels, workers=1): align the given slugs either one after another or in a pool of worker processes.
+Skip the pairs of articles that have not changed since they were aligned last time
+
+
+load_manifest(filename): load the manifest, which tells from which files and with which parameters every pair of
+articles was aligned
+
+
+base_similarities(slug, features, comp): calculate the similarities between all the sentences of two articles before
+any paragraphs are merged, or take them from the store (see SIMILARITY_STORE)
+
+
+prepare_replay(slugs, levels): calculate the similarities between all the sentences of every pair of articles once,
+so that the alignment can be repeated with different values of ALPHA, ALPHA2 and BETHA (see PairSimilarities)
+
+
+replay(pairs): align the pairs of articles prepared by prepare_replay with the current values of the constants and
+return the results instead of writing them
 """
 
 from newselautil import *  # the utils used for processing newsela articles.
 import classpaths as path  # info about where various source files are stored on this computer
 import euclidean as eu  # the tool for iterating over increasing euclidean distance
+import store  # the binary store of the results of the alignment
 import alignutils as autils
 import math
 import numpy
-import copy
+import multiprocessing
+import traceback
 import sys
+import os
+import hashlib
 is_py2 = sys.version[0] == '2'
 if is_py2:
     import Queue as queue
@@ -122,9 +179,9 @@ USE_CONCENTRATION = True  # if USE_CONCENTRATION = True, the algorithm will alig
 CONCENTRATION_MODIFIER = 2  # a constant used in calculate_cosine_similarity, if USE_CONCENTRATION is True.
 # Specifically, it should be equal to that value of teh coefficient of variation that is small enough for the alignment
 # to be made
-ALREADY_ALIGNED = -2  # a negative value distinct from -1 that will be assigned to any pair of sentences (an entry)
-# in sentSim if one of the sentences in this pair was already aligned. This is needed to skip these pairs when the
-# algorithm is called for the second time on the same articles.
+ALREADY_ALIGNED = -2  # a negative value distinct from -1 that is returned as the similarity of any pair of sentences
+# if one of the sentences in this pair was already aligned (see alignedSent). This is needed to skip these pairs when
+# the algorithm is called for the second time on the same articles.
 MAXIMUM_PARAGRAPHS = 50  # the maximum number of paragraphs in one article. Needed for creating the array of coordinates
 # sorted by euclidean distance. If this value is too small, the program will readjust it, but it is preferable that
 # this value is big enough in the beginning.
@@ -137,8 +194,17 @@ ALPHA2 = 0.38  # same for sentences. This constant is also called alpha in the p
 # chart). However, it makes sense to separate these two constants (the fmeaseure is higher this way).
 BETHA = 0  # slack value for the 1-N/N-1 sentence alignment. This constant is called betha in the paper
 # (Algorithm 2:Sentence Alignment chart).
-MAX_WORDS = 10000  # Supposed maximum number of distinct words in the two articles. If this constant is not big enough
-# the program will crash
+BATCHED_SIMILARITY = True  # if True, the similarities between all the sentences of two paragraphs are calculated at
+# once by calculate_block_similarity. Otherwise, calculate_cosine_similarity is called for every pair of sentences. The
+# results of the alignment are the same in both cases
+SKIP_UNCHANGED = True  # if True, align_slugs does not align again the pairs of articles that were aligned before from
+# the same .tok files and with the same parameters (see load_manifest). Should be set to False if the algorithm itself
+# was changed
+OUTPUT_FORMAT = 'csv'  # 'csv' - write_result writes two text files for every pair of articles to OUTDIR_SENTENCES and
+# OUTDIR_PARAGRAPHS. 'store' - the results are appended to the binary store in OUTDIR_STORE (see store.py)
+SIMILARITY_STORE = False  # if True, the similarities between all the sentences of every pair of articles are written
+# to OUTDIR_SIMILARITIES (see store.py) once, and the later alignments of the same pair of articles (and prepare_replay)
+# take them from there instead of calculating them again (see base_similarities)
 sInd = None  # A tuple of two elements. 0-th element is an array, where for every paragraph in the first article,
 # the number of sentences that occurred in a document before the beginning of this paragraph is given. 1-st element -
 # the same for the second article.
@@ -160,13 +226,38 @@ v = None  # For every article, for every paragraph in the article and for every
 # related to distinct words.
 wordsTotal = None  # the total number of words in every paragraph. wordsTotal[0] stores the info about the first article
 # , wordsTotal[1] - about the second
+tfIdfCache = None  # A tuple of two dictionaries, one for each article. The keys are the tuples of indexes of the
+# paragraphs, and the values are the TF-IDF vectors for the sentences of these paragraphs (see paragraph_tf_idf). The
+# dictionaries belong to SlugFeatures, so the vectors built for an article are reused when it is aligned with another one
+alignedSent = None  # A tuple of two boolean arrays. For every sentence in the first (0-th element) and the second
+# (1-st element) article, True is stored if this sentence was already aligned. The similarities that involve such
+# sentences are ignored, but are kept in sentSim, so that marking a sentence costs O(1) and nothing has to be
+# recalculated if the sentence is needed again
 parFreq = None  # for every paragraph in each article the number of times each word appears in the paragraph is stored.
+# Only the words that do appear in the paragraph are stored: for every paragraph, there is an array of tuples, where the
+# first value is the index related to the word, and the second one - the number of times it appears. The entries are
+# sorted by the indexes related to the words, so that the frequency of a word can be found by binary search (see
+# word_frequency)
 parResultMatrix = None  # the matrix that represents paragraph alignments. If the two paragraphs are aligned, the entry
 # will be True, otherwise - False
 parResult = None  # the list of paragraph alignments made. Every i-th element of the list is a tuple of two elements.
 # The 0th element is the list of indexes of the paragraphs from the first article that are part of the i-th alignment. 
 # The 1-st element is the list of indexes of the paragraphs from the second article that are part of the i-th alignment.
 result = None  # the same for sentences. A sentence index is given as a tuple (par_index,sentence_in_par_index).
+blockSim = None  # if BATCHED_SIMILARITY is True, the similarities between all the sentences given to align_sentences
+# (sent0 x sent1) that were missing in sentSim when it was called, calculated at once. A similarity is only moved to
+# sentSim when the scalar algorithm would have calculated it, so that the later passes of the algorithm find the same
+# entries of sentSim (calculated from the vectors of the merged paragraphs) in both cases. None outside align_sentences
+SLUGS_PER_CHUNK = 4  # the number of slugs a worker process of align_slugs receives at once
+_WORKER_SETTINGS = ['USE_CONCENTRATION', 'CONCENTRATION_MODIFIER', 'MAXIMUM_PARAGRAPHS', 'VICINITIES',
+                    'SENTENCE_VICINITIES', 'ALPHA', 'ALPHA2', 'BETHA', 'BATCHED_SIMILARITY', 'OUTPUT_FORMAT',
+                    'SIMILARITY_STORE']
+# the constants that the worker processes of align_slugs take from the process that created them
+_WORKER_PATHS = ['BASEDIR', 'OUTDIR_SENTENCES', 'OUTDIR_PARAGRAPHS', 'OUTDIR_EUCLIDEAN', 'OUTDIR_STORE',
+                 'OUTDIR_SIMILARITIES']  # same for the variables from classpaths
+_storeWriter = None  # the store.AlignmentWriter used by this process if OUTPUT_FORMAT = 'store'
+_similarityWriter = None  # the store.SimilarityWriter used by this process if SIMILARITY_STORE = True
+_similarityStore = None  # the store.SimilarityStore read by this process if SIMILARITY_STORE = True
 
 
 def absp(par, sent, inFirstArticle):
@@ -286,6 +377,182 @@ def calculate_cosine_similarity(v0, v1):
     return dotProduct / float(math.sqrt((lenLCommon + lenLDistinct) * lenS))
 
 
+def _block_statistics(vectors, columns, width):
+    """
+    Convert a list of TF-IDF vectors (see calculate_cosine_similarity) into the dense matrices needed by
+    calculate_block_similarity
+    :param vectors: the list of TF-IDF vectors
+    :param columns: for every entry of every vector (in the order they appear in the concatenation of vectors), the
+    index of the column that corresponds to the word of this entry
+    :param width:   the overall number of columns
+    :return: lengths - the number of entries in every vector, sentOfEntry - the index of the vector every entry belongs
+    to, tfIdf - the matrix (sentence x column) of the summed TF-IDF values, present - the same matrix with 1 wherever
+    the word occurs in the sentence
+    """
+    lengths = numpy.array([len(vector) for vector in vectors], dtype=numpy.int64)
+    sentOfEntry = numpy.repeat(numpy.arange(len(vectors)), lengths)
+    tfIdf = numpy.zeros((len(vectors), width), numpy.float16)  # the values are added up one after another in float16,
+    # as calculate_cosine_similarity does
+    numpy.add.at(tfIdf, (sentOfEntry, columns), numpy.concatenate(vectors)['freq'])
+    present = numpy.zeros((len(vectors), width))
+    present[sentOfEntry, columns] = 1
+    return lengths, sentOfEntry, tfIdf, present
+
+
+def _concentration(sentOfEntry, nSentences, positions, entryCommon):
+    """
+    Calculate, for every pair of sentences, the number of entries in the first sentence whose words also occur in the
+    second one and the coefficient of variation of their positions (see calculate_cosine_similarity)
+    :param sentOfEntry: the index of the sentence every entry belongs to
+    :param nSentences:  the number of sentences in the first set
+    :param positions:   the positions of the entries within their sentences
+    :param entryCommon: the matrix (entry x sentence from the other set) with 1 wherever the word of the entry occurs
+    in the sentence from the other set
+    :return: the counts and the coefficients of variation as two matrices (sentence x sentence from the other set)
+    """
+    members = numpy.zeros((nSentences, len(sentOfEntry)))
+    members[sentOfEntry, numpy.arange(len(sentOfEntry))] = 1
+    count = numpy.dot(members, entryCommon)
+    divisor = numpy.maximum(count, 1)  # the pairs without common words are never used, but should not produce NaN
+    average = numpy.dot(members, positions[:, None] * entryCommon) / divisor  # the sums of integers are exact
+    lengths = numpy.bincount(sentOfEntry, minlength=nSentences)
+    entryInSentence = numpy.arange(len(sentOfEntry)) - (numpy.cumsum(lengths) - lengths)[sentOfEntry]
+    padded = numpy.zeros((nSentences, max(lengths.max(), 1), entryCommon.shape[1]))  # the entries of every sentence
+    # followed by zeros, so that cumsum adds them up one after another, as calculate_cosine_similarity does
+    padded[sentOfEntry, entryInSentence] = numpy.fabs(positions[:, None] - average[sentOfEntry]) * entryCommon
+    deviation = numpy.cumsum(padded, axis=1)[:, -1]
+    return count, deviation / divisor * 2 / divisor
+
+
+def _add_up(pairs, terms, shape):
+    """
+    :param pairs:   the flat index (row * shape[1] + column) of the pair of sentences every term belongs to
+    :param terms:   the terms to add up. The terms of every pair are added up one after another in the given order
+    :param shape:   the shape of the result
+    :return:        the matrix of the sums (float64)
+    """
+    return numpy.bincount(pairs, terms.astype(numpy.float64), shape[0] * shape[1]).reshape(shape)
+
+
+def calculate_block_similarity(vectors0, vectors1):
+    """
+    Calculate the cosine similarities between every sentence given by vectors0 and every sentence given by vectors1 at
+    once. The result is exactly the same as if calculate_cosine_similarity was called for every pair of sentences,
+    including the coefficient of variation if USE_CONCENTRATION is True: the TF-IDF values of a word and their products
+    are rounded to float16 and the sums are accumulated word after word in the same order. Instead of merging the
+    vectors pair by pair, every word that occurs in the two sets of sentences is assigned a column of a dense matrix,
+    and the terms of all the pairs of sentences are added up at once.
+    :param vectors0: the list of TF-IDF vectors (see build_tf_idf) for the sentences from the first article
+    :param vectors1: same for the second article
+    :return: the matrix of similarities of the size len(vectors0) x len(vectors1)
+    """
+    if (len(vectors0) == 0) or (len(vectors1) == 0):
+        return numpy.zeros((len(vectors0), len(vectors1)))
+    entries0 = numpy.concatenate(vectors0)
+    entries1 = numpy.concatenate(vectors1)
+    words, columns = numpy.unique(numpy.concatenate((entries0['ind'], entries1['ind'])), return_inverse=True)
+    if len(words) == 0:
+        return numpy.zeros((len(vectors0), len(vectors1)))
+    columns0 = columns.ravel()[:len(entries0)]
+    columns1 = columns.ravel()[len(entries0):]
+    lengths0, sentOfEntry0, tfIdf0, present0 = _block_statistics(vectors0, columns0, len(words))
+    lengths1, sentOfEntry1, tfIdf1, present1 = _block_statistics(vectors1, columns1, len(words))
+
+    squared0 = (tfIdf0 * tfIdf0).astype(numpy.float64)  # rounded to float16 before they are added up
+    squared1 = (tfIdf1 * tfIdf1).astype(numpy.float64)
+    shape = (len(vectors0), len(vectors1))
+    words0, rows0 = numpy.nonzero(present0.T)  # the (word, sentence) pairs of the first set, ordered by the word
+    words1, rows1 = numpy.nonzero(present1.T)
+    perWord0 = numpy.bincount(words0, minlength=len(words))
+    perWord1 = numpy.bincount(words1, minlength=len(words))
+    pairs = perWord0 * perWord1  # the number of pairs of sentences every word is common to
+    word = numpy.repeat(numpy.arange(len(words)), pairs)  # every common word of every pair of sentences. The words
+    # are in ascending order, and numpy.bincount adds the weights up in the order they are given, so the terms of
+    # every pair are added up in the same order as in calculate_cosine_similarity
+    offset = numpy.arange(len(word)) - numpy.repeat(numpy.cumsum(pairs) - pairs, pairs)
+    row = rows0[(numpy.cumsum(perWord0) - perWord0)[word] + offset // numpy.maximum(perWord1, 1)[word]]
+    col = rows1[(numpy.cumsum(perWord1) - perWord1)[word] + offset % numpy.maximum(perWord1, 1)[word]]
+    pair = row * shape[1] + col
+    dotProduct = _add_up(pair, tfIdf0[row, word] * tfIdf1[col, word], shape)  # the products are rounded to float16
+    common0 = _add_up(pair, squared0[row, word], shape)  # lenLCommon if the first sentence is the longer one
+    common1 = _add_up(pair, squared1[col, word], shape)  # same if the second one is longer
+    row, col = numpy.repeat(rows0, shape[1]), numpy.tile(numpy.arange(shape[1]), len(rows0))
+    word = numpy.repeat(words0, shape[1])
+    only = present1[col, word] == 0  # the words of the first sentence that do not occur in the second one
+    distinct0 = _add_up(row[only] * shape[1] + col[only], squared0[row[only], word[only]], shape)  # same for
+    # lenLDistinct
+    row, col = numpy.tile(numpy.arange(shape[0]), len(rows1)), numpy.repeat(rows1, shape[0])
+    word = numpy.repeat(words1, shape[0])
+    only = present0[row, word] == 0
+    distinct1 = _add_up(row[only] * shape[1] + col[only], squared1[col[only], word[only]], shape)
+    longerIsFirst = lengths0[:, None] >= lengths1[None, :]  # calculate_cosine_similarity considers the first vector
+    # to be the longer one if the lengths are equal
+    lenLCommon = numpy.where(longerIsFirst, common0, common1)
+    lenL = lenLCommon + numpy.where(longerIsFirst, distinct0, distinct1)
+    lenS = numpy.where(longerIsFirst, numpy.cumsum(squared1, axis=1)[:, -1][None, :],
+                       numpy.cumsum(squared0, axis=1)[:, -1][:, None])  # cumsum adds the terms up one after another
+    common = lenLCommon > 0
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        similarity = numpy.where(common, dotProduct / numpy.sqrt(lenL * lenS), 0)
+        longer = numpy.maximum(lengths0[:, None], lengths1[None, :])
+        shorter = numpy.minimum(lengths0[:, None], lengths1[None, :])
+        if USE_CONCENTRATION and (common & (shorter < longer / 2.0)).any():
+            count0, variation0 = _concentration(sentOfEntry0, len(vectors0), entries0['pos'].astype(numpy.float64),
+                                                present1[:, columns0].T)
+            count1, variation1 = _concentration(sentOfEntry1, len(vectors1), entries1['pos'].astype(numpy.float64),
+                                                present0[:, columns1].T)
+            count = numpy.where(longerIsFirst, count0, count1.T)  # the positions are taken from the longer sentence
+            variation = numpy.where(longerIsFirst, variation0, variation1.T)
+            concentrated = common & (shorter < longer / 2.0) & (count > 2)
+            similarity = numpy.where(concentrated, dotProduct / numpy.sqrt(lenLCommon * lenS) / variation /
+                                     CONCENTRATION_MODIFIER, similarity)
+    return similarity
+
+
+def fill_block_similarity(sent0, sent1, v0, v1):
+    """
+    Calculate all the entries of sentSim that represent the similarities between the given sentences and were not
+    calculated previously (see missing_block_similarity).
+    :param sent0: the array of absolute coordinates of sentences in the first article
+    :param sent1: the array of absolute coordinates of sentences in the second article
+    :param v0:    the array of TF-IDF vectors for the sentences given by sent0
+    :param v1:    same for the second article
+    :return:      None
+    """
+    global sentSim
+    block = missing_block_similarity(sent0, sent1, v0, v1)
+    if block is not None:
+        sentSim[numpy.ix_(sent0, sent1)] = block
+
+
+def missing_block_similarity(sent0, sent1, v0, v1):
+    """
+    Calculate the similarities between the given sentences that are missing in sentSim and are still needed (neither of
+    the sentences is aligned). The similarities are calculated at once by calculate_block_similarity, and only for the
+    sentences that have at least one such entry. sentSim is not changed
+    :param sent0: the array of absolute coordinates of sentences in the first article
+    :param sent1: the array of absolute coordinates of sentences in the second article
+    :param v0:    the array of TF-IDF vectors for the sentences given by sent0
+    :param v1:    same for the second article
+    :return:      the block of sentSim (len(sent0) x len(sent1)) with the missing entries filled in, or None if no
+    entries are missing. The entries that are not needed are left as -1
+    """
+    rows, columns = numpy.ix_(sent0, sent1)
+    block = sentSim[rows, columns]
+    missing = (block < 0) & ~alignedSent[0][rows] & ~alignedSent[1][columns]  # the entries that were not calculated
+    # yet and are still needed
+    if not missing.any():
+        return None
+    needed0 = numpy.nonzero(missing.any(axis=1))[0]
+    needed1 = numpy.nonzero(missing.any(axis=0))[0]
+    similarity = calculate_block_similarity([v0[i] for i in needed0], [v1[j] for j in needed1])
+    subBlock = block[numpy.ix_(needed0, needed1)]
+    subMissing = missing[numpy.ix_(needed0, needed1)]
+    subBlock[subMissing] = similarity[subMissing]
+    block[numpy.ix_(needed0, needed1)] = subBlock
+    return block
+
+
 def rel_sent_sim(p0, s0, p1, s1, v0, v1):
     """
     Calculate the cosine similarity between two given sentences, if it was not calculated previously.
@@ -299,7 +566,9 @@ def rel_sent_sim(p0, s0, p1, s1, v0, v1):
     :return: the cosine similarity between the two sentences specified
     """
     global sentSim
-    if (sentSim[absp(p0, s0, True)][absp(p1, s1, False)] < 0)and(sentSim[absp(p0, s0, True)][absp(p1, s1, False)] !=ALREADY_ALIGNED):
+    if alignedSent[0][absp(p0, s0, True)] or alignedSent[1][absp(p1, s1, False)]:
+        return ALREADY_ALIGNED
+    if sentSim[absp(p0, s0, True)][absp(p1, s1, False)] < 0:
         # if the sentence similarity was not yet calculated.
         sentSim[absp(p0, s0, True)][absp(p1, s1, False)] = calculate_cosine_similarity(v0, v1)
     return sentSim[absp(p0, s0, True)][absp(p1, s1, False)]
@@ -320,8 +589,13 @@ def abs_sent_sim(sent0, sent1, v0, v1, ind0, ind1):
     """
     global sentSim
     # ind0 and ind1 are used, to reduce the overload of indexes in align_sentences and create_sentence_alignment methods
-    if (sentSim[sent0[ind0]][sent1[ind1]] < 0)and(sentSim[sent0[ind0]][sent1[ind1]] != ALREADY_ALIGNED):  # if the sentence similarity has not yet been calculated.
-        sentSim[sent0[ind0]][sent1[ind1]] = calculate_cosine_similarity(v0[ind0], v1[ind1])
+    if alignedSent[0][sent0[ind0]] or alignedSent[1][sent1[ind1]]:
+        return ALREADY_ALIGNED
+    if sentSim[sent0[ind0]][sent1[ind1]] < 0:  # if the sentence similarity has not yet been calculated.
+        if (blockSim is not None) and (blockSim[ind0][ind1] >= 0):  # it was calculated by align_sentences beforehand
+            sentSim[sent0[ind0]][sent1[ind1]] = blockSim[ind0][ind1]
+        else:
+            sentSim[sent0[ind0]][sent1[ind1]] = calculate_cosine_similarity(v0[ind0], v1[ind1])
     return sentSim[sent0[ind0]][sent1[ind1]]
 
 
@@ -350,24 +624,61 @@ def build_tf_idf(rawVectors, parFq, totalW):
     related to the word, the second one - the position of this word within the sentence. If the word appears more than
     once in the same sentence it occupies more than one entry, so that the position of the word within the sentence
     might be stored. Nevertheless, the TF will be calculated correctly in cosine_similarity.
-    :param parFq:       for every word in the text stores the number of times this word appears in this paragraph(s)
+    :param parFq:       for every word in this paragraph(s) stores the number of times this word appears there (see
+    parFreq)
     :param totalW:      total number of words in this paragraph
     :return:            TF_IDF vectors
     """
-    i = 0
-    newVector = []
-    while i < len(rawVectors):
-        newVector.append(numpy.ndarray(len(rawVectors[i]), dtype=[('ind', numpy.uint16), ('freq', numpy.float16),
-                                                                  ('pos', numpy.uint16)]))
-        j = 0
-        while j < len(rawVectors[i]):
-            newVector[i][j][0] = rawVectors[i][j][0]  # the word index remains the same
-            newVector[i][j][2] = rawVectors[i][j][1]
-            newVector[i][j][1] = math.log((totalW+1) / float(parFq[rawVectors[i][j][0]]))
-            #  +1 is necessary so that the logarithm will never be zero
-            j += 1
-        i += 1
-    return newVector
+    if len(rawVectors) == 0:
+        return []
+    lengths = numpy.array([len(vector) for vector in rawVectors], dtype=numpy.int64)
+    newVector = numpy.ndarray(lengths.sum(), dtype=[('ind', numpy.uint32), ('freq', numpy.float16),
+                                                    ('pos', numpy.uint16)])  # all vectors at once
+    if len(newVector) > 0:
+        entries = numpy.concatenate(rawVectors)
+        newVector['ind'] = entries['ind']  # the word index remains the same
+        newVector['pos'] = entries['pos']
+        newVector['freq'] = numpy.log((totalW + 1) / word_frequency(parFq, entries['ind']).astype(numpy.float64))
+        #  +1 is necessary so that the logarithm will never be zero
+    return numpy.split(newVector, numpy.cumsum(lengths)[:-1])
+
+
+def paragraph_tf_idf(article, pars):
+    """
+    Return the TF-IDF vectors for the sentences of the given paragraph(s). If more than one paragraph is given, the
+    paragraphs are conceptually concatenated, i.e. their frequency statistics is merged (see add_freq). The vectors are
+    only built once for every group of paragraphs and are then kept in tfIdfCache.
+    :param article: 0 if the paragraphs are from the first article, 1 if they are from the second one
+    :param pars:    the list of indexes of the paragraphs
+    :return:        the list of TF-IDF vectors for all the sentences of these paragraphs (see build_tf_idf)
+    """
+    key = tuple(pars)
+    if key not in tfIdfCache[article]:
+        if len(pars) == 1:
+            tfIdfCache[article][key] = build_tf_idf(v[article][pars[0]], parFreq[article][pars[0]],
+                                                    wordsTotal[article][pars[0]])
+        else:
+            totalW = 0
+            for par in pars:
+                totalW += wordsTotal[article][par]
+            tfIdfCache[article][key] = build_tf_idf(merge_lists(pars, v[article]), add_freq(pars, parFreq[article]),
+                                                    totalW)
+    return tfIdfCache[article][key]
+
+
+def invalidate_tf_idf(article, pars):
+    """
+    Forget the TF-IDF vectors built for the groups of paragraphs that were merged with some other paragraphs since and
+    now overlap with the given group. The vectors for single paragraphs are never forgotten, because they do not depend
+    on the way the paragraphs are merged.
+    :param article: 0 if the paragraphs are from the first article, 1 if they are from the second one
+    :param pars:    the list of indexes of the paragraphs that were just merged
+    :return:        None
+    """
+    key = tuple(pars)
+    for group in list(tfIdfCache[article].keys()):
+        if (len(group) > 1) and (group != key) and not set(group).isdisjoint(key):
+            del tfIdfCache[article][group]
 
 
 def paragraph_similarity(ind0, ind1):
@@ -379,7 +690,20 @@ def paragraph_similarity(ind0, ind1):
     :param ind1: the position of the second paragraph within the second article
     :return: the similarity between them [0,1]
     """
-    if parSim[ind0][ind1] < 0:  # if the paragraph similarity was not yet calculated
+    if (parSim[ind0][ind1] < 0) and BATCHED_SIMILARITY:  # all the sentence similarities are calculated at once
+        block = sentSim[sInd[0][ind0]:sInd[0][ind0 + 1], sInd[1][ind1]:sInd[1][ind1 + 1]]
+        needed = ~alignedSent[0][sInd[0][ind0]:sInd[0][ind0 + 1], None] & \
+            ~alignedSent[1][None, sInd[1][ind1]:sInd[1][ind1 + 1]]  # the similarities between unaligned sentences
+        if ((block < 0) & needed).any():  # if some of the similarities were never calculated
+            vectors = (paragraph_tf_idf(0, [ind0]), paragraph_tf_idf(1, [ind1]))
+            fill_block_similarity(pars_to_sents([ind0], sInd[0]), pars_to_sents([ind1], sInd[1]), vectors[0],
+                                  vectors[1])
+        candidates = block[needed]
+        if (len(candidates) > 0) and (candidates.max() > 0):
+            parSim[ind0][ind1] = candidates.max()
+        else:
+            parSim[ind0][ind1] = 0
+    elif parSim[ind0][ind1] < 0:  # if the paragraph similarity was not yet calculated
         TF_IDF_built = False # true if TF_IDF for these paragraphs was already built. If the algorithm is called for
         # the second or the third time, it might be that building TF_IDF will not be needed.
         max = 0  # the maximum cosine similarity found
@@ -387,11 +711,10 @@ def paragraph_similarity(ind0, ind1):
         while i < len(v[0][ind0]):
             j = 0
             while j < len(v[1][ind1]):
-                if sentSim[absp(ind0, i, True)][absp(ind1, j, False)] != ALREADY_ALIGNED:
+                if not (alignedSent[0][absp(ind0, i, True)] or alignedSent[1][absp(ind1, j, False)]):
                     if not TF_IDF_built: # if the similarity between these two sentences was never calculated
-                        vectors = (build_tf_idf(v[0][ind0], parFreq[0][ind0], wordsTotal[0][ind0]),
-                                   build_tf_idf(v[1][ind1], parFreq[1][ind1], wordsTotal[1][ind1]))  # creating TF-IDF
-                        # vectors for this particular set of sentences in these particular paragraphs
+                        vectors = (paragraph_tf_idf(0, [ind0]), paragraph_tf_idf(1, [ind1]))  # TF-IDF vectors
+                        # for this particular set of sentences in these particular paragraphs
                         TF_IDF_built = True
                     if rel_sent_sim(ind0, i, ind1, j, vectors[0][i], vectors[1][j]) > max:
                             max = rel_sent_sim(ind0, i, ind1, j, vectors[0][i], vectors[1][j])
@@ -428,12 +751,9 @@ def create_sentence_alignment(start, next, aligned, v0, v1, sent0, sent1):
         result.append(lst)
 
         for i in range(len(aligned)):
-            for s1 in range(len(sentSim[aligned[i][0]])):
-                sentSim[aligned[i][0]][s1] = ALREADY_ALIGNED  # this is needed to speed up the algorithm, when it is
-                # called for the second (third) time. The algorithm will ignore all previously aligned sentences
-        for s0 in range(len(sentSim)):
-            for j in range(len(aligned)):
-                sentSim[s0][aligned[j][1]] = ALREADY_ALIGNED
+            alignedSent[0][aligned[i][0]] = True  # this is needed to speed up the algorithm, when it is called for the
+            # second (third) time. The algorithm will ignore all previously aligned sentences
+            alignedSent[1][aligned[i][1]] = True
 
         del aligned[:]
         aligned.append((sent0[start[0] + next[0]], sent1[start[1] + next[1]]))
@@ -474,6 +794,36 @@ def sentence_function(last, next, pars):
     return abs_sent_sim(pars[0], pars[1], pars[2], pars[3], last[0] + next[0], last[1] + next[1]) > ALPHA2
 
 
+def sentence_batch_function(last, next0, next1, pars):
+    """
+    Vectorized version of sentence_function used in euclidean.closest. Evaluates many candidate alignments at once.
+    The similarities missing in sentSim are taken from blockSim, but they are only moved to sentSim for the alignments
+    up to the first one that is good enough, i.e. for the same alignments for which sentence_function would have been
+    called
+    :param last:  the coordinates of the previous alignemnt made
+    :param next0: the array of the first coordinates of the considered alignments relative to the last one
+    :param next1: the array of the second coordinates
+    :param pars:  extra parameters given as a list. Include sent0,sent1,v0 and v1 from the align_sentences method
+    :return:      the array of booleans, that shows for every alignment whether the cosine similarity between the
+    sentences is greater than ALPHA2. Only the first True value is meaningful
+    """
+    ind0 = last[0] + next0.astype(numpy.int64)
+    ind1 = last[1] + next1.astype(numpy.int64)
+    rows = pars[0][ind0]
+    columns = pars[1][ind1]
+    similarity = sentSim[rows, columns]
+    aligned = alignedSent[0][rows] | alignedSent[1][columns]
+    new = numpy.nonzero((similarity < 0) & ~aligned)[0]  # the similarities that were not calculated yet
+    similarity[new] = blockSim[ind0[new], ind1[new]]
+    similarity[aligned] = ALREADY_ALIGNED
+    good = similarity.astype(numpy.float64) > ALPHA2  # compared in float64 as the scalar similarities are, otherwise
+    # numpy rounds ALPHA2 to float16
+    found = numpy.nonzero(good)[0]
+    new = new[new <= (found[0] if len(found) > 0 else len(similarity) - 1)]
+    sentSim[rows[new], columns[new]] = similarity[new]
+    return good
+
+
 def align_sentences(sent0, sent1,v0,v1):
     """
     Takes an array with sentence indexes as input and uses (paper: Algorithm2:Sentence Alignment) algorithm to find the
@@ -491,9 +841,18 @@ def align_sentences(sent0, sent1,v0,v1):
     eu.calculate(len(sent0), len(sent1), VICINITIES, SENTENCE_VICINITIES) # this line is added to make sure that the
     # array in euclidean is long enough to iterate over sentences in this particular case. The array in euclidean
     # should be long enough and this line should not result in any further calculations
-    start = eu.closest((0, 0), 0, len(sent0), len(sent1), sentence_function, [sent0, sent1,v0,v1]) # the first pair of
-    # sentences that has the similarity between them great enough
+    global blockSim
+    batchFunction = None
+    if BATCHED_SIMILARITY:  # the similarities that are missing in sentSim (e.g. after the paragraphs are merged) are
+        # calculated at once, but are only moved to sentSim when they are used (see blockSim)
+        blockSim = missing_block_similarity(sent0, sent1, v0, v1)
+        if blockSim is None:  # sentSim already has all the needed similarities
+            blockSim = numpy.full((len(sent0), len(sent1)), -1, numpy.float16)
+        batchFunction = sentence_batch_function  # all the similarities are known, so they can be checked at once
+    start = eu.closest((0, 0), 0, len(sent0), len(sent1), sentence_function, [sent0, sent1,v0,v1], batchFunction)
+    # the first pair of sentences that has the similarity between them great enough
     if start is None:
+        blockSim = None
         return
     aligned = [(sent0[start[0]], sent1[start[1]])] # this will be the current blocks of alignments. A block of
     # alignments is a set of alignments that share sentences. An alignment is a tuple of indexes. Hence, aligned is
@@ -514,13 +873,15 @@ def align_sentences(sent0, sent1,v0,v1):
                 break
         if not alignmentMade:  # all vicinities are checked. From this point the algorithm searches for the nearest pair
             # of sentences such that the similarity between them is >ALPHA.
-            next = eu.closest(start, eu.sentStart, len(sent0), len(sent1), sentence_function, [sent0, sent1,v0,v1])
+            next = eu.closest(start, eu.sentStart, len(sent0), len(sent1), sentence_function, [sent0, sent1,v0,v1],
+                              batchFunction)
             if next is None:
                 break
             else:
                 start = create_sentence_alignment(start, next, aligned, v0, v1, sent0, sent1)
     create_sentence_alignment(start, (-1,-1), aligned, v0, v1, sent0, sent1) # an extra imaginary alignment
     # is added so that the last real one will be processed. This extra alignment is stored nowhere and is safe to make
+    blockSim = None
 
 
 def pars_to_sents(pars, sentInd):
@@ -555,33 +916,33 @@ def clean_sent_matrix(pars0, pars1):
     :return: None
     """
     for par0 in pars0:
-        i = sInd[0][par0]
-        while i < sInd[0][par0 + 1]:
-            for par1 in pars1:
-                j = sInd[1][par1]
-                while j < sInd[1][par1 + 1]:
-                    if sentSim[i][j] != ALREADY_ALIGNED:
-                        sentSim[i][j] = -1
-                    j += 1
-            i += 1
+        for par1 in pars1:
+            sentSim[sInd[0][par0]:sInd[0][par0 + 1], sInd[1][par1]:sInd[1][par1 + 1]] = -1
+
+
+def word_frequency(parFq, words):
+    """
+    Look up the number of times each of the given words appears in the paragraph(s)
+    :param parFq:   the frequencies of the words in the paragraph(s) (see parFreq)
+    :param words:   the array of indexes related to the words. All these words should appear in the paragraph(s)
+    :return:        the array of frequencies
+    """
+    return parFq['freq'][numpy.searchsorted(parFq['ind'], words)]
 
 
 def add_freq(indexes, originals):
     """
-    add together the entries at the same positions in the parFreq arrays. Conceptually, it merges the frequency statistics
-    of a set of paragraphs so that the whole set can be perceived as one paragraph.
+    add together the frequencies of the same words in the parFreq arrays. Conceptually, it merges the frequency
+    statistics of a set of paragraphs so that the whole set can be perceived as one paragraph.
     :param indexes: indexes of the arrays in originals to add
     :param originals: the actual arrays to add together
-    :return: the array of the sums of entries
+    :return: the array of the sums of frequencies in the same format as the arrays in parFreq
     """
-    destination=copy.deepcopy(originals[indexes[0]])
-    j = 1
-    while j < len(indexes):
-        i = 0
-        while i < len(destination):
-            destination[i] += originals[indexes[j]][i]
-            i += 1
-        j += 1
+    entries = numpy.concatenate([originals[index] for index in indexes])
+    words, position = numpy.unique(entries['ind'], return_inverse=True)
+    destination = numpy.ndarray(len(words), dtype=entries.dtype)
+    destination['ind'] = words
+    destination['freq'] = numpy.bincount(position.ravel(), weights=entries['freq'], minlength=len(words))
     return destination
 
 
@@ -624,18 +985,10 @@ def create_paragraph_alignment(last, next, pars0, pars1):
                 # concatenated and therefore, IDF changes. The conceptual concatenation of the paragraphs is suggested
                 # by the authors of the paper in the end of 3.Paragraph Alignment Algorithm section
                 clean_sent_matrix(pars0, pars1)
-                parFq = (add_freq(pars0, parFreq[0]), add_freq(pars1, parFreq[1]))
-                totalW = [0,0]
-                for par in pars0:
-                    totalW[0] += wordsTotal[0][par]
-                for par in pars1:
-                    totalW[1] += wordsTotal[1][par]
-                # parFq now contains the term frequency for the "concatenated" paragraphs
-                vectors = (build_tf_idf(merge_lists(pars0, v[0]), parFq[0],totalW[0]),
-                           build_tf_idf(merge_lists(pars1, v[1]), parFq[1], totalW[1]))  # creating TF-IDF vectors
-            else:  # if no concatenation is needed, the program proceeds straight to the creation of TF_IDF vectors
-                vectors = (build_tf_idf(v[0][pars0[0]], parFreq[0][pars0[0]], wordsTotal[0][pars0[0]]),
-                           build_tf_idf(v[1][pars1[0]], parFreq[1][pars1[0]], wordsTotal[1][pars1[0]]))
+                invalidate_tf_idf(0, pars0)
+                invalidate_tf_idf(1, pars1)
+            vectors = (paragraph_tf_idf(0, pars0), paragraph_tf_idf(1, pars1))  # TF-IDF vectors for the
+            # "concatenated" paragraphs
             align_sentences(pars_to_sents(pars0, sInd[0]), pars_to_sents(pars1, sInd[1]), vectors[0], vectors[1])
             # TF-IDF vectors are passed as argument to the align_sentences method
             del pars0[:]  # since here pars0 is only a reference, no initialization can be done with it, because it is
@@ -661,6 +1014,75 @@ def paragraph_function(last, next):
     return paragraph_similarity(last[0] + next[0], last[1] + next[1]) > ALPHA
 
 
+def paragraph_batch_function(last, next0, next1, pars):
+    """
+    Vectorized version of paragraph_function used in euclidean.closest. The similarities of the paragraphs that were not
+    calculated yet are calculated for all the candidate alignments at once from sentSim, but they are only kept in
+    parSim for the alignments up to the first one that is good enough, i.e. for the same alignments for which
+    paragraph_function would have been called
+    :param last:  the coordinates of the previous alignment made
+    :param next0: the array of the first coordinates of the considered alignments relative to the last one
+    :param next1: the array of the second coordinates
+    :param pars:  not used
+    :return:      the array of booleans, that shows for every alignment whether the similarity between the paragraphs is
+    greater than ALPHA. Only the first True value is meaningful
+    """
+    ind0 = last[0] + next0.astype(numpy.int64)
+    ind1 = last[1] + next1.astype(numpy.int64)
+    similarity = parSim[ind0, ind1].astype(numpy.float64)
+    new = numpy.nonzero(similarity < 0)[0]  # the similarities that were not calculated yet
+    if len(new) > 0:
+        similarity[new] = _paragraph_maxima(ind0[new], ind1[new])
+    first = len(similarity) - 1  # the first alignment that is good enough
+    for i in range(len(similarity)):
+        if numpy.isnan(similarity[i]):  # some of the sentence similarities are missing
+            similarity[i] = paragraph_similarity(ind0[i], ind1[i])
+        if similarity[i] > ALPHA:
+            first = i
+            break
+    new = new[new <= first]
+    parSim[ind0[new], ind1[new]] = similarity[new]
+    return similarity > ALPHA
+
+
+def _paragraph_maxima(ind0, ind1):
+    """
+    Calculate the similarities between the given pairs of paragraphs the same way as paragraph_similarity does, but
+    without calculating the missing similarities between the sentences and without changing parSim
+    :param ind0:    the array of the positions of the paragraphs in the first article
+    :param ind1:    the array of the positions of the paragraphs in the second article
+    :return:        the array of similarities. NaN is returned for the pairs of paragraphs, for which some of the needed
+    similarities between the sentences were not calculated yet
+    """
+    pars0, inverse0 = numpy.unique(ind0, return_inverse=True)
+    pars1, inverse1 = numpy.unique(ind1, return_inverse=True)
+    lengths0 = (sInd[0][pars0 + 1] - sInd[0][pars0]).astype(numpy.int64)
+    lengths1 = (sInd[1][pars1 + 1] - sInd[1][pars1]).astype(numpy.int64)
+    selected0 = numpy.zeros(len(sInd[0]) - 1, dtype=bool)
+    selected0[pars0] = True
+    selected1 = numpy.zeros(len(sInd[1]) - 1, dtype=bool)
+    selected1[pars1] = True
+    sent0 = numpy.nonzero(selected0[sCoor[0]])[0]  # the sentences of these paragraphs, paragraph after paragraph
+    sent1 = numpy.nonzero(selected1[sCoor[1]])[0]
+    maxima = numpy.zeros((len(pars0), len(pars1)))
+    missing = numpy.zeros((len(pars0), len(pars1)), dtype=bool)
+    full0 = numpy.nonzero(lengths0 > 0)[0]  # the paragraphs without sentences have the similarity of 0
+    full1 = numpy.nonzero(lengths1 > 0)[0]
+    if (len(full0) > 0) and (len(full1) > 0):
+        block = sentSim[numpy.ix_(sent0, sent1)].astype(numpy.float64)
+        needed = ~alignedSent[0][sent0][:, None] & ~alignedSent[1][sent1][None, :]
+        starts0 = (numpy.cumsum(lengths0) - lengths0)[full0]
+        starts1 = (numpy.cumsum(lengths1) - lengths1)[full1]
+        candidates = numpy.where(needed, block, -numpy.inf)
+        candidates = numpy.maximum.reduceat(numpy.maximum.reduceat(candidates, starts0, axis=0), starts1, axis=1)
+        maxima[numpy.ix_(full0, full1)] = numpy.maximum(candidates, 0)
+        unknown = (needed & (block < 0)).astype(numpy.int64)
+        unknown = numpy.add.reduceat(numpy.add.reduceat(unknown, starts0, axis=0), starts1, axis=1)
+        missing[numpy.ix_(full0, full1)] = unknown > 0
+    maxima[missing] = numpy.nan
+    return maxima[inverse0.ravel(), inverse1.ravel()]
+
+
 def align_paragraphs(a0, a1):
     """
     aligns paragraphs using the Vicinity-Driven Paragraph Alignment algorithm (Algorithm1: Paragraph Alignment Chart)
@@ -670,8 +1092,9 @@ def align_paragraphs(a0, a1):
     """
     eu.calculate(a0, a1, VICINITIES, SENTENCE_VICINITIES)  # check if the euclidean distance array is large
     # enough (it should be)
-    last = eu.closest((0,0), 0, a0, a1, paragraph_function)  # searching for the first alignment. Unlike the authors of
-    # the paper suggest, no assumption is made that the first paragraphs align
+    batchFunction = paragraph_batch_function if BATCHED_SIMILARITY else None
+    last = eu.closest((0,0), 0, a0, a1, paragraph_function, [], batchFunction)  # searching for the first alignment.
+    # Unlike the authors of the paper suggest, no assumption is made that the first paragraphs align
     if last is None:
         return
     pars0 = [last[0]]  # all the paragraphs from the first article aligned after last 1 to 1 alignment was made
@@ -694,7 +1117,7 @@ def align_paragraphs(a0, a1):
                 break
         if not alignmentMade:  # all vicinities are checked. From this point the algorithm searches for the nearest pair
             # of paragraphs such that the similarity between them is >ALPHA.
-            next = eu.closest(last, eu.parStart, a0, a1, paragraph_function)
+            next = eu.closest(last, eu.parStart, a0, a1, paragraph_function, [], batchFunction)
             if next is None:
                 break
             else:
@@ -723,7 +1146,7 @@ def fill_dictionary(dict, parFreq, wordsTotal, article, sentVectors, wordCount):
     for the sentences
     :param dict:        dictionary to fill the words in. Every entry in the dictionary is filled with a value specific
                         to the word. This value will be used elsewhere instead of the string itself.
-    :param parFreq:     array that is to be filled with term frequency for paragraphs
+    :param parFreq:     list that is to be filled with term frequency for paragraphs (see parFreq)
     :param wordsTotal:  total number distinct words in each paragraph (is calculated by this method)
     :param article:     the article to process, i.e. its text acquired via newselautils.getTokParagraphs
     :param sentVectors: array that is to be filled with term frequency for sentences
@@ -735,9 +1158,10 @@ def fill_dictionary(dict, parFreq, wordsTotal, article, sentVectors, wordCount):
         sentVectors.append([])
         parN += 1
         sentN = -1  # number of sentences processed in this paragraph
+        parWords = []  # the indexes related to all the words in the paragraph
         for sent in par:
             words = delete_stopwords(lemmatize(sent))
-            sentVectors[parN].append((numpy.ndarray(len(words), dtype=[('ind', numpy.uint16), ('pos', numpy.uint16)])))
+            sentVectors[parN].append((numpy.ndarray(len(words), dtype=[('ind', numpy.uint32), ('pos', numpy.uint16)])))
             # a "vector" consists of multiple tuples. The first value in a tuple stores the index related to the
             # word, the second one - the position of the word within the sentence. If the word occurs more than once
             # within the same sentence, it occupies more than one entry in the vector so that the positions could be
@@ -754,20 +1178,65 @@ def fill_dictionary(dict, parFreq, wordsTotal, article, sentVectors, wordCount):
                 wordN += 1
                 if word in dict:    # if the word was already added in the dictionary
                     tmp = dict[word]
-                    parFreq[parN][tmp] += 1
+                    parWords.append(tmp)
                     sentVectors[parN][sentN][wordN][0] = tmp
                 else:
                     dict[word] = wordCount
-                    parFreq[parN][wordCount] += 1
+                    parWords.append(wordCount)
                     sentVectors[parN][sentN][wordN][0] = wordCount
                     wordCount += 1
-                    if wordCount == MAX_WORDS:
-                        print("MAX_WORDS variable is too small. Increase MAX_WORDS so that there is no pair of "
-                              "articles in which there are more distinct words than MAX_WORDS")
             sentVectors[parN][sentN] = numpy.sort(sentVectors[parN][sentN], 0, order='ind')  # sorting the tf vector.
+        words, counts = numpy.unique(numpy.array(parWords, dtype=numpy.uint32), return_counts=True)
+        parFreq.append(numpy.ndarray(len(words), dtype=[('ind', numpy.uint32), ('freq', numpy.uint32)]))
+        parFreq[parN]['ind'] = words
+        parFreq[parN]['freq'] = counts
     return wordCount
 
 
+class SlugFeatures(object):
+
+    """
+    The information about the levels of one slug that does not depend on the pair of levels that are aligned: the
+    dictionary shared by all the levels, and for every level - parFreq, wordsTotal, v, sInd and sCoor (see the
+    description of the global variables with the same names). Every level is processed only once, when it is first
+    needed, and every pair of levels takes these arrays as they are (see set_up_levels).
+    """
+
+    def __init__(self, paragraphs):
+        """
+        :param paragraphs: the list of the tokenized articles with this slug (obtained from
+        newselautils.getTokParagraphs)
+        """
+        self.paragraphs = paragraphs
+        self.dictionary = {}  # word -> the index used elsewhere instead of the string itself. Shared by all levels
+        self.wordCount = 0  # the number of distinct words in the dictionary
+        self.parFreq = [None] * len(paragraphs)
+        self.wordsTotal = [None] * len(paragraphs)
+        self.v = [None] * len(paragraphs)
+        self.sInd = [None] * len(paragraphs)
+        self.sCoor = [None] * len(paragraphs)
+        self.tfIdf = [{} for article in paragraphs]  # see tfIdfCache
+
+    def level(self, level):
+        """
+        Process the article with the given level, unless it was processed before
+        :param level: the level of the article
+        :return: None
+        """
+        if self.v[level] is not None:
+            return
+        article = self.paragraphs[level]
+        self.parFreq[level] = []
+        self.wordsTotal[level] = numpy.zeros(len(article), numpy.uint32)
+        self.v[level] = []
+        self.wordCount = fill_dictionary(self.dictionary, self.parFreq[level], self.wordsTotal[level], article,
+                                         self.v[level], self.wordCount)
+        lengths = numpy.array([len(par) for par in article], dtype=numpy.int64)
+        self.sInd[level] = numpy.zeros(len(article) + 1, numpy.uint16)
+        self.sInd[level][1:] = numpy.cumsum(lengths)
+        self.sCoor[level] = numpy.repeat(numpy.arange(len(article)), lengths).astype(numpy.uint16)
+
+
 def set_up(a0, a1):
     """
     Get the text of the two articles and set up all the arrays and lists that will be needed later during the alignment.
@@ -779,62 +1248,41 @@ def set_up(a0, a1):
     :param a1:  the second article loaded via newselautils.getTokParagraphs
     :return:    None
     """
-    
-    global parFreq
-    parFreq = (numpy.ndarray((len(a0), MAX_WORDS), numpy.uint16), numpy.ndarray((len(a1), MAX_WORDS), numpy.uint16))
-    for par in parFreq[0]:
-        par.fill(0)  # zero, because no word appeared yet
-    for par in parFreq[1]:
-        par.fill(0)
+    set_up_levels(SlugFeatures([a0, a1]), 0, 1)
 
-    global wordsTotal
-    wordsTotal = (numpy.ndarray(len(a0), numpy.uint32), numpy.ndarray(len(a1), numpy.uint32))
-    wordsTotal[0].fill(0)
-    wordsTotal[1].fill(0)
 
+def set_up_levels(features, lo, hi):
+    """
+    Same as set_up, but the arrays that describe the articles are taken from features, so that an article that is
+    aligned with several other articles is only processed once
+    :param features:    the SlugFeatures of the slug
+    :param lo:          the level of the first article
+    :param hi:          the level of the second article
+    :return:            None
+    """
+    features.level(lo)
+    features.level(hi)
+    global parFreq
+    parFreq = (features.parFreq[lo], features.parFreq[hi])
+    global wordsTotal
+    wordsTotal = (features.wordsTotal[lo], features.wordsTotal[hi])
     global v
-    v = ([], [])
-    dict = {}  # the dictionary. Dictionary is only temporary and is not used anywhere else
-    wordCount = fill_dictionary(dict, parFreq[0], wordsTotal[0], a0, v[0], 0)
-    fill_dictionary(dict, parFreq[1], wordsTotal[1], a1, v[1], wordCount)
-
+    v = (features.v[lo], features.v[hi])
     global sInd
-    sInd= (numpy.ndarray(len(a0) + 1, numpy.uint16), numpy.ndarray(len(a1) + 1, numpy.uint16))
-    sInd[0][0] = 0
-    sInd[1][0] = 0
-    i = 1
-    while i < len(a0) + 1:
-        sInd[0][i] = len(a0[i - 1]) + sInd[0][i - 1]
-        i += 1
-    i = 1
-    while i < len(a1) + 1:
-        sInd[1][i] = len(a1[i - 1]) + sInd[1][i - 1]
-        i += 1
-
+    sInd = (features.sInd[lo], features.sInd[hi])
     global sCoor
-    sCoor = (numpy.ndarray(sInd[0][len(a0)], numpy.uint16), numpy.ndarray(sInd[1][len(a1)], numpy.uint16))
-    i=0
-    j=0
-    while i < len(sCoor[0]):
-        if i == sInd[0][j+1]:
-            j += 1
-        sCoor[0][i] = j
-        i += 1
-    i = 0
-    j = 0
-    while i < len(sCoor[1]):
-        if i == sInd[1][j + 1]:
-            j += 1
-        sCoor[1][i] = j
-        i += 1
+    sCoor = (features.sCoor[lo], features.sCoor[hi])
+    global tfIdfCache
+    tfIdfCache = (features.tfIdf[lo], features.tfIdf[hi])
 
     global parSim
-    parSim = numpy.ndarray((len(a0), len(a1)), numpy.float16)
+    parSim = numpy.ndarray((len(v[0]), len(v[1])), numpy.float16)
     parSim.fill(-1)
     global sentSim
-    sentSim = numpy.ndarray((sInd[0][len(a0) - 1] + len(a0[len(a0) - 1]),
-                            (sInd[1][len(a1) - 1] + len(a1[len(a1) - 1]))), numpy.float16)
+    sentSim = numpy.ndarray((sInd[0][-1], sInd[1][-1]), numpy.float16)
     sentSim.fill(-1)
+    global alignedSent
+    alignedSent = (numpy.zeros(sInd[0][-1], numpy.bool_), numpy.zeros(sInd[1][-1], numpy.bool_))
 
 
 def write_result(slug, loLevel, hiLevel, allparagraphs):
@@ -846,6 +1294,14 @@ def write_result(slug, loLevel, hiLevel, allparagraphs):
     :param allparagraphs:   the text of all articles with this slug loaded via newselautils.getTokParagraphs
     :return:                None
     """
+    if OUTPUT_FORMAT == 'store':
+        global _storeWriter
+        if (_storeWriter is None) or (_storeWriter.directory != path.OUTDIR_STORE) or \
+                (_storeWriter.pid != os.getpid()):  # every process writes to its own shard
+            _storeWriter = store.AlignmentWriter(path.OUTDIR_STORE)
+        _storeWriter.write(slug, loLevel, hiLevel, sInd, result, parResult,
+                           (len(allparagraphs[loLevel]), len(allparagraphs[hiLevel])))
+        return
     with open(path.OUTDIR_SENTENCES + slug + '-cmp-' + str(loLevel) + '-' + str(hiLevel) + '.csv', 'w') as file:
         # writing all sentence alignments
         file.write(slug + '.en.' + str(loLevel) + '\t\t' + slug + '.en.' + str(hiLevel) + '\tFirst line contains '
@@ -870,6 +1326,7 @@ def write_result(slug, loLevel, hiLevel, allparagraphs):
         file.write(slug + '.en.' + str(loLevel) + '\t\t' + slug + '.en.' + str(hiLevel) + '\tFirst line contains '
         'the overall number of paragraphs in the first and second articles \n'+str(len(allparagraphs[loLevel]))+' '+
                                                                                str(len(allparagraphs[hiLevel]))+ '\n')
+        i = 0
         while i < len(parResult):
             # all sentences from the first article
             j = 0
@@ -931,28 +1388,157 @@ def sim_in_articles(slug, paragraphs, levels):
     :param levels: the same as levels parameter in align_all and align_particular.
     :return: None
     """
+    features = SlugFeatures(paragraphs)  # every level is processed once and shared by all the comparisons
     #   for levels except last, starting from simplest
     for comp in levels:
         if comp[1] >= len(paragraphs):
             continue  # if the article was not adapted for this level
         # print('Matching levels %d and %d' % (comp[0], comp[1]))
-        set_up(paragraphs[comp[0]], paragraphs[comp[1]])
-        global result  # cleaning the result variables that are filled with results of previous alignments
-        global parSim
-        result = []
-        global parResultMatrix
-        parResultMatrix = numpy.ndarray((len(paragraphs[comp[0]]), len(paragraphs[comp[1]])), numpy.bool)
-        parResultMatrix.fill(False)
-        align_paragraphs(len(paragraphs[comp[0]]), len(paragraphs[comp[1]]))
-        for i in range(comp[2]-1):
-            for par in parSim:  # resetting parSim before calling align_paragraphs for the second (third) time
-                par.fill(-1)
-            align_paragraphs(len(paragraphs[comp[0]]), len(paragraphs[comp[1]]))
-        extract_results()
+        if SIMILARITY_STORE:
+            similarities = base_similarities(slug, features, comp)  # calls set_up_levels
+            _align_levels(comp, similarities)
+        else:
+            set_up_levels(features, comp[0], comp[1])
+            _align_levels(comp)
         write_result(slug, comp[0], comp[1], paragraphs)
 
 
-def align_first_n(nToAlign = -1, levels = [(0, 1, 3), (1, 2, 3), (2, 3, 2), (3, 4, 2), (4, 5, 2)]):
+def _align_levels(comp, similarities=None):
+    """
+    Align the pair of articles that was set up by set_up_levels and fill parResult and result
+    :param comp:            the tuple (lower level, higher level, the number of times to run the algorithm)
+    :param similarities:    if given, the similarities between all the sentences calculated by PairSimilarities. They
+    are used instead of calculating the similarities again
+    :return: None
+    """
+    global result  # cleaning the result variables that are filled with results of previous alignments
+    result = []
+    if similarities is not None:
+        sentSim[:] = similarities
+    global parResultMatrix
+    parResultMatrix = numpy.ndarray((len(v[0]), len(v[1])), numpy.bool)
+    parResultMatrix.fill(False)
+    align_paragraphs(len(v[0]), len(v[1]))
+    for i in range(comp[2]-1):
+        for par in parSim:  # resetting parSim before calling align_paragraphs for the second (third) time
+            par.fill(-1)
+        align_paragraphs(len(v[0]), len(v[1]))
+    extract_results()
+
+
+class PairSimilarities(object):
+
+    """
+    The part of the alignment of one pair of articles that does not depend on ALPHA, ALPHA2 and BETHA: the
+    SlugFeatures of the slug and the similarities between every sentence of the first article and every sentence of the
+    second one, each calculated from the TF-IDF vectors of its own paragraph. These are exactly the values that the
+    algorithm calculates when it needs them, so the alignment can be replayed with other values of the constants without
+    calculating them again (see replay). Only the similarities between the sentences of the paragraphs that are merged
+    are calculated during the replay, since the merged paragraphs depend on the constants
+    """
+
+    def __init__(self, slug, features, comp):
+        """
+        :param slug:        the slug of the articles
+        :param features:    the SlugFeatures of the slug, shared by all the pairs of levels
+        :param comp:        the tuple (lower level, higher level, the number of times to run the algorithm)
+        """
+        self.slug = slug
+        self.features = features
+        self.comp = comp
+        self.similarities = numpy.array(base_similarities(slug, features, comp))
+
+
+def base_similarities(slug, features, comp):
+    """
+    Set up the pair of articles (see set_up_levels) and calculate the similarities between every sentence of the first
+    article and every sentence of the second one, each from the TF-IDF vectors of its own paragraph. These are the
+    values the algorithm calculates before any paragraphs are merged, so they do not depend on ALPHA, ALPHA2 and BETHA.
+    The similarities between the sentences of merged paragraphs are calculated during the alignment and are never
+    stored. If SIMILARITY_STORE is True, the similarities are taken from the store if they were calculated from the same
+    articles with the same parameters, otherwise they are calculated and written to the store
+    :param slug:        the slug of the articles
+    :param features:    the SlugFeatures of the slug
+    :param comp:        the tuple (lower level, higher level, the number of times to run the algorithm)
+    :return: the matrix of the similarities (sInd[0][-1] rows, sInd[1][-1] columns). It might be memory-mapped and
+    read-only
+    """
+    set_up_levels(features, comp[0], comp[1])
+    if SIMILARITY_STORE:
+        global _similarityStore
+        global _similarityWriter
+        inputHash = _similarity_hash(features, comp)
+        if (_similarityStore is None) or (_similarityStore.directory != path.OUTDIR_SIMILARITIES):
+            _similarityStore = store.SimilarityStore(path.OUTDIR_SIMILARITIES)
+        similarities = _similarityStore.lookup(slug, comp[0], comp[1], inputHash)
+        if (similarities is not None) and (similarities.shape == sentSim.shape):
+            return similarities
+    vectors = ([vector for par in range(len(v[0])) for vector in paragraph_tf_idf(0, [par])],
+               [vector for par in range(len(v[1])) for vector in paragraph_tf_idf(1, [par])])
+    fill_block_similarity(numpy.arange(sInd[0][-1]), numpy.arange(sInd[1][-1]), vectors[0], vectors[1])
+    if SIMILARITY_STORE:
+        if (_similarityWriter is None) or (_similarityWriter.directory != path.OUTDIR_SIMILARITIES) or \
+                (_similarityWriter.pid != os.getpid()):  # every process writes to its own shard
+            _similarityWriter = store.SimilarityWriter(path.OUTDIR_SIMILARITIES)
+        _similarityWriter.write(slug, comp[0], comp[1], inputHash, sInd, sentSim)
+    return sentSim.copy()
+
+
+def _similarity_hash(features, comp):
+    """
+    :param features:    the SlugFeatures of the slug
+    :param comp:        the tuple (lower level, higher level, the number of times to run the algorithm)
+    :return: the hash of the two articles and of the parameters that affect the similarities between their sentences
+    """
+    parameters = [features.paragraphs[comp[0]], features.paragraphs[comp[1]], USE_CONCENTRATION,
+                  CONCENTRATION_MODIFIER]
+    return hashlib.md5(repr(parameters).encode('utf-8')).hexdigest()
+
+
+def prepare_replay(slugs, levels=[(0, 1, 3), (1, 2, 3), (2, 3, 2), (3, 4, 2), (4, 5, 2)]):
+    """
+    Load the articles with the given slugs and calculate everything that does not depend on ALPHA, ALPHA2 and BETHA
+    for every pair of levels (see PairSimilarities)
+    :param slugs:   the list of slugs
+    :param levels:  same as in align_particular
+    :return: the list of PairSimilarities
+    """
+    info = loadMetafile()
+    pairs = []
+    for slug in slugs:
+        articles = info.slug_articles(slug)
+        if len(articles) == 0:
+            print("No such slug: " + slug)
+            continue
+        features = SlugFeatures(list(map(getTokParagraphs, articles)))
+        for comp in levels:
+            if comp[1] < len(features.paragraphs):
+                pairs.append(PairSimilarities(slug, features, comp))
+    return pairs
+
+
+def replay(pairs):
+    """
+    Align the pairs of articles with the current values of the constants (ALPHA, ALPHA2, BETHA, etc.) using the
+    similarities calculated by prepare_replay. The result is the same as if the articles were aligned by
+    align_particular, but it is kept in memory instead of being written to the files
+    :param pairs:   the list of PairSimilarities returned by prepare_replay
+    :return: the dictionary, where for every (slug, lower level, higher level) the tuple (result, parResult, sInd) is
+    stored (see the description of the global variables with the same names)
+    """
+    alignments = {}
+    slug = None
+    for pair in pairs:
+        if pair.slug != slug:  # same as in _align_group
+            eu.resize(MAXIMUM_PARAGRAPHS, MAXIMUM_PARAGRAPHS, VICINITIES, SENTENCE_VICINITIES)
+            slug = pair.slug
+        set_up_levels(pair.features, pair.comp[0], pair.comp[1])
+        _align_levels(pair.comp, pair.similarities)
+        alignments[(pair.slug, pair.comp[0], pair.comp[1])] = (result, parResult, sInd)
+    return alignments
+
+
+def align_first_n(nToAlign = -1, levels = [(0, 1, 3), (1, 2, 3), (2, 3, 2), (3, 4, 2), (4, 5, 2)], workers=1):
     """
     Create alignments for the first nToAlign slugs. If nToAlign=-1, align all slugs.
     :param nToAlign: the number of slugs to align. If nToAlign = -1, all the slugs will be aligned
@@ -962,33 +1548,28 @@ def align_first_n(nToAlign = -1, levels = [(0, 1, 3), (1, 2, 3), (2, 3, 2), (3,
     for every level. The levels parameter should be a list of tuples of three elements. The first element is the lower
     level to align, the second is the higher level to align, the third is how many times to run the algorithm for this
     pair of levels.
-    :return: None
+    :param workers: the number of processes that align the slugs in parallel (see align_slugs)
+    :return: the list of slugs that could not be aligned
     """
     info = loadMetafile()
-    eu.calculate(MAXIMUM_PARAGRAPHS, MAXIMUM_PARAGRAPHS, VICINITIES, SENTENCE_VICINITIES) # one-time operation that will 
-    # later allow to iterate over the matrix by increasing the euclidean distance from a specific entry
-    nSlugs = 0
-    i = 0
     for comparison in levels:
         if comparison[0] >= comparison[1]:
             print("the lower level should be indicated first")
             return
-    while (i < len(info))and((nToAlign == -1)or(nSlugs < nToAlign)):
+    groups = []  # the slugs to align together with the articles that have these slugs
+    i = 0
+    while (i < len(info))and((nToAlign == -1)or(len(groups) < nToAlign)):
         artLow = i  # first article with this slug
-       	slug = info[i]['slug']
-        nSlugs += 1
-        if nToAlign == -1:
-            print("Processing slug... "+ slug+' '+str(round(i/float(len(info)) * 100, 3))+'% of the task completed')
-        else:
-            print("Processing slug... "+ slug+' '+str(round(nSlugs/float(nToAlign) * 100, 3))+'% of the task completed')
+        slug = info[i]['slug']
         while i < len(info) and slug == info[i]['slug']:
             i += 1
         artHi = i  # one more than the number of the highest article with this slug
-        sim_in_articles(slug, list(map(getTokParagraphs, info[artLow:artHi])), levels)  # the articles in the metafile
-        #  should be ordered by the slug and then by increasing the level of adaptation
+        groups.append((slug, info[artLow:artHi]))  # the articles in the metafile should be ordered by the slug and
+        # then by increasing the level of adaptation
+    return align_slugs(groups, levels, workers)
 
 
-def align_particular(slugs, levels=[(0, 1, 3), (1, 2, 3), (2, 3, 2), (3, 4, 2), (4, 5, 2)]):
+def align_particular(slugs, levels=[(0, 1, 3), (1, 2, 3), (2, 3, 2), (3, 4, 2), (4, 5, 2)], workers=1):
     """
     Create alignments for the slugs that are indicated by the slugs parameter.
     :param slugs: the list of slugs to process
@@ -999,22 +1580,234 @@ def align_particular(slugs, levels=[(0, 1, 3), (1, 2, 3), (2, 3, 2), (3, 4, 2),
     running the algorithm once for every level. The levels parameter should be a list of tuples of three elements.
     The first element is the lower level to align, the second is the higher level to align, the third is how many times
     to run the algorithm for this pair of levels.
-    :return: None
+    :param workers: the number of processes that align the slugs in parallel (see align_slugs)
+    :return: the list of slugs that could not be aligned
     """
     info = loadMetafile()
-    eu.calculate(MAXIMUM_PARAGRAPHS, MAXIMUM_PARAGRAPHS, VICINITIES, SENTENCE_VICINITIES) # one-time operation that will
-    # later allow to iterate over the matrix by increasing the euclidean distance from a specific entry
     for comparison in levels:
         if comparison[0] >= comparison[1]:
             print("the lower level should be indicated first")
             return
+    groups = []
     for slug in slugs:
-        # print("Processing slug... " + slug)
-        artLow = autils.get_lowest_element_with_slug(slug, info)
-        artHi = artLow
-        while artHi < len(info) and slug == info[artHi]['slug']:
-            artHi += 1
-        sim_in_articles(slug, list(map(getTokParagraphs, info[artLow:artHi])), levels)
+        articles = info.slug_articles(slug)
+        if len(articles) == 0:
+            print("No such slug: " + slug)
+            continue
+        groups.append((slug, articles))
+    return align_slugs(groups, levels, workers, False)
+
+
+def align_slugs(groups, levels, workers=1, report=True):
+    """
+    Align the given slugs. If workers > 1, the slugs are distributed among a pool of worker processes in chunks of
+    SLUGS_PER_CHUNK slugs. Every worker loads the NLTK resources and the euclidean array once, when it is started, and
+    takes the values of the constants in this module (ALPHA, BETHA, VICINITIES, etc.) and the output directories from
+    the process that created the pool. Since every slug is aligned independently of the others and is written to its own
+    files, the results are the same as if the slugs were aligned one after another. With any number of workers, an error
+    while aligning one slug is reported, but does not stop the alignment of the other ones.
+    If SKIP_UNCHANGED is True, the pairs of articles that were aligned before from the same .tok files and with the same
+    parameters are not aligned again (see ALIGN_MANIFEST in classpaths). The manifest is updated after every slug.
+    :param groups:  the list of tuples (slug, the list of the articles with this slug from the metafile)
+    :param levels:  same as in align_first_n
+    :param workers: the number of processes to use. If workers = 1, everything is done in this process
+    :param report:  if True, report the progress
+    :return: the list of slugs that could not be aligned
+    """
+    eu.resize(MAXIMUM_PARAGRAPHS, MAXIMUM_PARAGRAPHS, VICINITIES, SENTENCE_VICINITIES)  # allows to iterate over
+    # the matrix by increasing the euclidean distance from a specific entry. This also completes the vicinities, so that
+    # the parameters hashed by _pending_levels are the same in every run
+    manifest = load_manifest(path.ALIGN_MANIFEST)
+    stored = _stored_pairs()  # read once, not for every slug
+    tasks = []  # tuples (slug, the articles with this slug, the levels to align, the entries for the manifest)
+    for group in groups:
+        pending, entries = _pending_levels(group, levels, manifest, stored)
+        if len(pending) > 0:
+            tasks.append((group[0], group[1], pending, entries))
+    if report and (len(tasks) < len(groups)):
+        print(str(len(groups) - len(tasks)) + ' slugs are skipped, since they have not changed since the last time')
+    failed = []
+    if workers <= 1:
+        for i in range(len(tasks)):
+            if report:
+                print("Processing slug... " + tasks[i][0] + ' ' + str(round(i / float(len(tasks)) * 100, 3)) +
+                      '% of the task completed')
+            slug, error = _align_in_worker(tasks[i][:3])
+            if error is not None:
+                print("ERROR while aligning slug " + slug + "\n" + error)
+                failed.append(slug)
+                continue
+            _record_in_manifest(tasks[i][3])
+        return failed
+    if lemmaCache.store is not None:  # the store cannot be written by many processes at once. The workers will only
+        # read it and the process will continue to write to it afterwards
+        reopen = (lemmaCache.filename, lemmaCache.readOnly)
+        lemmaCache.close()
+    else:
+        reopen = None
+    settings = dict((name, globals()[name]) for name in _WORKER_SETTINGS)
+    paths = dict((name, getattr(path, name)) for name in _WORKER_PATHS)
+    entries = dict((task[0], task[3]) for task in tasks)
+    pool = multiprocessing.Pool(workers, _init_worker, (settings, paths, reopen and reopen[0]))
+    try:
+        done = 0
+        for slug, error in pool.imap_unordered(_align_in_worker, [task[:3] for task in tasks], SLUGS_PER_CHUNK):
+            done += 1
+            if error is not None:
+                print("ERROR while aligning slug " + slug + "\n" + error)
+                failed.append(slug)
+                continue
+            _record_in_manifest(entries[slug])
+            if report:
+                print("Aligned slug... " + slug + ' ' + str(round(done / float(len(tasks)) * 100, 3)) +
+                      '% of the task completed')
+    finally:
+        pool.close()
+        pool.join()
+        if reopen is not None:
+            use_lemma_store(reopen[0], reopen[1])
+    return failed
+
+
+def load_manifest(filename):
+    """
+    Load the manifest written by align_slugs. Every line of the manifest describes one pair of articles that was aligned:
+    slug, the lower level, the higher level, the hash of the two .tok files and the hash of the parameters of the
+    alignment. If the same pair of articles appears more than once, the last line is used
+    :param filename:    the name of the manifest. If there is no such file, the manifest is empty
+    :return: the dictionary, where for every (slug, loLevel, hiLevel) the tuple (the hash of the files, the hash of
+    the parameters) is stored
+    """
+    manifest = {}
+    if not os.path.exists(filename):
+        return manifest
+    with open(filename) as file:
+        for line in file:
+            line = line.rstrip('\n').split('\t')
+            if len(line) == 5:  # otherwise the line was not written completely
+                manifest[(line[0], int(line[1]), int(line[2]))] = (line[3], line[4])
+    return manifest
+
+
+def _pending_levels(group, levels, manifest, stored):
+    """
+    Find out which pairs of articles with this slug have to be aligned. These are the pairs that are not in the manifest,
+    the pairs whose .tok files have changed and the pairs that were aligned with different parameters. If
+    SKIP_UNCHANGED is False, all the pairs are aligned
+    :param group:       a tuple (slug, the list of the articles with this slug from the metafile)
+    :param levels:      same as in align_first_n
+    :param manifest:    the manifest loaded by load_manifest
+    :param stored:      the set of pairs of articles in the store in OUTDIR_STORE (see _stored_pairs)
+    :return: the list of levels to align (in the same format as levels) and the list of the manifest entries for them
+    """
+    slug, articles = group[0], group[1]
+    fileHashes = {}  # the hash of every .tok file of this slug that was read
+    pending = []
+    entries = []
+    for comp in levels:
+        if comp[1] >= len(articles):
+            continue  # if the article was not adapted for this level
+        for level in comp[:2]:
+            if level not in fileHashes:
+                with open(path.BASEDIR + '/articles/' + articles[level]['filename'] + '.tok', 'rb') as file:
+                    fileHashes[level] = hashlib.md5(file.read()).hexdigest()
+        entry = (slug, comp[0], comp[1], hashlib.md5((fileHashes[comp[0]] + fileHashes[comp[1]]).encode()).hexdigest(),
+                 _parameter_hash(comp[2]))
+        if SKIP_UNCHANGED and (manifest.get(entry[:3]) == entry[3:]) and _output_exists(slug, comp[0], comp[1],
+                                                                                         stored):
+            continue
+        pending.append(comp)
+        entries.append(entry)
+    return pending, entries
+
+
+def _parameter_hash(passes):
+    """
+    :param passes:  how many times the algorithm is run for the pair of articles
+    :return: the hash of all the parameters that affect the results of the alignment
+    """
+    vicinities = [[(int(point[0]), int(point[1])) for point in vicinity] for vicinity in VICINITIES]
+    sentenceVicinities = [[(int(point[0]), int(point[1])) for point in vicinity] for vicinity in SENTENCE_VICINITIES]
+    parameters = [ALPHA, ALPHA2, BETHA, vicinities, sentenceVicinities, USE_CONCENTRATION, CONCENTRATION_MODIFIER,
+                  MAXIMUM_PARAGRAPHS, OUTPUT_FORMAT, passes]  # BATCHED_SIMILARITY does not change the results
+    return hashlib.md5(repr(parameters).encode()).hexdigest()
+
+
+def _stored_pairs():
+    """
+    :return: the set of (slug, loLevel, hiLevel) tuples for the pairs of articles in the store in OUTDIR_STORE, or an
+    empty set if the results are not written to the store
+    """
+    if OUTPUT_FORMAT != 'store':
+        return set()
+    return set(store.AlignmentStore(path.OUTDIR_STORE).pairs())
+
+
+def _output_exists(slug, loLevel, hiLevel, stored):
+    """
+    :param stored:  the set of pairs of articles in the store (see _stored_pairs)
+    :return: True if the results of the alignment of this pair of articles are still in the text files or in the store
+    (depending on OUTPUT_FORMAT), False otherwise
+    """
+    if OUTPUT_FORMAT == 'store':
+        return (slug, loLevel, hiLevel) in stored
+    name = slug + '-cmp-' + str(loLevel) + '-' + str(hiLevel) + '.csv'
+    return os.path.exists(path.OUTDIR_SENTENCES + name) and os.path.exists(path.OUTDIR_PARAGRAPHS + name)
+
+
+def _record_in_manifest(entries):
+    """
+    Append the entries for the pairs of articles that were just aligned to the manifest (see load_manifest)
+    :param entries: the list of tuples (slug, loLevel, hiLevel, the hash of the files, the hash of the parameters)
+    :return: None
+    """
+    if len(entries) == 0:
+        return
+    with open(path.ALIGN_MANIFEST, 'a') as file:
+        for entry in entries:
+            file.write('\t'.join(map(str, entry)) + '\n')
+
+
+def _align_group(task):
+    """
+    Align all the articles with one slug
+    :param task:    a tuple (slug, the list of the articles with this slug from the metafile, the levels to align in
+    the same format as in align_first_n)
+    :return: None
+    """
+    eu.resize(MAXIMUM_PARAGRAPHS, MAXIMUM_PARAGRAPHS, VICINITIES, SENTENCE_VICINITIES)  # if the previous slug needed
+    # a larger array, the results for this slug should not depend on it
+    sim_in_articles(task[0], list(map(getTokParagraphs, task[1])), task[2])
+
+
+def _init_worker(settings, paths, lemmaStore):
+    """
+    Prepare a worker process of align_slugs
+    :param settings:    the values of the constants from _WORKER_SETTINGS in the process that created the pool
+    :param paths:       same for the variables in classpaths
+    :param lemmaStore:  the name of the store with lemmas to read from (see newselautil.use_lemma_store) or None
+    :return: None
+    """
+    for name in settings:
+        globals()[name] = settings[name]
+    for name in paths:
+        setattr(path, name, paths[name])
+    if lemmaStore is not None:
+        use_lemma_store(lemmaStore, True)
+    eu.resize(MAXIMUM_PARAGRAPHS, MAXIMUM_PARAGRAPHS, VICINITIES, SENTENCE_VICINITIES)
+
+
+def _align_in_worker(task):
+    """
+    Align all the articles with one slug in a worker process of align_slugs (or in this process if there are no workers)
+    :param task:    same as in _align_group
+    :return: a tuple (slug, None) if the slug was aligned or (slug, the description of the error) otherwise
+    """
+    try:
+        _align_group(task)
+        return task[0], None
+    except Exception:
+        return task[0], traceback.format_exc()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 """
 This modules contains utils for working with already aligned articles
 
-def get_aligned_sentences(metafile, slug, level1, level2, auto=True): Return aligned sentences..
+def get_aligned_sentences(metafile, slug, level1, level2, auto=True, alignmentStore=None): Return aligned sentences..
+
+def read_alignment_lines(slug, level1, level2, auto=True, alignmentStore=None): Return the blocks of alignments as they
+are written in the -cmp- files or in the store (see store.py)
 """
 
 from newselautil import *
@@ -51,6 +54,11 @@ def get_lowest_element_with_slug(slug, metafile):
     :param metafile: the metafile to use
     :return: The position of the first element with this slug
     """
+    if hasattr(metafile, 'slugRanges'):  # the metafile was loaded with newselautil.loadMetafile
+        if slug not in metafile.slugRanges:
+            print("No such slug: " + slug)
+            return
+        return metafile.slugRanges[slug][0]
     hi = len(metafile) - 1  # search for slug
     lo = 0
     while lo < hi:
@@ -84,7 +92,44 @@ def replace(threeDimArray, old, new):
                     oneDim[i] == new
 
 
-def get_aligned_sentences(metafile, slug, level1, level2, auto=True):
+def read_alignment_lines(slug, level1, level2, auto=True, alignmentStore=None):
+    """
+    Returns the blocks of sentence alignments written for the pair of articles. Every block is a list of alignments, and
+    every alignment is a tuple ((n_of_paragraph, n_of_phrase), (n_of_paragraph, n_of_phrase)) of one-based coordinates,
+    as they are written in the -cmp- files
+    :param slug:            the slug of the aligned articles
+    :param level1:          the lower level of the alignment
+    :param level2:          the upper level of the alignment
+    :param auto:            true if alignments made by the algorithm are to be
+                            loaded, false otherwise (for manual alignemnets)
+    :param alignmentStore:  if given, the alignments made by the algorithm are read from this store.AlignmentStore
+                            instead of the -cmp- files
+    :return:
+    """
+    if auto and (alignmentStore is not None):
+        return [[((a[0] + 1, a[1] + 1), (a[2] + 1, a[3] + 1)) for a in block.tolist()]
+                for block in alignmentStore.sentence_blocks(slug, level1, level2)]
+    if auto:
+        directory = path.OUTDIR_SENTENCES
+        i = 3
+    else:
+        directory = path.MANUAL_SENTENCES
+        i = 1
+    blocks = []
+    with open(directory + slug+"-cmp-"+str(level1)+"-"+str(level2)+".csv") as file:
+        f = file.readlines()
+        while i < len(f):
+            block = []
+            for alignment in f[i].split("\t"):
+                alignment = alignment.split(",")
+                block.append((list(map(int, re.findall(r'\d+', alignment[0]))),
+                              list(map(int, re.findall(r'\d+', alignment[1])))))
+            blocks.append(block)
+            i += 1
+    return blocks
+
+
+def get_aligned_sentences(metafile, slug, level1, level2, auto=True, alignmentStore=None):
     """
     Returns the list of Alignment objects.
     :param metafile:        the metafile loaded with newselautils.loadMetafile()
@@ -93,6 +138,8 @@ def get_aligned_sentences(metafile, slug, level1, level2, auto=True):
     :param level2:          the upper level of the alignment
     :param auto:            true if alignments made by the algorithm are to be
                             loaded, false otherwise (for manual alignemnets)
+    :param alignmentStore:  if given, the alignments made by the algorithm are read from this store.AlignmentStore
+                            (see align.OUTPUT_FORMAT) instead of the -cmp- files
     :return:
     """
     if level1 >= level2:
@@ -125,61 +172,49 @@ def get_aligned_sentences(metafile, slug, level1, level2, auto=True):
     #  appears. sentCount[0][i][j] is the same thing for the second article
     # if the same sentence appears in two blocks of alignment, the blocks are concatenated
 
-    if auto:
-        directory = path.OUTDIR_SENTENCES
-        i = 3
-    else:
-        directory = path.MANUAL_SENTENCES
-        i = 1
+    for line in read_alignment_lines(slug, level1, level2, auto, alignmentStore):
+        current = []
+        blockId = len(result)  # current is added to result[oldBlock]
+        for alignment in line:
+            first = convert_coordinates(alignment[0], allParagraphs[0])
+            second = convert_coordinates(alignment[1], allParagraphs[1])
 
-    with open(directory + slug+"-cmp-"+str(level1)+"-"+str(level2)+".csv") as file:
-        f = file.readlines()
-        while i < len(f):
-            line = f[i].split("\t")
-            current = []
-            blockId = len(result)  # current is added to result[oldBlock]
-            for alignment in line:
-                alignment = alignment.split(",")
-                first = convert_coordinates(list(map(int, re.findall(r'\d+', alignment[0]))), allParagraphs[0])
-                second = convert_coordinates(list(map(int, re.findall(r'\d+', alignment[1]))), allParagraphs[1])
-
-                if blockId == len(result):
-                    if (sentCount[0][first[0]][first[1]] != -1)and(sentCount[0][first[0]][first[1]] != len(result)):
-                        blockId = sentCount[0][first[0]][first[1]]
-                        replace(sentCount, len(result), blockId)
-                    elif (sentCount[1][second[0]][second[1]] != -1)and(sentCount[1][second[0]][second[1]]!=len(result)):
-                        blockId = sentCount[1][second[0]][second[1]]
-                        replace(sentCount, len(result), blockId)
-                if sentCount[0][first[0]][first[1]] == -1:
-                    sentCount[0][first[0]][first[1]] = blockId
-                elif sentCount[0][first[0]][first[1]] != blockId:
-                    current += result[sentCount[0][first[0]][first[1]]]
-                    result[sentCount[0][first[0]][first[1]]] = None
-                    replace(sentCount, sentCount[0][first[0]][first[1]], blockId)
-                if sentCount[1][second[0]][second[1]] == -1:
-                    sentCount[1][second[0]][second[1]] = blockId
-                elif sentCount[1][second[0]][second[1]] != blockId:
-                    current += result[sentCount[1][second[0]][second[1]]]
-                    result[sentCount[1][second[0]][second[1]]] = None
-                    replace(sentCount, sentCount[1][second[0]][second[1]], blockId)
-
-                ind0 = allParagraphs[0][first[0]][first[1]][2]
-                ind1 = allParagraphs[1][second[0]][second[1]][2]
-                sent0 = allParagraphs[0][first[0]][first[1]][0]
-                sent1 = allParagraphs[1][second[0]][second[1]][0]
-                current.append(Alignment(sent0, ind0, first[0], first[1], first[2],
-                                         sent1, ind1, second[0], second[1], second[2]))
             if blockId == len(result):
-                result.append(current)
-            else:
-                result[blockId] += current
+                if (sentCount[0][first[0]][first[1]] != -1)and(sentCount[0][first[0]][first[1]] != len(result)):
+                    blockId = sentCount[0][first[0]][first[1]]
+                    replace(sentCount, len(result), blockId)
+                elif (sentCount[1][second[0]][second[1]] != -1)and(sentCount[1][second[0]][second[1]]!=len(result)):
+                    blockId = sentCount[1][second[0]][second[1]]
+                    replace(sentCount, len(result), blockId)
+            if sentCount[0][first[0]][first[1]] == -1:
+                sentCount[0][first[0]][first[1]] = blockId
+            elif sentCount[0][first[0]][first[1]] != blockId:
+                current += result[sentCount[0][first[0]][first[1]]]
+                result[sentCount[0][first[0]][first[1]]] = None
+                replace(sentCount, sentCount[0][first[0]][first[1]], blockId)
+            if sentCount[1][second[0]][second[1]] == -1:
+                sentCount[1][second[0]][second[1]] = blockId
+            elif sentCount[1][second[0]][second[1]] != blockId:
+                current += result[sentCount[1][second[0]][second[1]]]
+                result[sentCount[1][second[0]][second[1]]] = None
+                replace(sentCount, sentCount[1][second[0]][second[1]], blockId)
+
+            ind0 = allParagraphs[0][first[0]][first[1]][2]
+            ind1 = allParagraphs[1][second[0]][second[1]][2]
+            sent0 = allParagraphs[0][first[0]][first[1]][0]
+            sent1 = allParagraphs[1][second[0]][second[1]][0]
+            current.append(Alignment(sent0, ind0, first[0], first[1], first[2],
+                                     sent1, ind1, second[0], second[1], second[2]))
+        if blockId == len(result):
+            result.append(current)
+        else:
+            result[blockId] += current
+    i = 0
+    while i < len(result):
+        if result[i] is None:
+            del result[i]
+        else:
             i += 1
-        i = 0
-        while i < len(result):
-            if result[i] is None:
-                del result[i]
-            else:
-                i += 1
     # result accounts for N-1, N-N and 1-N alignments. new_result does not
     new_result = []
     for x in result:
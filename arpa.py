@@ -0,0 +1,200 @@
+"""
+This module scores tokenized articles with a back-off language model in the ARPA format (the .bo files created by
+ngram-count, see ngram.build_ngrams) the same way as "ngram -lm MODEL -ppl FILE -debug 2" does, but without starting
+a new program and reading the whole model for every article.
+
+The model is converted once into a directory of numpy arrays, which are memory-mapped when the model is loaded, so the
+model is read from the disk only when it is used and the same pages are shared by all the processes that use it. Every
+word of the vocabulary gets an integer id, and every ngram of order n is stored as one int64 key: the ids of its words
+written as the digits of a number in base len(vocabulary)+1 (the last digit, len(vocabulary), is the id of all the
+words that are out of vocabulary). For every order the directory contains:
+    keys-n.npy      - the sorted keys of all the ngrams of order n
+    probs-n.npy     - the log10 probabilities of these ngrams (float32)
+    bows-n.npy      - the log10 back-off weights of these ngrams (float32, zero if the ngram has no back-off weight)
+The vocabulary is kept in vocabulary.txt, one word per line, in the order of the ids.
+
+load(arpaFile, directory=None) - return the LanguageModel for the .bo file. The arrays are created if they do not exist
+or are older than the .bo file. The models are kept in memory, so every model is loaded only once per process
+
+convert(arpaFile, directory) - write the arrays for the .bo file
+
+LanguageModel(directory) - the model read from the arrays:
+    score(sentences) - the log10 probability of every word (and of the end of every sentence) in the list of sentences
+    perplexity(scores) - the two perplexities reported by ngram -ppl (ppl and ppl1) for the result of score
+"""
+
+import io
+import os
+import numpy
+
+SENTENCE_START = '<s>'  # the tags that are added to the beginning and to the end of every sentence (see ngram.py)
+SENTENCE_END = '</s>'
+VOCABULARY_FILE = 'vocabulary.txt'
+
+_models = {}  # the models loaded by load, for every directory: (the time when the .bo file was modified, model)
+
+
+def convert(arpaFile, directory):
+    """
+    Read the language model in the ARPA format and write it as arrays to the directory (see the description of the
+    module). The directory is written under a temporary name and then renamed
+    :param arpaFile:    the name of the .bo file
+    :param directory:   the directory to write the arrays to. It is replaced if it exists
+    :return:            None
+    """
+    vocabulary = {}  # for every word its id
+    ngrams = []  # for every order the lists of keys, probabilities and back-off weights
+    order = 0  # the order of the section that is being read. 0 for the header
+    with io.open(arpaFile, encoding='utf-8', errors='replace') as file:
+        for line in file:
+            line = line.strip()
+            if (len(line) == 0) or (line == '\\data\\') or line.startswith('ngram '):
+                continue
+            if line == '\\end\\':
+                break
+            if line.startswith('\\') and line.endswith('-grams:'):
+                order = int(line[1:-len('-grams:')])
+                while len(ngrams) < order:
+                    ngrams.append(([], [], []))
+                continue
+            fields = line.split()
+            if order == 1:
+                vocabulary[fields[1]] = len(vocabulary)
+            ngrams[order - 1][0].append(fields[1:order + 1])
+            ngrams[order - 1][1].append(float(fields[0]))
+            ngrams[order - 1][2].append(float(fields[order + 1]) if len(fields) > order + 1 else 0.0)
+    base = len(vocabulary) + 1
+    if base ** len(ngrams) >= 2 ** 63:
+        raise ValueError('the vocabulary of ' + arpaFile + ' is too large to store the ngrams as int64 keys')
+    temporary = directory.rstrip('/') + '.' + str(os.getpid())
+    if not os.path.isdir(temporary):
+        os.makedirs(temporary)
+    with io.open(os.path.join(temporary, VOCABULARY_FILE), 'w', encoding='utf-8') as file:
+        for word in sorted(vocabulary, key=vocabulary.get):
+            file.write(word + u'\n')
+    for n in range(1, len(ngrams) + 1):
+        keys = numpy.zeros(len(ngrams[n - 1][0]), dtype=numpy.int64)
+        for i in range(n):  # the ids of the words in the i-th position of every ngram are the i-th digits of the keys
+            keys = keys * base + numpy.array([vocabulary.get(words[i], base - 1) for words in ngrams[n - 1][0]],
+                                             dtype=numpy.int64)
+        sort = numpy.argsort(keys, kind='mergesort')
+        numpy.save(os.path.join(temporary, 'keys-' + str(n) + '.npy'), keys[sort])
+        numpy.save(os.path.join(temporary, 'probs-' + str(n) + '.npy'),
+                   numpy.array(ngrams[n - 1][1], dtype=numpy.float32)[sort])
+        numpy.save(os.path.join(temporary, 'bows-' + str(n) + '.npy'),
+                   numpy.array(ngrams[n - 1][2], dtype=numpy.float32)[sort])
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    os.rename(temporary, directory)
+
+
+def load(arpaFile, directory=None):
+    """
+    Return the model for the .bo file. If the arrays for it do not exist or are older than the .bo file, they are
+    created first (see convert). The model is loaded only once per process
+    :param arpaFile:    the name of the .bo file
+    :param directory:   the directory with the arrays. By default, arpaFile + '.arrays/'
+    :return:            the LanguageModel
+    """
+    if directory is None:
+        directory = arpaFile + '.arrays/'
+    modified = os.path.getmtime(arpaFile)
+    if (directory in _models) and (_models[directory][0] == modified):
+        return _models[directory][1]
+    if (not os.path.isfile(os.path.join(directory, VOCABULARY_FILE))) or \
+            (os.path.getmtime(os.path.join(directory, VOCABULARY_FILE)) < modified):
+        convert(arpaFile, directory)
+    _models[directory] = (modified, LanguageModel(directory))
+    return _models[directory][1]
+
+
+class LanguageModel(object):
+
+    """ a back-off language model read from the arrays written by convert """
+
+    def __init__(self, directory):
+        """
+        :param directory:   the directory with the arrays (see convert)
+        """
+        with io.open(os.path.join(directory, VOCABULARY_FILE), encoding='utf-8') as file:
+            self.vocabulary = dict((line.rstrip('\n'), i) for i, line in enumerate(file))
+        self.unknown = len(self.vocabulary)  # the id of the words that are out of vocabulary
+        self.order = 0
+        while os.path.isfile(os.path.join(directory, 'keys-' + str(self.order + 1) + '.npy')):
+            self.order += 1
+        self.keys = []  # for every order (starting from 1) the memory-mapped arrays described in convert
+        self.probs = []
+        self.bows = []
+        for n in range(1, self.order + 1):
+            self.keys.append(numpy.load(os.path.join(directory, 'keys-' + str(n) + '.npy'), mmap_mode='r'))
+            self.probs.append(numpy.load(os.path.join(directory, 'probs-' + str(n) + '.npy'), mmap_mode='r'))
+            self.bows.append(numpy.load(os.path.join(directory, 'bows-' + str(n) + '.npy'), mmap_mode='r'))
+
+    def _find(self, n, keys, valid):
+        """
+        :param n:       the order of the ngrams
+        :param keys:    the array of keys of ngrams of order n
+        :param valid:   the mask of the keys that should be looked up
+        :return:        the mask of the keys that are in the model and the array of their positions in the arrays
+        """
+        table = self.keys[n - 1]
+        if len(table) == 0:
+            return numpy.zeros(len(keys), dtype=bool), numpy.zeros(len(keys), dtype=numpy.int64)
+        positions = numpy.minimum(numpy.searchsorted(table, keys), len(table) - 1)
+        return valid & (table[positions] == keys), positions
+
+    def score(self, sentences):
+        """
+        Calculate the log10 probability of every word given the preceding words of the sentence, the same way as ngram
+        -ppl does: if the ngram that ends with the word is not in the model, the back-off weight of its context is added
+        to the probability of the word given the shorter context. Every sentence starts with SENTENCE_START, which is
+        not scored, and ends with SENTENCE_END, which is. The words that are out of vocabulary get -inf
+        :param sentences:   the list of sentences, every sentence is a list of words
+        :return:            the list of float64 arrays, one per sentence, of length len(sentence) + 1. The last value is
+        the probability of SENTENCE_END
+        """
+        if len(sentences) == 0:
+            return []
+        base = self.unknown + 1
+        lengths = numpy.array([len(sentence) + 2 for sentence in sentences])
+        starts = numpy.cumsum(lengths) - lengths  # the position of SENTENCE_START of every sentence
+        ids = numpy.array([self.vocabulary.get(word, self.unknown) for sentence in sentences
+                           for word in [SENTENCE_START] + list(sentence) + [SENTENCE_END]], dtype=numpy.int64)
+        scored = numpy.ones(len(ids), dtype=bool)
+        scored[starts] = False
+        positions = numpy.nonzero(scored)[0]  # the positions of the words that are scored
+        context = positions - numpy.repeat(starts, lengths - 1)  # the number of words before the word in its sentence
+        words = ids[positions]
+        found, index = self._find(1, words, words != self.unknown)
+        result = numpy.where(found, numpy.asarray(self.probs[0], dtype=numpy.float64)[index], -numpy.inf)
+        ngramKeys = words.copy()  # the keys of the ngrams of order n that end with the word
+        contextKeys = numpy.zeros(len(words), dtype=numpy.int64)  # the keys of their contexts (of order n - 1)
+        for n in range(2, self.order + 1):
+            valid = context >= n - 1
+            previous = ids[numpy.maximum(positions - n + 1, 0)]  # the first word of the ngram
+            ngramKeys = ngramKeys + previous * base ** (n - 1)
+            contextKeys = contextKeys + previous * base ** (n - 2)
+            contextFound, contextIndex = self._find(n - 1, contextKeys, valid)
+            ngramFound, ngramIndex = self._find(n, ngramKeys, valid & found)
+            backoff = result + numpy.where(contextFound, self.bows[n - 2][contextIndex], 0)
+            result = numpy.where(ngramFound, self.probs[n - 1][ngramIndex], backoff)
+        return numpy.split(result, numpy.cumsum(lengths - 1)[:-1])
+
+    def perplexity(self, scores):
+        """
+        Calculate the perplexity the same way as ngram -ppl does. The words that are out of vocabulary (and the words
+        with zero probability) are not taken into account
+        :param scores:  the result of score
+        :return:        the tuple (ppl, ppl1): the perplexity counting all the words and the ends of the sentences,
+        and the perplexity counting only the words
+        """
+        if len(scores) == 0:
+            return float('nan'), float('nan')
+        values = numpy.concatenate(scores)
+        known = numpy.isfinite(values)
+        logprob = values[known].sum()
+        ends = numpy.cumsum([len(sentence) for sentence in scores]) - 1
+        words = known.sum() - known[ends].sum()
+        return 10 ** (-logprob / max(known.sum(), 1)), 10 ** (-logprob / words) if words > 0 else float('nan')
@@ -0,0 +1,412 @@
+"""
+This module measures how long the functions that take most of the time of the alignment and of the evaluation run on
+articles of different sizes, so that a change to one of them can be checked for speeding things up or slowing them down.
+The articles are synthetic and are generated from a fixed seed, so every run measures exactly the same work. They are
+written as .tok files with @PGPH lines (the same format as the output of custom/Tokenizer) and read back with
+newselautil.getTokParagraphs. The lemmas of all their sentences are put into newselautil.lemmaCache beforehand, so
+neither the Stanford tools nor the NLTK corpora are needed. If the stopwords corpus or the punkt tokenizer are not
+installed, they are replaced with stubs before newselautil is imported (see _stub_corpora). This is only done for the
+benchmark: the synthetic articles have no stopwords and are never split into sentences by punkt.
+
+For every size in SIZES the pair of articles is set up (see align.set_up) and the following functions are timed:
+    align.calculate_cosine_similarity   - COSINE_PAIRS pairs of sentences from the two articles
+    align.build_tf_idf                  - the TF-IDF vectors for every paragraph of both articles
+    align.paragraph_similarity          - the similarity between every pair of paragraphs, starting from empty sentSim
+                                        and parSim
+    euclidean.calculate                 - the array for the matrix with the number of paragraphs of the larger article
+    euclidean.closest                   - the search from the origin of the same matrix that never succeeds, so that
+                                        all the points are checked (closest-batched - same with the vectorized
+                                        expression)
+    align.extract_results               - the list of paragraph alignments from a matrix with one-to-one alignments
+                                        and merged groups of paragraphs
+    compare.createStstistics            - the statistics for a sentence matrix filled with AUTO, MAN and MAN_AND_AUTO
+
+make_article(nParagraphs, seed) - generate the synthetic article: the list of paragraphs, every paragraph is a list of
+sentences and every sentence is a list of words (which are already lemmas)
+
+simplify(article, seed) - generate the simplified version of the article: some paragraphs, sentences and words are
+dropped and some sentences are split
+
+write_fixture(article, filename) - write the article as a .tok file and put the lemmas of its sentences into
+newselautil.lemmaCache
+
+measure(function, repeats=REPEATS, minTime=MIN_TIME) - the time one call of the function takes
+
+benchmark(sizes=SIZES, repeats=REPEATS) - time all the functions for all the sizes and return the report
+
+write_report(report, filename), read_report(filename) - save the report as JSON and read it back
+
+compare_reports(report, baseline, tolerance=TOLERANCE) - compare the report with the baseline and return the
+functions that became slower
+
+main(reportFile=REPORT, baselineFile=BASELINE) - run the benchmark, write the report and compare it with the baseline.
+Usage: python benchmark.py [report.json [baseline.json]]
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+import numpy
+import nltk.corpus
+import nltk.data
+
+PUNKT = 'tokenizers/punkt/english.pickle'  # the sentence tokenizer loaded by newselautil
+
+
+class _Stopwords(object):
+
+    """ stands for the NLTK stopwords corpus if it is not installed """
+
+    def words(self, language):
+        """
+        :return: an empty list, since the words of the synthetic articles are never stopwords
+        """
+        return []
+
+
+def _stub_corpora():
+    """
+    Replace the NLTK resources that newselautil loads when it is imported with stubs if they are not installed, so that
+    the benchmark runs offline. Nothing is replaced if the resources are installed
+    :return: None
+    """
+    try:
+        nltk.corpus.stopwords.words('english')
+    except LookupError:
+        nltk.corpus.stopwords = _Stopwords()
+    try:
+        nltk.data.load(PUNKT)
+    except LookupError:
+        load = nltk.data.load
+        nltk.data.load = lambda resource, *args, **kwargs: None if resource == PUNKT else load(resource, *args,
+                                                                                                **kwargs)
+
+
+_stub_corpora()  # before newselautil is imported
+
+import classpaths as path
+import newselautil
+import align
+import euclidean as eu
+import compare
+
+SIZES = {'small': 10, 'medium': 25, 'large': 60}  # the number of paragraphs in the original article of every size
+SEED = 1  # the seed from which the articles are generated
+VOCABULARY = 3000  # the number of distinct words the articles are made of
+COSINE_PAIRS = 500  # the number of pairs of sentences calculate_cosine_similarity is timed on
+REPEATS = 5  # the number of times every function is timed. The fastest time is reported
+MIN_TIME = 0.05  # the function is called as many times as needed to run for at least MIN_TIME seconds, so that fast
+# functions can be timed precisely
+TOLERANCE = 0.2  # compare_reports reports the functions that became more than 20% slower
+REPORT = 'benchmark.json'  # the default names of the report and of the baseline
+BASELINE = 'benchmark-baseline.json'
+REPORT_VERSION = 1  # the version of the format of the report. Reports of different versions are not compared
+
+
+def make_article(nParagraphs, seed):
+    """
+    Generate the synthetic article. The words are drawn from the vocabulary with the probabilities that decrease as in
+    the natural language (Zipf's law), so that some words are shared by many sentences and most words are rare
+    :param nParagraphs: the number of paragraphs
+    :param seed:        the seed of the random generator
+    :return: the list of paragraphs, every paragraph is a list of sentences and every sentence is a list of words
+    """
+    generator = random.Random(seed)
+    weights = numpy.cumsum(1.0 / numpy.arange(1, VOCABULARY + 1))
+    weights /= weights[-1]
+    article = []
+    for p in range(nParagraphs):
+        paragraph = []
+        for s in range(generator.randint(1, 5)):
+            ranks = numpy.searchsorted(weights, [generator.random() for w in range(generator.randint(3, 25))])
+            paragraph.append(['w' + str(rank) for rank in ranks])
+        article.append(paragraph)
+    return article
+
+
+def simplify(article, seed):
+    """
+    Generate the simplified version of the article, so that the two articles can be aligned
+    :param article: the article returned by make_article
+    :param seed:    the seed of the random generator
+    :return: the article in the same format. About 10% of the paragraphs and sentences and 15% of the words are dropped,
+    and a third of the long sentences are split in two
+    """
+    generator = random.Random(seed)
+    simplified = []
+    for paragraph in article:
+        if generator.random() < 0.1:
+            continue
+        sentences = []
+        for sentence in paragraph:
+            if generator.random() < 0.1:
+                continue
+            sentence = [word for word in sentence if generator.random() > 0.15] or sentence[:1]
+            if (len(sentence) > 12) and (generator.random() < 0.3):
+                sentences.append(sentence[:len(sentence) // 2])
+                sentences.append(sentence[len(sentence) // 2:])
+            else:
+                sentences.append(sentence)
+        if len(sentences) > 0:
+            simplified.append(sentences)
+    return simplified if len(simplified) > 0 else article[:1]
+
+
+def write_fixture(article, filename):
+    """
+    Write the article in the format of custom/Tokenizer: every paragraph starts with a @PGPH line, the first paragraph
+    is the title. The lemmas of every sentence are put into newselautil.lemmaCache, so that the sentences do not have to
+    be lemmatized when the article is read
+    :param article:     the article returned by make_article or simplify
+    :param filename:    the name of the .tok file
+    :return: None
+    """
+    with open(filename, 'w') as file:
+        file.write('@PGPH \nTITLE\n')
+        for paragraph in article:
+            file.write('@PGPH \n')
+            for sentence in paragraph:
+                file.write(' '.join(sentence) + '\n')
+                newselautil.lemmaCache.put(' '.join(sentence), sentence)
+    newselautil.lemmaCache.put('TITLE', ['TITLE'])
+
+
+def measure(function, repeats=REPEATS, minTime=MIN_TIME):
+    """
+    :param function:    the function without parameters to time
+    :param repeats:     the number of times to time the function
+    :param minTime:     the minimum time of one measurement in seconds (see MIN_TIME)
+    :return: the time one call of the function takes in seconds (the fastest of the repeats)
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= minTime:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(minTime / elapsed) + 1)
+    times = [elapsed] + timer.repeat(repeats - 1, number)
+    return min(times) / number
+
+
+def _parameters():
+    """
+    :return: the values of the constants of align.py that affect the timed functions
+    """
+    return dict((name, getattr(align, name)) for name in ['USE_CONCENTRATION', 'CONCENTRATION_MODIFIER',
+                                                          'BATCHED_SIMILARITY', 'VICINITIES', 'SENTENCE_VICINITIES'])
+
+
+def _reset_similarities():
+    """Forget all the similarities calculated by paragraph_similarity"""
+    align.parSim.fill(-1)
+    align.sentSim.fill(-1)
+
+
+def _pairwise_similarities(nParagraphs0, nParagraphs1):
+    """Calculate the similarity between every pair of paragraphs from scratch"""
+    _reset_similarities()
+    for par0 in range(nParagraphs0):
+        for par1 in range(nParagraphs1):
+            align.paragraph_similarity(par0, par1)
+
+
+def _euclidean_calculate(n):
+    """Create the euclidean array for the n*n matrix from scratch"""
+    eu.resize(0, 0, [], [])
+    eu.calculate(n, n, list(align.VICINITIES), list(align.SENTENCE_VICINITIES))  # copies, since calculate might
+    # extend them
+
+
+def _result_matrix(n0, n1, seed):
+    """
+    :return: the matrix of paragraph alignments for extract_results: mostly one-to-one alignments along the diagonal,
+    every fifth of them merged with the next paragraph of the first or of the second article
+    """
+    generator = random.Random(seed)
+    matrix = numpy.zeros((n0, n1), dtype=numpy.bool_)
+    for i in range(min(n0, n1)):
+        matrix[i][i] = True
+        if generator.random() < 0.2:
+            if generator.random() < 0.5:
+                matrix[min(i + 1, n0 - 1)][i] = True
+            else:
+                matrix[i][min(i + 1, n1 - 1)] = True
+    return matrix
+
+
+def _extract_results(matrix):
+    """Extract the paragraph alignments from a copy of the matrix (extract_results empties the matrix)"""
+    align.parResultMatrix = matrix.copy()
+    align.extract_results()
+
+
+def _statistics_matrix(rows, columns, seed):
+    """
+    :return: the sentence matrix for createStstistics: one alignment per row, most of them made both by the computer
+    and manually
+    """
+    generator = numpy.random.RandomState(seed)
+    matrix = numpy.zeros((rows, columns), dtype=numpy.uint8)
+    positions = numpy.minimum((numpy.arange(rows) * columns) // rows + generator.randint(-1, 2, rows), columns - 1)
+    positions = numpy.maximum(positions, 0)
+    matrix[numpy.arange(rows), positions] = generator.choice([compare.AUTO, compare.MAN, compare.MAN_AND_AUTO], rows,
+                                                             p=[0.15, 0.15, 0.7])
+    return matrix
+
+
+def _benchmark_size(name, nParagraphs, directory, repeats):
+    """
+    Time all the functions for one size of the articles
+    :param name:        the name of the size
+    :param nParagraphs: the number of paragraphs in the original article
+    :param directory:   the directory with the articles (BASEDIR of the fixtures)
+    :param repeats:     see measure
+    :return: the dictionary with the time of every function (see benchmark)
+    """
+    original = make_article(nParagraphs, SEED + nParagraphs)
+    articles = [original, simplify(original, SEED + nParagraphs + 1)]
+    rows = []
+    for level in range(len(articles)):
+        filename = name + '.en.' + str(level) + '.txt'
+        write_fixture(articles[level], os.path.join(directory, 'articles', filename + '.tok'))
+        rows.append({'filename': filename})
+    paragraphs = [newselautil.getTokParagraphs(row) for row in rows]
+    align.set_up(paragraphs[0], paragraphs[1])
+    n0, n1 = len(align.v[0]), len(align.v[1])
+    times = {}
+
+    generator = random.Random(SEED)
+    vectors = ([vector for par in range(n0) for vector in align.paragraph_tf_idf(0, [par])],
+               [vector for par in range(n1) for vector in align.paragraph_tf_idf(1, [par])])
+    pairs = [(vectors[0][generator.randrange(len(vectors[0]))], vectors[1][generator.randrange(len(vectors[1]))])
+             for i in range(COSINE_PAIRS)]
+    times['align.calculate_cosine_similarity'] = measure(
+        lambda: [align.calculate_cosine_similarity(v0, v1) for v0, v1 in pairs], repeats)
+    times['align.build_tf_idf'] = measure(
+        lambda: [align.build_tf_idf(align.v[k][par], align.parFreq[k][par], align.wordsTotal[k][par])
+                 for k in range(2) for par in range(len(align.v[k]))], repeats)
+    times['align.paragraph_similarity'] = measure(lambda: _pairwise_similarities(n0, n1), repeats)
+
+    size = max(n0, n1)
+    times['euclidean.calculate'] = measure(lambda: _euclidean_calculate(size), repeats)
+    _euclidean_calculate(size)
+    never = lambda start, point, parameters=None: False
+    times['euclidean.closest'] = measure(lambda: eu.closest((0, 0), 0, size, size, never), repeats)
+    times['euclidean.closest-batched'] = measure(
+        lambda: eu.closest((0, 0), 0, size, size, never, [],
+                           lambda start, x, y, parameters: numpy.zeros(len(x), dtype=numpy.bool_)), repeats)
+
+    matrix = _result_matrix(n0, n1, SEED)
+    times['align.extract_results'] = measure(lambda: _extract_results(matrix), repeats)
+    matrix = _statistics_matrix(align.sInd[0][-1], align.sInd[1][-1], SEED)
+    times['compare.createStstistics'] = measure(lambda: compare.createStstistics(matrix), repeats)
+    return times, {'paragraphs': [n0, n1], 'sentences': [int(align.sInd[0][-1]), int(align.sInd[1][-1])]}
+
+
+def benchmark(sizes=SIZES, repeats=REPEATS):
+    """
+    Generate the articles of every size in a temporary directory and time all the functions on them. The paths in
+    classpaths are restored afterwards
+    :param sizes:   the dictionary, where for every name of the size the number of paragraphs is stored
+    :param repeats: see measure
+    :return: the report: the dictionary with the version of the format, the description of the machine and of the
+    fixtures, and 'results', where for every function, for every size the time of one call in seconds is stored
+    """
+    directory = tempfile.mkdtemp(prefix='benchmark')
+    saved = (path.BASEDIR, path.OUTDIR_EUCLIDEAN)
+    path.BASEDIR = directory
+    path.OUTDIR_EUCLIDEAN = os.path.join(directory, 'none') + '/'  # the euclidean arrays are never read from the disk
+    os.makedirs(os.path.join(directory, 'articles'))
+    report = {'version': REPORT_VERSION, 'python': platform.python_version(), 'numpy': numpy.__version__,
+              'machine': platform.machine(), 'seed': SEED, 'repeats': repeats, 'parameters': repr(_parameters()),
+              'fixtures': {}, 'results': {}}
+    try:
+        for name in sorted(sizes, key=sizes.get):
+            times, fixture = _benchmark_size(name, sizes[name], directory, repeats)
+            report['fixtures'][name] = fixture
+            for function in times:
+                report['results'].setdefault(function, {})[name] = times[function]
+            print("Timed " + name + " articles (" + str(fixture['paragraphs'][0]) + " and " +
+                  str(fixture['paragraphs'][1]) + " paragraphs)")
+    finally:
+        path.BASEDIR, path.OUTDIR_EUCLIDEAN = saved
+        eu.resize(0, 0, [], [])  # the arrays created for the benchmark should not be used by the alignment
+        shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+def write_report(report, filename):
+    """
+    Write the report returned by benchmark to the file as JSON
+    :return: None
+    """
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    os.rename(filename + '.tmp', filename)
+
+
+def read_report(filename):
+    """
+    :return: the report written by write_report
+    """
+    with open(filename) as file:
+        return json.load(file)
+
+
+def compare_reports(report, baseline, tolerance=TOLERANCE):
+    """
+    Compare the times in the report with the times in the baseline. Only the functions and the sizes that are in both
+    reports are compared
+    :param report:      the report returned by benchmark
+    :param baseline:    the report to compare with (e.g. read by read_report)
+    :param tolerance:   the function is reported as slower if it takes more than (1 + tolerance) times as long
+    :return: the list of tuples (function, size, time in the baseline, time in the report, ratio) for all the compared
+    functions and sizes, sorted by the ratio, and the list of the same tuples for those that became slower
+    """
+    if baseline.get('version') != report.get('version'):
+        print("The baseline was written in another format and cannot be compared")
+        return [], []
+    comparison = []
+    for function in sorted(report['results']):
+        for size in sorted(report['results'][function]):
+            if size not in baseline['results'].get(function, {}):
+                continue
+            old = baseline['results'][function][size]
+            new = report['results'][function][size]
+            comparison.append((function, size, old, new, new / old if old > 0 else float('inf')))
+    comparison.sort(key=lambda row: -row[4])
+    return comparison, [row for row in comparison if row[4] > 1 + tolerance]
+
+
+def main(reportFile=REPORT, baselineFile=BASELINE):
+    """
+    Run the benchmark, print the times, write the report and compare it with the baseline if it exists
+    :param reportFile:      the file to write the report to
+    :param baselineFile:    the report to compare with
+    :return: the list of functions that became slower (see compare_reports)
+    """
+    report = benchmark()
+    sizes = sorted(SIZES, key=SIZES.get)
+    print('function'.ljust(36) + ''.join(size.rjust(14) for size in sizes))
+    for function in sorted(report['results']):
+        print(function.ljust(36) + ''.join(('%.3f ms' % (report['results'][function][size] * 1000)).rjust(14)
+                                           for size in sizes))
+    write_report(report, reportFile)
+    if not os.path.exists(baselineFile):
+        print("No baseline in " + baselineFile + ". Copy " + reportFile + " there to compare the next runs with it")
+        return []
+    comparison, slower = compare_reports(report, read_report(baselineFile))
+    for function, size, old, new, ratio in comparison:
+        print(function.ljust(36) + size.rjust(8) + ('x%.2f' % ratio).rjust(10) + ('  SLOWER' if ratio > 1 + TOLERANCE
+                                                                                   else ''))
+    return slower
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -7,6 +7,7 @@ USERDIR = '/home/nlp'
 if sys.platform == 'darwin': USERDIR = '/Users/alexanderfedchin'
 BASEDIR = USERDIR + '/newsela'
 METAFILE = BASEDIR + '/articles_metadata.csv'
+METAFILE_INDEX = BASEDIR + '/articles_metadata.index'  # the parsed METAFILE (see newselautil.loadMetafileIndex)
 PARSERDIR = BASEDIR + '/stanford-parser-full-2015-12-09/'
 OUTDIR_SENTENCES = BASEDIR+'/output/sentences/'
 OUTDIR_PARAGRAPHS = BASEDIR+'/output/paragraphs/'
@@ -15,11 +16,21 @@ OUTDIR_PRECALCULATED = OUTDIR_NGRAMS+'ngramsByFile/'
 OUTDIR_TO_DELETE = OUTDIR_NGRAMS+'toDelete/'
 OUTDIR_TOK_NGRAMS = OUTDIR_NGRAMS+'tokenizedForNgrams/'
 OUTDIR_PERPLEX = OUTDIR_NGRAMS+'perplexity/'
+OUTDIR_PERPLEX_STORE = OUTDIR_NGRAMS+'perplexityStore/'  # the binary store of the perplexities (see store.py)
 MANUAL_SENTENCES = BASEDIR+'/manual/sentences/new_format/'
 MANUAL_PARAGRAPHS = BASEDIR+'/manual/paragraphs/'
+ALIGN_MANIFEST = BASEDIR+'/output/manifest.tsv'  # which pairs of articles were aligned and how (see align.load_manifest)
+OUTDIR_STORE = BASEDIR+'/output/store/'  # the binary store of the alignments (see store.py and align.OUTPUT_FORMAT)
+SEARCH_RESULTS = BASEDIR+'/output/search.csv'  # the ranked configurations of align.py tried by compare.search
+OUTDIR_SIMILARITIES = BASEDIR+'/output/similarities/'  # the stored similarities between sentences (see store.py)
+OUTDIR_EUCLIDEAN = BASEDIR+'/output/euclidean/'  # the orderings of matrix elements calculated by euclidean.py
+LEMMA_STORE = BASEDIR+'/output/lemmas'  # the store of lemmatized sentences used by newselautil.use_lemma_store
 
 PARSERPROG = 'custom/Parser'
 TOKENIZERPROG = 'custom/Tokenizer'
+BATCH_PARSERPROG = 'custom/BatchParser'  # same as PARSERPROG, but processes many files (see StanfordParse.start_workers)
+BATCH_TOKENIZERPROG = 'custom/BatchTokenizer'  # same for TOKENIZERPROG
+MODELS = 'edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz'  # the parser model from the models jar
 
 CLASSPATH = ':'.join(['.',PARSERDIR,PARSERDIR + 'stanford-parser.jar',PARSERDIR + 'stanford-parser-3.6.0-models.jar', PARSERDIR + 'slf4j-api.jar'])
 
@@ -7,6 +7,9 @@ alignment and return #true_positives, #false_positives, #false_negatives, precis
 createStatistics(matrix): Return #true_positives, #false_positives, #false_negatives, precision, recall, and fmeasure
 for a given matrix.
 
+statistics(truePositive, falsePositive, falseNegative): same, for the given numbers of true and false positives and
+false negatives
+
 absp(int par, int sent, boolean inFirstArticle): converts the sentence's position from that given relative to the
 beginning of paragraph to that given by the sentence's absolute position in the document
 
@@ -14,15 +17,46 @@ fillMatrix(matrix, lines, startId, changes, paragraphs, stopline="\n"): Read the
 output file and then change the entries of the matrix that have these coordinates according to the given rules
 (the rules are determined by the parameter called "changes")
 
-analyse(slugs, parameters_for_align) - runs align.py on the test data several times until it finds the optimal
-constants' values. Takes a lot of time to run.
+analyse(slugs, parameters_for_align) - replays the alignment of the test data with different values of the constants
+until it finds the optimal ones (see sweep).
+
+read_pairs(lines, startId, paragraphs, sentenceIndexes=None, stopline="\n") - read the coordinates from the align
+algorithm output file as the array of aligned pairs
+
+evaluate(man, auto, paragraphs) - same as compare, but the alignments are compared as sets of pairs without the matrix
+
+evaluate_titles(titles, paragraphs, workers=1) - evaluate all the titles and return the results for every title, the
+macro averages and the micro averages
+
+title_key(title) - the slug and the levels of the alignment file
+
+alignment_pairs(alignment, paragraphs) - same as read_pairs, but for the alignment kept in memory (see align.replay)
+
+evaluate_alignments(titles, alignments, paragraphs) - same as evaluate_titles for the alignments kept in memory
 
-main(titles, paragraphs, printDetailedStats = True) - get a list of titles and compare pairs of documents with these
-titles, some in OUTPUT directory, others in MANUAL directory. If these are files with paragraph alignment,
+sweep(titles, pairs, settings, paragraphs) - evaluate the alignment replayed with every given set of values of the
+constants in align.py (see align.prepare_replay)
+
+configurations(grid=None, ranges=None, samples=0, seed=0) - the list of the sets of values of the constants in
+align.py to try: all the combinations of the values in the grid and the given number of random points in the ranges
+
+search(titles, slugs, settings, paragraphs=False, workers=1, eta=3, minSlugs=2, seed=0, output=path.SEARCH_RESULTS) -
+evaluate the sets of values on a process pool with successive halving and write the ranked table to the output file
+
+write_search(ranked, output) - write the table returned by search to the csv file
+
+main(titles, paragraphs, printDetailedStats = True, workers=1) - get a list of titles and compare pairs of documents
+with these titles, some in OUTPUT directory, others in MANUAL directory. If these are files with paragraph alignment,
 then paragraphs==True, otherwise paragraphs==False. Return the average fmeasure.
 """
 
 import classpaths as path
+import csv
+import itertools
+import math
+import multiprocessing
+import os
+import random
 import numpy
 import re
 import align
@@ -36,6 +70,7 @@ EMPTY = 0  # the value that is stored in the matrix if the particular pair of se
 AUTO = 1  # if it was only aligned by the computer
 MAN = 2  # if it was only aligned manually
 MAN_AND_AUTO = 3  # if it was aligned both by the computer and manually
+PAIR_BASE = 2 ** 32  # the aligned pair (i, j) is stored as i * PAIR_BASE + j by read_pairs
 sInd = None  # A tuple of two elements. 0-th element is a list, where for every paragraph in the first article,
 # the number of sentences that occurred in a document before the beginning of this paragraph is given. 1-st element
 # contains the same information  about the second article. This variable is only used for sentence alignment comparisons
@@ -76,21 +111,15 @@ def createStstistics(matrix):
     :param printStats:  if true, print calculated results
     :return: precision, recall, fmeasure
     """
-    truePositive = 0
-    falsePositive = 0
-    falseNegative = 0
-    i = 0
-    while i < len(matrix):
-        j = 0
-        while j < len(matrix[i]):
-            if matrix[i][j] == AUTO:
-                falsePositive += 1
-            elif matrix[i][j] == MAN:
-                falseNegative += 1
-            elif matrix[i][j] == MAN_AND_AUTO:
-                truePositive += 1
-            j += 1
-        i += 1
+    matrix = numpy.asarray(matrix)
+    return statistics(int((matrix == MAN_AND_AUTO).sum()), int((matrix == AUTO).sum()), int((matrix == MAN).sum()))
+
+
+def statistics(truePositive, falsePositive, falseNegative):
+    """
+    calculate the precision, recall and fmeasure from the number of true positives, false positives and false negatives
+    :return: truePositive, falsePositive, falseNegative, precision, recall, fmeasure
+    """
     if truePositive == 0:
        recall = 0
        precision = 0
@@ -167,51 +196,365 @@ def fillMatrix(matrix, lines, startId, changes, paragraphs, stopline="\n"):
         i += 1
 
 
-def main(titles, paragraphs, printDetailedStats = True):
+def read_pairs(lines, startId, paragraphs, sentenceIndexes=None, stopline="\n"):
     """
-    get a list of titles and compare pairs of documents with these titles, some in the OUTPUT directory, others
-    in the MANUAL directory
-    :param titles:      the full names of the files (with extension)
-    :param paragraphs:  true if the files to compare are those with aligned paragraphs. If the files are with aligned
-    sentences, then paragraphs is false
-    :param printDetailedStats: if True, print the recall, precision and fmeasure for every single articles. Otherwise,
-    only print the average values
-    :return: average f measure for all comparisons
+    Read the coordinates from the align algorithm output file (or from the file with the manual alignment) the same way
+    as fillMatrix does, but return them as the set of aligned pairs instead of filling the matrix
+    :param lines:           the lines to read from
+    :param startId:         the first line to read in lines
+    :param paragraphs:      true if the lines contain the aligned paragraphs, false if they contain aligned sentences
+    :param sentenceIndexes: the tuple of two arrays with the number of sentences that occur before every paragraph (see
+    sInd). Only used for the sentence alignments
+    :param stopline:        the line in the input after which the program should stop reading
+    :return: the sorted array of unique pairs. Every pair (i, j) of zero-based positions is stored as one int64 number
+    i * PAIR_BASE + j
+    """
+    end = startId
+    while (end < len(lines)) and (lines[end] != stopline):
+        end += 1
+    if paragraphs:
+        pairs = []
+        for line in lines[startId:end]:
+            line = line.split("\t")
+            if len(line) != 3:
+                print("every line should contain two sets of numbers. The sets should be separated by the double tab," +
+                      " the numbers within the sets - by commas. The line entered was \n"+"\t".join(line))
+                break
+            second = [int(par1) - 1 for par1 in re.findall(r'\d+', line[2])]  # one-indexed to zero-indexed
+            pairs += [(int(par0) - 1) * PAIR_BASE + par1 for par0 in re.findall(r'\d+', line[0]) for par1 in second]
+        return numpy.unique(numpy.array(pairs, dtype=numpy.int64))
+    numbers = numpy.array(re.findall(r'\d+', ' '.join(lines[startId:end])), dtype=numpy.int64)
+    if len(numbers) % 4 != 0:
+        print("every sentence alignment should contain four numbers: the paragraph and the sentence for both articles")
+        numbers = numbers[:len(numbers) - len(numbers) % 4]
+    numbers = numbers.reshape(-1, 4)
+    first = numpy.asarray(sentenceIndexes[0], dtype=numpy.int64)[numbers[:, 0] - 1] + numbers[:, 1] - 1  # see absp
+    second = numpy.asarray(sentenceIndexes[1], dtype=numpy.int64)[numbers[:, 2] - 1] + numbers[:, 3] - 1
+    return numpy.unique(first * PAIR_BASE + second)
+
+
+def evaluate(man, auto, paragraphs):
+    """
+    Same as compare, but the alignments are compared as sets of aligned pairs, so no matrix is created
+    :param man:         the list of lines of the result obtained by manual alignments
+    :param auto:        the list of lines of the results obtained automatically
+    :param paragraphs:  true if the files to compare are those with aligned paragraphs
+    :return: truePositive, falsePositive, falseNegative, precision, recall, fmeasure
     """
-    avg_precision = 0  # all the precision values will be added to this value. In the end, this value will be divided by
-    # the number of comparisons analysed to report the average precision
-    avg_recall = 0
-    avg_fmeasure = 0
+    if paragraphs:
+        autoPairs = read_pairs(auto, 2, True)
+        manPairs = read_pairs(man, 1, True)
+    else:
+        sentenceIndexes = (list(map(int, auto[1].split())), list(map(int, auto[2].split())))
+        autoPairs = read_pairs(auto, 3, False, sentenceIndexes)
+        manPairs = read_pairs(man, 1, False, sentenceIndexes)
+    truePositive = len(numpy.intersect1d(autoPairs, manPairs, assume_unique=True))
+    return statistics(truePositive, len(autoPairs) - truePositive, len(manPairs) - truePositive)
+
+
+def _evaluate_file(task):
+    """
+    Compare the manual and the automatic alignment in the given files. Can be called by a worker process
+    :param task:    the tuple (the file with the manual alignment, the file with the automatic one, paragraphs)
+    :return:        same as evaluate
+    """
+    with open(task[0]) as m:
+        with open(task[1]) as a:
+            return evaluate(m.readlines(), a.readlines(), task[2])
+
 
+def evaluate_titles(titles, paragraphs, workers=1):
+    """
+    Compare the manual and the automatic alignments for all the titles and calculate the averages
+    :param titles:      the full names of the files (with extension), see main
+    :param paragraphs:  true if the files to compare are those with aligned paragraphs
+    :param workers:     the number of processes that compare the files. If workers = 1, everything is done in this
+    process, which is faster unless there are many titles
+    :return: the list of the results of evaluate for every title, the macro averages (the average precision, recall and
+    fmeasure of all the titles) and the micro averages (the precision, recall and fmeasure of all the aligned pairs from
+    all the titles taken together)
+    """
     if paragraphs:
         manual_directory = path.MANUAL_PARAGRAPHS
         auto_directory = path.OUTDIR_PARAGRAPHS
     else:
         manual_directory = path.MANUAL_SENTENCES
         auto_directory = path.OUTDIR_SENTENCES
+    tasks = [(manual_directory + title, auto_directory + title, paragraphs) for title in titles]
+    if (workers > 1) and (len(tasks) > 1):
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        try:
+            results = pool.map(_evaluate_file, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_evaluate_file(task) for task in tasks]
+    return _averages(results)
+
+
+def _averages(results):
+    """
+    :param results: the list of the results of evaluate
+    :return: the results, the macro averages and the micro averages (see evaluate_titles)
+    """
+    if len(results) == 0:
+        return results, (0, 0, 0), (0, 0, 0)
+    values = numpy.array(results, dtype=numpy.float64)
+    macro = tuple(values[:, 3:].mean(axis=0))
+    micro = statistics(*[int(total) for total in values[:, :3].sum(axis=0)])[3:]
+    return results, macro, micro
+
+
+def title_key(title):
+    """
+    :param title:   the name of the file with the alignment, e.g. slug-cmp-0-1.csv
+    :return:        the tuple (slug, lower level, higher level)
+    """
+    slug, levels = title.rsplit('-cmp-', 1)
+    levels = levels.split('.')[0].split('-')
+    return slug, int(levels[0]), int(levels[1])
+
 
+def alignment_pairs(alignment, paragraphs):
+    """
+    Same as read_pairs, but for the results of the alignment kept in memory
+    :param alignment:   the tuple (result, parResult, sInd) returned by align.replay
+    :param paragraphs:  true if the paragraph alignments are needed, false if the sentence alignments are needed
+    :return: the sorted array of unique pairs (see read_pairs)
+    """
+    if paragraphs:
+        pairs = [par0 * PAIR_BASE + par1 for a in alignment[1] for par0 in a[0] for par1 in a[1]]
+        return numpy.unique(numpy.array(pairs, dtype=numpy.int64))
+    sentences = numpy.array([[a[0][0], a[0][1], a[1][0], a[1][1]] for block in alignment[0] for a in block],
+                            dtype=numpy.int64).reshape(-1, 4)
+    first = numpy.asarray(alignment[2][0], dtype=numpy.int64)[sentences[:, 0]] + sentences[:, 1]
+    second = numpy.asarray(alignment[2][1], dtype=numpy.int64)[sentences[:, 2]] + sentences[:, 3]
+    return numpy.unique(first * PAIR_BASE + second)
+
+
+_manualPairs = {}  # the pairs read from the files with the manual alignments by evaluate_alignments. The files are
+# only read again if they were modified
+
+
+def evaluate_alignments(titles, alignments, paragraphs):
+    """
+    Same as evaluate_titles, but the automatic alignments are taken from memory instead of the files (see align.replay)
+    :param titles:      the full names of the files with the manual alignments (with extension)
+    :param alignments:  the dictionary returned by align.replay
+    :param paragraphs:  true if the paragraph alignments are compared
+    :return: same as evaluate_titles
+    """
+    manual_directory = path.MANUAL_PARAGRAPHS if paragraphs else path.MANUAL_SENTENCES
+    results = []
     for title in titles:
-        with open(manual_directory + title) as m:
-            with open(auto_directory + title) as a:
-                tPositive, fPositive, fNegative, precision, recall, fmeasure = \
-                    compare(m.readlines(), a.readlines(), paragraphs)
-                avg_precision += precision
-                avg_recall += recall
-                avg_fmeasure += fmeasure
-                if printDetailedStats:  # then report precision and recall for every individual article
-                    print("comparing " + title)
-                    print("tp=" + str(tPositive) + " fn=" + str(fNegative) + " fp=" + str(fPositive))
-                    print("precision=" + str(round(precision, 5)) + "\t\t recall=" + str(
-                        round(recall, 5)) + "\t\t fmeasure=" + str(round(fmeasure, 5)) + " \n\n")
-    print("AVERAGE_PRECISION=" + str(round(avg_precision/len(titles), 5)) + "\t\t AVERAGE_RECALL="
-              + str(round(avg_recall/len(titles), 5)) + "\t\t AVERAGE_F_MEASURE="
-              + str(round(avg_fmeasure/len(titles), 5)))
-    return avg_fmeasure/len(titles)
+        alignment = alignments[title_key(title)]
+        sentenceIndexes = None if paragraphs else (list(alignment[2][0]), list(alignment[2][1]))
+        key = (manual_directory + title, paragraphs)
+        modified = os.path.getmtime(manual_directory + title)
+        if (key not in _manualPairs) or (_manualPairs[key][0] != modified) or \
+                (_manualPairs[key][1] != sentenceIndexes):
+            with open(manual_directory + title) as m:
+                _manualPairs[key] = (modified, sentenceIndexes, read_pairs(m.readlines(), 1, paragraphs,
+                                                                           sentenceIndexes))
+        manPairs = _manualPairs[key][2]
+        autoPairs = alignment_pairs(alignment, paragraphs)
+        truePositive = len(numpy.intersect1d(autoPairs, manPairs, assume_unique=True))
+        results.append(statistics(truePositive, len(autoPairs) - truePositive, len(manPairs) - truePositive))
+    return _averages(results)
+
+
+def sweep(titles, pairs, settings, paragraphs):
+    """
+    Align the articles with every given set of values of the constants in align.py and evaluate the results. The
+    similarities are calculated once (see align.prepare_replay), and only the decisions of the algorithm are repeated
+    for every set of values, so nothing is written to the files
+    :param titles:      the full names of the files with the manual alignments (with extension)
+    :param pairs:       the list returned by align.prepare_replay for the slugs of these titles
+    :param settings:    the list of dictionaries, where the names of the constants (e.g. 'ALPHA', 'ALPHA2', 'BETHA')
+    are the keys
+    :param paragraphs:  true if the paragraph alignments are evaluated, false if the sentence alignments are
+    :return: the list of tuples (settings, macro averages, micro averages), one for every dictionary in settings. The
+    constants in align.py are restored afterwards
+    """
+    original = {}
+    scores = []
+    try:
+        for setting in settings:
+            for name in setting:
+                if name not in original:
+                    original[name] = getattr(align, name)
+                setattr(align, name, setting[name])
+            results, macro, micro = evaluate_alignments(titles, align.replay(pairs), paragraphs)
+            scores.append((setting, macro, micro))
+    finally:
+        for name in original:
+            setattr(align, name, original[name])
+    return scores
+
+
+def configurations(grid=None, ranges=None, samples=0, seed=0):
+    """
+    Create the sets of values of the constants in align.py for search
+    :param grid:    the dictionary, where the names of the constants are the keys and the lists of the values to try are
+    the values. Every combination of these values is returned
+    :param ranges:  the dictionary, where the names of the constants are the keys and the tuples (minimum, maximum) are
+    the values
+    :param samples: the number of random sets of values to add. The value of every constant in ranges is drawn
+    uniformly from its range
+    :param seed:    the seed of the random generator, so that the same sets are drawn every time
+    :return: the list of dictionaries (see sweep), first the grid, then the random sets
+    """
+    settings = []
+    if grid:
+        names = sorted(grid)
+        for values in itertools.product(*[grid[name] for name in names]):
+            settings.append(dict(zip(names, values)))
+    if ranges and (samples > 0):
+        generator = random.Random(seed)
+        names = sorted(ranges)
+        for i in range(samples):
+            settings.append(dict((name, round(generator.uniform(ranges[name][0], ranges[name][1]), 4))
+                                 for name in names))
+    return settings
+
+
+_searchPairs = None  # the PairSimilarities of all the slugs used by search. They are calculated once in the main
+# process and inherited by the processes of the pool (or calculated again by _init_search if they are not inherited)
+
+
+def _init_search(slugs):
+    """
+    Calculate the similarities for search in a process of the pool, unless they were inherited from the main process
+    :param slugs: the slugs that are evaluated by search
+    :return: None
+    """
+    global _searchPairs
+    if _searchPairs is None:
+        _searchPairs = align.prepare_replay(slugs)
+
+
+def _score_setting(task):
+    """
+    Evaluate one set of values on some of the slugs. Called by search, possibly in another process
+    :param task: the tuple (the dictionary with the values, titles, slugs, paragraphs) (see search)
+    :return: the tuple (macro averages, micro averages) returned by sweep
+    """
+    setting, titles, slugs, paragraphs = task
+    slugs = set(slugs)
+    pairs = [pair for pair in _searchPairs if pair.slug in slugs]
+    return sweep(titles, pairs, [setting], paragraphs)[0][1:]
+
+
+def search(titles, slugs, settings, paragraphs=False, workers=1, eta=3, minSlugs=2, seed=0,
+           output=path.SEARCH_RESULTS):
+    """
+    Find the best values of the constants in align.py with successive halving. All the sets of values are evaluated on
+    minSlugs slugs first, then the best 1/eta of them are evaluated on eta times more slugs, and so on until the
+    remaining sets are evaluated on all the slugs. The slugs are shuffled once, so every round uses the slugs of the
+    previous one and some new ones. The sets of values of one round are evaluated in parallel. Every evaluation replays
+    the alignment (see sweep), so the similarities are calculated only once
+    :param titles:      the full names of the files with the manual alignments (with extension)
+    :param slugs:       the slugs of these files
+    :param settings:    the list of dictionaries with the values of the constants (see configurations)
+    :param paragraphs:  true if the sets of values are compared by the paragraph alignments, false if by the sentence
+    alignments
+    :param workers:     the number of processes that evaluate the sets of values. If 1, everything is done in this
+    process
+    :param eta:         the fraction of the sets of values that are dropped after every round is 1 - 1/eta
+    :param minSlugs:    the number of slugs in the first round
+    :param seed:        the seed for shuffling the slugs
+    :param output:      the csv file to write the ranked table to. If None, the table is not written
+    :return: the ranked list of tuples (setting, number of slugs, macro averages, micro averages): the sets that were
+    evaluated on more slugs first, and by the macro fmeasure among those evaluated on the same slugs. The constants in
+    align.py are not changed
+    """
+    global _searchPairs
+    slugs = list(slugs)
+    random.Random(seed).shuffle(slugs)
+    _searchPairs = align.prepare_replay(slugs)
+    pool = multiprocessing.Pool(workers, _init_search, (slugs,)) if workers > 1 else None
+    scores = {}  # for every set of values (by its position in settings) the last tuple (slugs, macro, micro)
+    remaining = list(range(len(settings)))
+    size = min(max(minSlugs, 1), len(slugs))
+    try:
+        while len(remaining) > 0:
+            subset = slugs[:size]
+            subsetTitles = [title for title in titles if title_key(title)[0] in subset]
+            tasks = [(settings[i], subsetTitles, subset, paragraphs) for i in remaining]
+            results = pool.map(_score_setting, tasks, 1) if pool is not None else list(map(_score_setting, tasks))
+            for i, result in zip(remaining, results):
+                scores[i] = (size,) + tuple(result)
+            print("Evaluated " + str(len(remaining)) + " sets of values on " + str(size) + " slugs")
+            if size >= len(slugs):
+                break
+            remaining.sort(key=lambda i: (-scores[i][1][2], -scores[i][2][2]))
+            remaining = remaining[:int(math.ceil(len(remaining) / float(eta)))]
+            size = min(size * eta, len(slugs))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _searchPairs = None
+    order = sorted(scores, key=lambda i: (-scores[i][0], -scores[i][1][2], -scores[i][2][2]))
+    ranked = [(settings[i],) + scores[i] for i in order]
+    if output is not None:
+        write_search(ranked, output)
+    return ranked
+
+
+def write_search(ranked, output):
+    """
+    Write the result of search to the csv file: the rank, the values of the constants, the number of slugs, the macro
+    precision, recall and fmeasure and the micro ones, one set of values per line
+    :param ranked: the list returned by search
+    :param output: the name of the file. It is written under a temporary name first and then renamed
+    :return: None
+    """
+    names = sorted(set(name for row in ranked for name in row[0]))
+    with open(output + '.tmp', 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow(['rank'] + names + ['slugs', 'MACRO_PRECISION', 'MACRO_RECALL', 'MACRO_FMEASURE',
+                                            'MICRO_PRECISION', 'MICRO_RECALL', 'MICRO_FMEASURE'])
+        for rank, row in enumerate(ranked):
+            writer.writerow([rank + 1] + [row[0].get(name, '') for name in names] + [row[1]] + list(row[2]) +
+                            list(row[3]))
+    os.rename(output + '.tmp', output)
+
+
+def main(titles, paragraphs, printDetailedStats = True, workers=1):
+    """
+    get a list of titles and compare pairs of documents with these titles, some in the OUTPUT directory, others
+    in the MANUAL directory
+    :param titles:      the full names of the files (with extension)
+    :param paragraphs:  true if the files to compare are those with aligned paragraphs. If the files are with aligned
+    sentences, then paragraphs is false
+    :param printDetailedStats: if True, print the recall, precision and fmeasure for every single articles. Otherwise,
+    only print the average values (both the macro and the micro averages, see evaluate_titles)
+    :param workers: the number of processes that compare the files (see evaluate_titles)
+    :return: average f measure for all comparisons
+    """
+    results, macro, micro = evaluate_titles(titles, paragraphs, workers)
+    for title, result in zip(titles, results):
+        tPositive, fPositive, fNegative, precision, recall, fmeasure = result
+        if printDetailedStats:  # then report precision and recall for every individual article
+            print("comparing " + title)
+            print("tp=" + str(tPositive) + " fn=" + str(fNegative) + " fp=" + str(fPositive))
+            print("precision=" + str(round(precision, 5)) + "\t\t recall=" + str(
+                round(recall, 5)) + "\t\t fmeasure=" + str(round(fmeasure, 5)) + " \n\n")
+    print("AVERAGE_PRECISION=" + str(round(macro[0], 5)) + "\t\t AVERAGE_RECALL="
+              + str(round(macro[1], 5)) + "\t\t AVERAGE_F_MEASURE="
+              + str(round(macro[2], 5)))
+    print("MICRO_PRECISION=" + str(round(micro[0], 5)) + "\t\t MICRO_RECALL="
+              + str(round(micro[1], 5)) + "\t\t MICRO_F_MEASURE="
+              + str(round(micro[2], 5)))
+    return macro[2]
 
 
 def analize(slugs, parameters_for_align, alpha_variability, alpha2_variability, beta_variability):
     """
-    Automatically find the best values for constants in align.py
+    Automatically find the best values for constants in align.py. The articles are not aligned again for every value,
+    the alignment is replayed from the similarities calculated once (see sweep)
     :param slugs: the slugs that were aligned manually and automatically (this list is passed as a parameter to the main
     function)
     :param parameters_for_align: essentially the same list but in a different format needed for align.py
@@ -221,14 +564,13 @@ def analize(slugs, parameters_for_align, alpha_variability, alpha2_variability,
     :param beta_variability: same for betha
     :return: None
     """
+    pairs = align.prepare_replay(parameters_for_align)  # the similarities are calculated once for all the values
     i = alpha_variability[0]
     bestI = 0
     bestResult = 0
     while i < alpha_variability[1]:
         print("ALPHA="+str(i))
-        align.ALPHA = i
-        align.align_particular(parameters_for_align)
-        current=main(slugs, True, False)
+        current = sweep(slugs, pairs, [{'ALPHA': i}], True)[0][1][2]
         if current>bestResult:
             bestResult = current
             bestI = i
@@ -239,9 +581,7 @@ def analize(slugs, parameters_for_align, alpha_variability, alpha2_variability,
     bestResult2 = 0
     while i < alpha2_variability[1]:
         print("ALPHA2="+str(i))
-        align.ALPHA2 = i
-        align.align_particular(parameters_for_align)
-        current=main(slugs, False, False)
+        current = sweep(slugs, pairs, [{'ALPHA2': i}], False)[0][1][2]
         if current>bestResult2:
             bestResult2 = current
             bestI2 = i
@@ -252,9 +592,7 @@ def analize(slugs, parameters_for_align, alpha_variability, alpha2_variability,
     bestResult3 = bestResult2
     while i < beta_variability[1]:
         print("BETHA=" + str(i))
-        align.BETHA = i
-        align.align_particular(parameters_for_align)
-        current = main(slugs, False, False)
+        current = sweep(slugs, pairs, [{'BETHA': i}], False)[0][1][2]
         if current > bestResult3:
             bestResult3 = current
             bestI3 = i
@@ -6,12 +6,22 @@ THE ITERATION STARTS
 
 calculate(int n, int m) - this method ensures that the module will work adequately with a matrix of the size n*m. If the
 requested size of teh matrix is larger than that calculated previously, the module will resize the _euclidean array.
-This procedure should work in nm*log(nm) time.
+This procedure should work in nm*log(nm) time. The arrays are stored in OUTDIR_EUCLIDEAN (if this directory exists), so
+that every size is only calculated once
 
-closest((uint,uint) start, uint startIndex, uint len1, uint len2, function, extraParameters=[]) - Performs a
-search for a point in the matrix that satisfies the expression. The search is performed by increasing the euclidean
-distance from a given point. Returns the first pair of coordinates for which the expression is evaluated as true one,
-or None if there are no such coordinates
+build(int n, int m) - returns the array of all the points of the n*m matrix ordered by the euclidean distance from the
+origin
+
+closest((uint,uint) start, uint startIndex, uint len1, uint len2, function, extraParameters=[], vectorized=None) -
+Performs a search for a point in the matrix that satisfies the expression. The search is performed by increasing the
+euclidean distance from a given point. Returns the first pair of coordinates for which the expression is evaluated as
+true one, or None if there are no such coordinates
+
+candidates(uint startIndex, int change0, int change1) - returns the indexes of the elements of the _euclidean array that
+closest has to check for a rectangle of the given shape. The indexes are only calculated once for every shape
+
+resize(int n, int m, parVicinities, sentVicinities) - same as calculate, but makes sure that the array is created for
+the matrix of exactly this size, even if a larger one was requested previously
 
 update_vicinities(vicinities, boolean isForParagraphs) - sets the values for parStart
 and sentStart. Updates the vicinities list if there is no way to set a unique parStart and SentStart
@@ -20,7 +30,8 @@ main() - only for debugging
 """
 
 import numpy
-import math
+import os
+import classpaths as path
 
 _euclidean = None  # the array of coordinates. The coordinates are stored in the order of increasing euclidean distance
 # from point (0.0). All coordinates are positive
@@ -30,17 +41,59 @@ parStart = 0  # since the algorithm in align.py at first searches for the paragr
 # euclidean distance afterwards, there is no need to include the point covered by vicinities in the euclidean array.
 # Only the elements of the array starting from PAR_START should be checked.
 sentStart = 0  # same for sentences
+_position = None  # for every point (x, y) of the matrix stores the index of this point in the _euclidean array
+BATCH_SIZE = 64  # the number of candidates passed at once to a vectorized expression in closest
+_candidates = {}  # for every (startIndex, change0, change1) stores the indexes of the elements of _euclidean that
+# closest should check in this order (see candidates). Emptied every time the _euclidean array is recreated
+
+
+def build(n, m):
+    """
+    Creates the array of all the points of the n*m matrix sorted by the euclidean distance from the origin. The sort key
+    is the square of the distance, which is an integer, so that there are no rounding errors. The points that are at the
+    same distance are ordered by the sum of the coordinates and then by decreasing x (as if the matrix was traversed by
+    the diagonals going from the top right to the low left boundaries)
+    :param n:   - width of the matrix (int)
+    :param m:   - height of the matrix (int)
+    :return:    - the array of points (see _euclidean)
+    """
+    x, y = numpy.indices((n, m)).reshape(2, -1)
+    order = numpy.lexsort((-x, x + y, x * x + y * y))
+    array = numpy.ndarray(n * m, dtype=[('x', numpy.uint16), ('y', numpy.uint16), ('euclidean', numpy.float16)])
+    array['x'] = x[order]
+    array['y'] = y[order]
+    array['euclidean'] = numpy.sqrt(x[order] * x[order] + y[order] * y[order])
+    return array
+
+
+def _load(n, m):
+    """
+    Returns the array for the matrix of the size n*m (see build). The array is read from OUTDIR_EUCLIDEAN if it was
+    calculated before. Otherwise it is built and written there, if the directory exists
+    :param n:   - width of the matrix (int)
+    :param m:   - height of the matrix (int)
+    :return:    - the array of points (see _euclidean)
+    """
+    directory = path.OUTDIR_EUCLIDEAN
+    if not os.path.isdir(directory):
+        return build(n, m)
+    filename = directory + 'euclidean-' + str(n) + 'x' + str(m) + '.npy'
+    if os.path.exists(filename):
+        return numpy.load(filename)
+    array = build(n, m)
+    temporary = filename + '.' + str(os.getpid())  # several processes might be writing the same file at once
+    with open(temporary, 'wb') as file:
+        numpy.save(file, array)
+    os.rename(temporary, filename)
+    return array
 
 
 def calculate(n, m, parVicinities, sentVicinities):
     """
     If the array of the requested size already exists, does nothing.
-    Otherwise creates the new array for a matrix of a given size (m*n). Then fills this array with points from this
-    matrix by increasing the sum of coordinates (going by the diagonal from top right to low left boundaries).
-    The array should be partially sorted after this procedure. Then quickSort is used for sorting the array
-    by the euclidean distance from the origin. Finally, the algorithm determines the values of parStart and sentStart
-    and appends extra points to parVicinities or sentVicinities if it is necessary for setting unique parStart and
-    sentStart values
+    Otherwise creates the new array for a matrix of a given size (m*n) or reads it from the disk (see build and _load).
+    Finally, the algorithm determines the values of parStart and sentStart and appends extra points to parVicinities or
+    sentVicinities if it is necessary for setting unique parStart and sentStart values
     :param n:               - width of the matrix (int)
     :param m:               - height of the matrix (int)
     :param parVicinities:   - VICINITIES list from align.py
@@ -50,35 +103,61 @@ def calculate(n, m, parVicinities, sentVicinities):
     global _N
     global _M
     global _euclidean
+    global _position
     if (n <= _N) and (m <= _M):
         return
     _N = n
     _M = m
-    _euclidean = numpy.ndarray(n * m,
-                               dtype=[('x', numpy.uint16), ('y', numpy.uint16), ('euclidean', numpy.float16)])
-    count = 0  # the next position to be filled in the array
-    dist = 0  # iterating by the sum of the coordinates starting from the sum=0
-    next = (0, dist - 1)  # next = (0, -1) so that in the first iteration of the while loop, the first "if" will be True
-    while dist < n + m - 1:
-        if next[0] + next[1] < dist:  # dist was updated and it is necessary to set up next
-            if dist >= n:
-                next = (n - 1, dist - n + 1)
-            else:
-                next = (dist, 0)
-        else:
-            _euclidean[count]['x'] = next[0]
-            _euclidean[count]['y'] = next[1]
-            _euclidean[count]['euclidean'] = math.sqrt(next[0] * next[0] + next[1] * next[1])
-            count += 1
-            next = (next[0] - 1, next[1] + 1)  # going by the diagonal from the top right to the low left boundaries
-            if (next[1] >= m) or (next[0] < 0):
-                dist += 1
-    _euclidean=numpy.sort(_euclidean, 0, order='euclidean')
+    _euclidean = _load(n, m)
+    _position = numpy.ndarray((n, m), dtype=numpy.int64)
+    _position[_euclidean['x'], _euclidean['y']] = numpy.arange(len(_euclidean))
+    _candidates.clear()
     _update_vicinities(parVicinities, True)  # determines the value of parStart
     _update_vicinities(sentVicinities, False)  # determines the value of sentStart
 
 
-def closest(start, startIndex, len1, len2, function, extraParameters=[]):
+def resize(n, m, parVicinities, sentVicinities):
+    """
+    Same as calculate, but if the array was previously created for a matrix of a different size (even if it was a larger
+    one), it is recreated for the matrix of the size n*m. Since closest iterates over the whole array, the results of
+    the search might depend on the size of the matrix, and this method allows to start from the same state every time
+    :param n:               - width of the matrix (int)
+    :param m:               - height of the matrix (int)
+    :param parVicinities:   - VICINITIES list from align.py
+    :param sentVicinities:  - SENTENCE_VICINITIES list from align.py
+    :return:   - None
+    """
+    global _N
+    global _M
+    if (n != _N) or (m != _M):
+        _N = 0
+        _M = 0
+    calculate(n, m, parVicinities, sentVicinities)
+
+
+def candidates(startIndex, change0, change1):
+    """
+    Returns the indexes of the elements of the _euclidean array that closest has to check, when it searches in the
+    rectangle of the size change0*change1 starting from the element at startIndex. These are the elements that lie
+    within the rectangle and precede the first element which sum of coordinates is too large. The indexes are calculated
+    once for every shape of the rectangle and then stored in _candidates
+    :param startIndex:  - the index in euclidean array from which to start the search (unit)
+    :param change0:     - the length of the first axis of the rectangle (int)
+    :param change1:     - the length of the second axis of the rectangle (int)
+    :return:            - numpy array of indexes in the _euclidean array in the order they should be checked
+    """
+    key = (startIndex, change0, change1)
+    if key not in _candidates:
+        x = _euclidean['x'][startIndex:].astype(numpy.int64)
+        y = _euclidean['y'][startIndex:].astype(numpy.int64)
+        tooFar = numpy.nonzero(x + y >= change0 + change1 - 1)[0]  # the search stops at the first such element
+        end = tooFar[0] if len(tooFar) > 0 else len(x)
+        inside = numpy.nonzero((x[:end] < change0) & (y[:end] < change1))[0]
+        _candidates[key] = inside + startIndex
+    return _candidates[key]
+
+
+def closest(start, startIndex, len1, len2, function, extraParameters=[], vectorized=None):
     """
     Performs a search for a point in the matrix that satisfies the expression. The search is performed by increasing the
     euclidean distance from a given point. Returns the first pair of coordinates for which the expression is 
@@ -90,23 +169,31 @@ def closest(start, startIndex, len1, len2, function, extraParameters=[]):
     :param function:        - an expression to evaluate (function that returns a boolean and takes at least two
                             parameters: the starting point and the distance from it)
     :param extraParameters: - extra parameters to pass to the function if needed
+    :param vectorized:      - optional version of the expression that evaluates BATCH_SIZE points at once. It takes the
+                            starting point, the array of x distances, the array of y distances and extraParameters, and
+                            returns an array of booleans. It should have no side effects, since some of the points it
+                            is asked about lie beyond the one that is returned. If given, function is not used
     :return: the coordinates (relative to start) that first satisfy the function. Returns None if there are no such
                                                                                                         coordinates
     """
     change0 = len1 - start[0]  # the length of the first axis of the matrix that is searched in (as if start coordinate
     # was the origin)
     change1 = len2 - start[1]  # same for the second axis
-    maxDistance = change0 + change1
-    i = startIndex
-    while (i < len(_euclidean))and(_euclidean[i][0] + _euclidean[i][1] < maxDistance-1):
-        if (_euclidean[i][0] < change0) and (_euclidean[i][1] < change1):
-            if len(extraParameters) == 0:
-                if function(start, _euclidean[i]):
-                    return _euclidean[i]
-            else:
-                if function(start, _euclidean[i], extraParameters):
-                    return _euclidean[i]
-        i += 1
+    indexes = candidates(startIndex, change0, change1)
+    if vectorized is not None:
+        for i in range(0, len(indexes), BATCH_SIZE):
+            points = _euclidean[indexes[i:i + BATCH_SIZE]]
+            found = numpy.nonzero(vectorized(start, points['x'], points['y'], extraParameters))[0]
+            if len(found) > 0:
+                return points[found[0]]
+        return None
+    for i in indexes:
+        if len(extraParameters) == 0:
+            if function(start, _euclidean[i]):
+                return _euclidean[i]
+        else:
+            if function(start, _euclidean[i], extraParameters):
+                return _euclidean[i]
     return None
 
 
@@ -118,29 +205,21 @@ def _update_vicinities(vicinities, isForParagraphs):
     :param isForParagraphs: - true if vicinities=VICINITIES, false if vicinities=SENTENCE_VICINITIES
     :return:                - None
     """
-    max = -1.0  # the maximum euclidean distance between the origin and a point in Vicinities
-    maxInd = -1  # the index of this point (or the maximum index among such points if there are many of those)
+    maxInd = -1  # the maximum index of a point from vicinities in the euclidean array
+    covered = set()  # all the points in vicinities
     for vicinity in vicinities:
         for point in vicinity:
-            if point[0] * point[0] + point[1] * point[1] >= max:  # if the new maximum is found
-                i = 0  # then search for this point in euclidean
-                while (i < len(_euclidean)) and ((_euclidean[i][0] != point[0]) or (_euclidean[i][1] != point[1])):
-                    i += 1
-                if i > maxInd:
-                    maxInd = i
-                    max = point[0] * point[0] + point[1] * point[1]
+            covered.add((int(point[0]), int(point[1])))
+            if (point[0] < _N) and (point[1] < _M):
+                maxInd = max(maxInd, int(_position[point[0], point[1]]))
+            else:  # the point is not in the euclidean array
+                maxInd = max(maxInd, len(_euclidean))
     # for every element in euclidean which is at the position less than max and which is not in vicinities - add it to
     # vicinities
     i = 0
     while i < maxInd:
-        foundInVicinities = False
-        for vicinity in vicinities:
-            for point in vicinity:
-                if (_euclidean[i][0] == point[0]) and (_euclidean[i][1] == point[1]):
-                    foundInVicinities = True
-                    break
-        if (not foundInVicinities)and((_euclidean[i][0] != 0)or(_euclidean[i][1] != 0)): # starting point itself should
-            # not be added to vicinities
+        point = (int(_euclidean[i][0]), int(_euclidean[i][1]))
+        if (point not in covered) and (point != (0, 0)):  # starting point itself should not be added to vicinities
             vicinities.append(((_euclidean[i][0], _euclidean[i][1]),))
         i += 1
     # update parStart and sentStart
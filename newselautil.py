@@ -3,15 +3,20 @@
 # Modified: A. Fedchin
 
 import io
+import os
 import re
+import pickle
+import numpy
 import string
 import csv
+import shelve
+from collections import OrderedDict
 import nltk.data
 import regex as re
 import classpaths as path
 from nltk.tokenize import TreebankWordTokenizer
 from nltk.stem import WordNetLemmatizer
-from nltk.corpus import wordnet
+from nltk.corpus.reader import wordnet as wordnetReader
 
 from nltk.corpus import stopwords
 STOPWORDS = stopwords.words('english')
@@ -25,21 +30,157 @@ Tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
 Wordtokenizer = TreebankWordTokenizer()
 Lemmatizer = WordNetLemmatizer()
 htmltag_rm = re.compile(r'(<!--.*?-->|<[^>]*>)')
+LEMMA_CACHE_SIZE = 200000  # the maximum number of sentences whose lemmas are kept in memory by lemmatize. The least
+# recently used sentences are forgotten first. If LEMMA_CACHE_SIZE = 0, nothing is kept in memory
 
 
-def loadMetafile():
-    """Return list of dictionaries, one for each English Newsela file."""
-    numArticles = 0
-    enArticles = 0
-    articles = []  # all articles
-    with open(path.METAFILE,'r') as meta:
-        reader = csv.DictReader(meta, delimiter=',')
-        for row in reader:
-            numArticles += 1
-            if row['language'] == 'en':
-                enArticles += 1
-                articles.append(row)
-    return articles
+def loadMetafile(language='en'):
+    """
+    Return list of dictionaries, one for each English Newsela file. The list is taken from the metafile index (see
+    MetafileIndex), so the same list is returned every time and should not be modified. The list also has the slugRanges
+    attribute, which allows to find all the articles with a given slug at once
+    :param language: the language of the articles to return
+    """
+    return loadMetafileIndex().select(language=language)
+
+
+class Metafile(list):
+
+    """ a list of the rows of the metafile, which also knows where the articles with every slug are """
+
+    def __init__(self, rows):
+        """
+        :param rows: the rows of the metafile (dictionaries) ordered by slug and then by the level of adaptation
+        """
+        list.__init__(self, rows)
+        self.slugRanges = {}  # for every slug stores (lo, hi), where lo is the position of the first row with this
+        # slug in the list and hi is one more than the position of the last one
+        lo = 0
+        while lo < len(self):
+            hi = lo + 1
+            while (hi < len(self)) and (self[hi]['slug'] == self[lo]['slug']):
+                hi += 1
+            if self[lo]['slug'] not in self.slugRanges:  # the rows with one slug should go one after another
+                self.slugRanges[self[lo]['slug']] = (lo, hi)
+            lo = hi
+
+    def slug_articles(self, slug):
+        """
+        :param slug: the slug
+        :return: the list of the rows with this slug (ordered by the level of adaptation) or an empty list
+        """
+        if slug not in self.slugRanges:
+            return []
+        lo, hi = self.slugRanges[slug]
+        return self[lo:hi]
+
+
+class MetafileIndex(object):
+
+    """ the parsed metafile, which can be stored on disk, so that the csv file is only parsed when it changes """
+
+    def __init__(self, filename):
+        """
+        Parse the metafile
+        :param filename: the name of the csv file
+        """
+        status = os.stat(filename)
+        self.filename = filename
+        self.version = (status.st_mtime, status.st_size)  # the index is outdated if the csv file was modified
+        with open(filename, 'r') as meta:
+            reader = csv.DictReader(meta, delimiter=',')
+            self.fields = list(reader.fieldnames)
+            self.rows = [tuple(row[field] for field in self.fields) for row in reader]  # columns are in self.fields
+        self.selections = {}  # the Metafile lists that were already built by select
+
+    def __getstate__(self):
+        """Only the parsed rows are written to disk"""
+        state = self.__dict__.copy()
+        state['selections'] = {}
+        return state
+
+    def is_outdated(self):
+        """
+        :return: True if the csv file was modified or removed after it was parsed
+        """
+        if not os.path.exists(self.filename):
+            return True
+        status = os.stat(self.filename)
+        return self.version != (status.st_mtime, status.st_size)
+
+    def _column(self, field):
+        """
+        :param field: the name of the column
+        :return: the list of values in this column
+        """
+        i = self.fields.index(field)
+        return [row[i] for row in self.rows]
+
+    def select(self, language='en', minGrade=None, maxGrade=None):
+        """
+        Return the rows of the metafile with the given language and grade level. The result is built once for every
+        combination of the parameters
+        :param language: the language of the articles. If None, the articles in all the languages are returned
+        :param minGrade: if not None, only the articles with grade_level >= minGrade are returned
+        :param maxGrade: if not None, only the articles with grade_level <= maxGrade are returned
+        :return: the Metafile list of dictionaries
+        """
+        key = (language, minGrade, maxGrade)
+        if key not in self.selections:
+            if 'grades' not in self.__dict__:  # the columns used for filtering
+                self.grades = numpy.array([float(grade) if grade else numpy.nan
+                                           for grade in self._column('grade_level')])
+                self.languages = numpy.array(self._column('language'))
+            mask = numpy.ones(len(self.rows), dtype=bool)
+            if language is not None:
+                mask &= self.languages == language
+            with numpy.errstate(invalid='ignore'):
+                if minGrade is not None:
+                    mask &= self.grades >= minGrade
+                if maxGrade is not None:
+                    mask &= self.grades <= maxGrade
+            self.selections[key] = Metafile([dict(zip(self.fields, self.rows[i])) for i in numpy.nonzero(mask)[0]])
+        return self.selections[key]
+
+    def slug_articles(self, slug, language='en'):
+        """
+        :param slug:     the slug
+        :param language: the language of the articles
+        :return: the list of the rows with this slug (ordered by the level of adaptation) or an empty list
+        """
+        return self.select(language).slug_articles(slug)
+
+
+metafileIndex = None  # the MetafileIndex used by loadMetafile
+
+
+def loadMetafileIndex():
+    """
+    Return the index of the metafile. The index is kept in memory and in the METAFILE_INDEX file, and the metafile is
+    only parsed again if it was modified since
+    :return: the MetafileIndex object
+    """
+    global metafileIndex
+    if (metafileIndex is not None) and (metafileIndex.filename == path.METAFILE) and not metafileIndex.is_outdated():
+        return metafileIndex
+    metafileIndex = None
+    try:
+        with open(path.METAFILE_INDEX, 'rb') as file:
+            metafileIndex = pickle.load(file)
+        if (metafileIndex.filename != path.METAFILE) or metafileIndex.is_outdated():
+            metafileIndex = None
+    except Exception:  # there is no index yet or it cannot be read
+        metafileIndex = None
+    if metafileIndex is None:
+        metafileIndex = MetafileIndex(path.METAFILE)
+        try:
+            temporary = path.METAFILE_INDEX + '.' + str(os.getpid())  # several processes might write it at once
+            with open(temporary, 'wb') as file:
+                pickle.dump(metafileIndex, file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temporary, path.METAFILE_INDEX)
+        except (IOError, OSError):  # the index is only kept in memory if it cannot be written
+            pass
+    return metafileIndex
 
 
 def cleanSentence(s):
@@ -135,8 +276,34 @@ def getTokParagraphs(article, separateBySemicolon=True, MODIFY_HEADER=True):
     return pars
 
 
+def tokenizeFile(textfile, tokfile=None):
+    """
+    Tokenize the text file with the NLTK tokenizers and write the result in the same format as custom/Tokenizer does
+    (see getTokParagraphs): every paragraph (a non-empty line of the text file) starts with the "@PGPH " line and is
+    followed by its sentences, one per line, with the tokens separated by spaces. Apostrophes are replaced with
+    backquotes, as parsefiles.processFile does for the output of custom/Tokenizer. The file is processed line by line
+    :param textfile: the name of the text file
+    :param tokfile:  the name of the file to write. By default, textfile.tok
+    :return: None
+    """
+    if tokfile is None:
+        tokfile = textfile + '.tok'
+    with io.open(textfile, mode='r', encoding='utf-8') as source:
+        with io.open(tokfile, mode='w', encoding='utf-8') as target:
+            for line in source:
+                line = line.strip()
+                if line == '':
+                    continue
+                target.write(u'@PGPH \n')
+                for sentence in Tokenizer.tokenize(line):
+                    tokens = Wordtokenizer.tokenize(sentence)
+                    if len(tokens) > 0:
+                        target.write(u' '.join(tokens).replace(u"'", u"`") + u'\n')
+
+
 PENNPOS = ['N', 'V', 'J', 'R']
-WNETPOS = [wordnet.NOUN, wordnet.VERB, wordnet.ADJ, wordnet.ADV]
+WNETPOS = [wordnetReader.NOUN, wordnetReader.VERB, wordnetReader.ADJ, wordnetReader.ADV]  # the constants are taken
+# from the reader module, so that the WordNet corpus is not loaded when the module is imported
 
 
 def convertPOS(pos):
@@ -147,7 +314,131 @@ def convertPOS(pos):
     return None
 
 
+class LemmaCache(object):
+
+    """ a bounded LRU cache of lemmatized sentences, optionally backed by a store on disk """
+
+    def __init__(self, maxSize=LEMMA_CACHE_SIZE, filename=None):
+        """
+        :param maxSize:  the maximum number of sentences kept in memory
+        :param filename: the name of the store on disk (see open). If None, the lemmas are only kept in memory
+        """
+        self.maxSize = maxSize
+        self.entries = OrderedDict()  # sentence -> list of lemmas, the least recently used sentence goes first
+        self.store = None
+        self.filename = None
+        self.readOnly = False
+        self.hits = 0  # the number of sentences found in memory
+        self.storeHits = 0  # the number of sentences found in the store on disk
+        self.misses = 0  # the number of sentences that had to be lemmatized
+        if filename is not None:
+            self.open(filename)
+
+    def open(self, filename, flag='c'):
+        """
+        Use the store on disk with the given name. The lemmas of all the sentences that are not in memory will be
+        looked up in the store, and all newly lemmatized sentences will be written to it
+        :param filename: the name of the store (see shelve.open)
+        :param flag:     'c' to create the store if it does not exist, 'r' to open it for reading only
+        :return: None
+        """
+        self.close()
+        self.store = shelve.open(filename, flag)
+        self.filename = filename
+        self.readOnly = flag == 'r'
+
+    def close(self):
+        """Write everything to the store on disk (if any) and stop using it"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def get(self, sentence):
+        """
+        :param sentence: the sentence to look up
+        :return: the list of lemmas for this sentence or None if it is neither in memory nor in the store
+        """
+        if sentence in self.entries:
+            self.hits += 1
+            lemmas = self.entries.pop(sentence)
+            self.entries[sentence] = lemmas  # this sentence is now the most recently used one
+            return list(lemmas)
+        if self.store is not None:
+            lemmas = self.store.get(_store_key(sentence))
+            if lemmas is not None:
+                self.storeHits += 1
+                self._remember(sentence, lemmas)
+                return list(lemmas)
+        self.misses += 1
+        return None
+
+    def put(self, sentence, lemmas):
+        """
+        Remember the lemmas for the sentence in memory and in the store on disk
+        :param sentence: the sentence
+        :param lemmas:   the list of lemmas
+        :return: None
+        """
+        self._remember(sentence, list(lemmas))
+        if (self.store is not None) and not self.readOnly:
+            self.store[_store_key(sentence)] = list(lemmas)
+
+    def _remember(self, sentence, lemmas):
+        """Add the sentence to the memory and forget the least recently used ones if there are too many"""
+        if self.maxSize <= 0:
+            return
+        self.entries[sentence] = lemmas
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Forget everything kept in memory and reset the counters. The store on disk is not affected"""
+        self.entries.clear()
+        self.hits = 0
+        self.storeHits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        :return: the number of sentences found in memory, the number of sentences found in the store, the number of
+        sentences that had to be lemmatized, and the number of sentences currently kept in memory
+        """
+        return self.hits, self.storeHits, self.misses, len(self.entries)
+
+
+def _store_key(sentence):
+    """Keys of shelve should be str both in python 2 and python 3"""
+    if isinstance(sentence, str):
+        return sentence
+    return sentence.encode('utf-8')
+
+
+lemmaCache = LemmaCache()  # used by lemmatize
+
+
+def use_lemma_store(filename=path.LEMMA_STORE, readOnly=False):
+    """
+    Make lemmatize look up sentences in the store on disk and save the lemmas of new sentences there, so that the
+    following runs of the program do not need to lemmatize the same sentences again
+    :param filename: the name of the store
+    :param readOnly: if True, new sentences will not be added to the store
+    :return: None
+    """
+    lemmaCache.open(filename, 'r' if readOnly else 'c')
+
+
 def lemmatize(s):
+    """
+    Return list of lemmas for string s, a sentence. The lemmas are looked up in lemmaCache first
+    """
+    lemmas = lemmaCache.get(s)
+    if lemmas is None:
+        lemmas = _lemmatize(s)
+        lemmaCache.put(s, lemmas)
+    return lemmas
+
+
+def _lemmatize(s):
     """Return list of lemmas for string s, a sentence."""
     tokens = Wordtokenizer.tokenize(s)
     # tokens = [x for x in tokens if x.lower() == x]
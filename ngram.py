@@ -1,12 +1,43 @@
-" this module is a tool for automatic creation of n-grams for newsela data "
+"""
+this module is a tool for automatic creation of n-grams for newsela data
+
+build_ngrams(outputFile, ...) - count the ngrams for the articles, merge them and build the language model
+
+count_ngrams(tokFile, order=ORDER, counts=None) - count the ngrams in one tokenized article without ngram-count
+
+write_counts(counts, outputFile) - write the counts in the same sorted format as ngram-count -sort -write
+
+count_articles(articleNames, order=ORDER, usePrecalculated=True) - count the ngrams for a batch of articles
+
+read_counts(countFile) - read a count file line by line
+
+merge_counts(countFiles, outputFile, maxOpenFiles=None, subtractFiles=()) - merge the sorted count files in one pass
+
+read_manifest(manifestFile), write_manifest(manifestFile, names) - the list of the count files in a merged file and
+their sizes and modification times
+
+update_ngrams(countFile, manifestFile, names) - add the new count files to a merged file and subtract the removed ones
+
+article_perplexity(articleName, lmName) - calculate the probability of each word in an article
+
+calculate_all_perplexities(lmName, ...) - calculate perplexities for many articles. If SCORER = 'native', the language
+model is loaded once (see arpa.py) instead of starting the ngram program for every article
+"""
 
 
 #TODO Get Tok Paragraphs
 import newselautil as nutils
 import classpaths as path
+import toolrunner
+import arpa
+import store
+import numpy
 import subprocess
 import sys
 import io
+import threading
+import heapq
+import os
 import os.path
 is_py2 = sys.version[0] == '2'
 if is_py2:
@@ -20,9 +51,24 @@ MERGE_PER_TIME = 200 # the maximum amount of ngram-files to merge in one call. D
 
 MINUS_INFINITY = '-1000000'  # the value that will be assigned to the log of the probability if the probability is zero
 
+COUNTER = 'srilm'  # 'srilm' - the ngrams for every article are counted by ngram-count. 'native' - they are counted in
+# this process by count_ngrams and written in the same format by write_counts
+ORDER = 3  # the maximum order of the ngrams counted by count_ngrams (the default order of ngram-count)
+SENTENCE_START = '<s>'  # the tags that ngram-count adds to the beginning and to the end of every sentence
+SENTENCE_END = '</s>'
+MERGER = 'srilm'  # 'srilm' - the counts are merged by ngram-merge, MERGE_PER_TIME files per call. 'native' - all the
+# files are merged at once in this process by merge_counts
+MAX_OPEN_FILES = 500  # the maximum number of count files that merge_counts reads at once
+SCORER = 'srilm'  # 'srilm' - the perplexities are calculated by the ngram program, which is started for every article.
+# 'native' - the model is loaded into this process once (see arpa.py) and all the articles are scored with it
+PERPLEXITY_FORMAT = 'text'  # 'text' - the probabilities for every article are written to a .prob file in
+# OUTDIR_PERPLEX. 'store' - they are appended as float32 arrays to the store in OUTDIR_PERPLEX_STORE (see store.py)
+
+_perplexityWriter = None  # the store.PerplexityWriter used by this process if PERPLEXITY_FORMAT = 'store'
+
 
 def build_ngrams(outputFile, nToProcess=-1, levels=[0,1,2,3,4,5], mingrade=0, maxgrade=12, exclude = None,
-                 onlyEnglish = True, usePrecalculated = True):
+                 onlyEnglish = True, usePrecalculated = True, workers=toolrunner.WORKERS, incremental=False):
     """
     Count ngrams for nToProcess slugs (and indicated levels) (put them into path.OUTPUT_NGRAMS/ngrams_by_file/) and
     then merge them all into one file. Then create a language model using Kneser-Nay
@@ -40,9 +86,15 @@ def build_ngrams(outputFile, nToProcess=-1, levels=[0,1,2,3,4,5], mingrade=0, ma
     :param onlyEnglish: If True, only english articles will be processed
     :param usePrecalculated: If True, the program will not reevaluate the ngrams for the files which are already
     in the ngrams_by_file folder
-    :return: None
+    :param workers: the number of ngram-count (and ngram-merge) programs that run at once (see toolrunner)
+    :param incremental: If True and outputFile.ngrams was built before, only the counts of the articles that were added
+    since then are added to it, and the counts of the articles that are no longer selected (e.g. excluded) are
+    subtracted from it (see update_ngrams). The list of the merged articles is kept in outputFile.manifest. The
+    language model is built again only if something has changed
+    :return: None. If COUNTER = 'native', the ngrams for the articles are counted in this process
     """
     info = nutils.loadMetafile()
+    runner = toolrunner.ToolRunner(workers)
     nSlugs = 0  # this will store the number of the slug that is currently processed
 
     q = queue.Queue()  # the program first creates n-gram models for all the articles separately, then merges them all
@@ -94,10 +146,14 @@ def build_ngrams(outputFile, nToProcess=-1, levels=[0,1,2,3,4,5], mingrade=0, ma
                                             path.OUTDIR_PRECALCULATED + info[artLow + level]["filename"] + ".ngrams"):
                         continue
 
-                    subprocess.call(["ngram-count", "-text", path.OUTDIR_TOK_NGRAMS +
-                                     info[artLow + level]["filename"] + ".tok", "-sort", "-write",
-                                     path.OUTDIR_PRECALCULATED + info[artLow + level]["filename"] + ".ngrams"])
-                    # crete the n-gram model for this particular file
+                    if COUNTER == 'native':
+                        count_articles([info[artLow + level]["filename"]], usePrecalculated=False)
+                        continue
+                    runner.submit(["ngram-count", "-text", path.OUTDIR_TOK_NGRAMS +
+                                   info[artLow + level]["filename"] + ".tok", "-sort", "-write",
+                                   path.OUTDIR_PRECALCULATED + info[artLow + level]["filename"] + ".ngrams"],
+                                  creates=path.OUTDIR_PRECALCULATED + info[artLow + level]["filename"] + ".ngrams")
+                    # crete the n-gram model for this particular file. The files are processed concurrently
 
                 if nToProcess == -1:
                     print(
@@ -108,34 +164,284 @@ def build_ngrams(outputFile, nToProcess=-1, levels=[0,1,2,3,4,5], mingrade=0, ma
         else:
             e_index += 1
 
-    extraFilesCount = 0  # the number of extra files that could be deleted after the completion of the program
-    # (these are temporaraly merges and will be located in path.OUTPUT_NGRAMS/toDelete/)
+    if not _report_failures(runner.wait()):
+        return
+
+    manifestFile = path.OUTDIR_NGRAMS+outputFile+".manifest"  # the list of the count files merged into outputFile
+    names = [name[len(path.OUTDIR_PRECALCULATED):] for name in list(q.queue)]
+    updated = None
+    if incremental:
+        updated = update_ngrams(path.OUTDIR_NGRAMS+outputFile+".ngrams", manifestFile, names)
+    if updated is not None:
+        print("Files added: " + str(updated[0]) + ", files subtracted: " + str(updated[1]))
+        if (updated == (0, 0)) and os.path.isfile(path.OUTDIR_NGRAMS+outputFile+".bo"):  # the model is up to date
+            return
+    elif MERGER == 'native':  # one pass over all the files, straight into the final file
+        files = []
+        while q.qsize() > 0:
+            files.append(q.get())
+        merge_counts(files, path.OUTDIR_NGRAMS+outputFile+".ngrams")
+    else:
+        extraFilesCount = 0  # the number of extra files that could be deleted after the completion of the program
+        # (these are temporaraly merges and will be located in path.OUTPUT_NGRAMS/toDelete/)
+
+        while q.qsize() > MERGE_PER_TIME:  # align MERGE_PER_TIME files per call. All the merges that can be made from
+            # the files in the queue are made at once, and their results are put back to the queue
+            print("Files left to merge:"+str(q.qsize()))
+            merged = []
+            while q.qsize() > MERGE_PER_TIME:
+                next_input = ["ngram-merge"]
+                for i in range (MERGE_PER_TIME):
+                    next_input.append(q.get())
+                runner.submit(next_input, output=path.OUTDIR_TO_DELETE+str(extraFilesCount)+".ngrams")
+                merged.append(path.OUTDIR_TO_DELETE+str(extraFilesCount)+".ngrams")
+                extraFilesCount += 1
+            if not _report_failures(runner.wait()):
+                return
+            for name in merged:
+                q.put(name)
 
-    while q.qsize() > MERGE_PER_TIME:  # align MERGE_PER_TIME files per call
         next_input = ["ngram-merge"]
-        print("Files left to merge:"+str(q.qsize()))
-        for i in range (MERGE_PER_TIME):
+        for i in range (q.qsize()):
             next_input.append(q.get())
-        with open(path.OUTDIR_TO_DELETE+str(extraFilesCount)+".ngrams", 'w') as file:
-            if is_py2:
-                file.write(subprocess.check_output(next_input, shell=False))
-            else:
-                file.write(subprocess.run(next_input, stdout=subprocess.PIPE).stdout.decode('utf-8'))
-        q.put(path.OUTDIR_TO_DELETE+str(extraFilesCount)+".ngrams")
-        extraFilesCount += 1
-
-    next_input = ["ngram-merge"]
-    for i in range (q.qsize()):
-        next_input.append(q.get())
-    with open(path.OUTDIR_NGRAMS+outputFile+".ngrams", 'w') as file:
-        if is_py2:
-            file.write(subprocess.check_output(next_input, shell=False))
-        else:
-            file.write(subprocess.run(next_input, stdout=subprocess.PIPE).stdout.decode('utf-8'))  # this will create
-        # the outputFile.ngrams that will contain all the merged ngrams
+        runner.submit(next_input, output=path.OUTDIR_NGRAMS+outputFile+".ngrams")  # this will create the
+        # outputFile.ngrams that will contain all the merged ngrams
+        if not _report_failures(runner.wait()):
+            return
+    if updated is None:
+        write_manifest(manifestFile, names)
+
+    runner.submit(["ngram-count", "-read", path.OUTDIR_NGRAMS+outputFile+".ngrams",
+                   "-lm", path.OUTDIR_NGRAMS+outputFile+".bo", "-kndiscount"])
+    _report_failures(runner.wait())
+
+
+def count_ngrams(tokFile, order=ORDER, counts=None):
+    """
+    Count the ngrams in the tokenized article the same way as ngram-count -text does: every line is a sentence, which is
+    surrounded by SENTENCE_START and SENTENCE_END, and all the ngrams of orders from 1 to order are counted
+    :param tokFile: the name of the file with one tokenized sentence per line
+    :param order:   the maximum order of the ngrams
+    :param counts:  if given, the ngrams are added to this dictionary
+    :return: the dictionary, where for every ngram (tuple of words) the number of times it occurs is stored
+    """
+    if counts is None:
+        counts = {}
+    with io.open(tokFile, encoding='utf-8') as file:
+        for line in file:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            words = [SENTENCE_START] + words + [SENTENCE_END]
+            for i in range(len(words)):
+                for n in range(1, min(order, len(words) - i) + 1):
+                    ngram = tuple(words[i:i + n])
+                    counts[ngram] = counts.get(ngram, 0) + 1
+    return counts
+
+
+def write_counts(counts, outputFile):
+    """
+    Write the counts in the format of ngram-count -sort -write: one ngram per line, the words are separated by spaces
+    and followed by a tab and the count. The ngrams are sorted as tuples of words, so every ngram is followed by the
+    ngrams that extend it. The file is written under a temporary name and then renamed
+    :param counts:      the dictionary returned by count_ngrams
+    :param outputFile:  the name of the file
+    :return: None
+    """
+    with io.open(outputFile + '.tmp', 'w', encoding='utf-8') as file:
+        for ngram in sorted(counts):
+            file.write(u' '.join(ngram) + u'\t' + str(counts[ngram]) + u'\n')
+    os.rename(outputFile + '.tmp', outputFile)
+
+
+def count_articles(articleNames, order=ORDER, usePrecalculated=True):
+    """
+    Count the ngrams for a batch of tokenized articles in this process and write them to OUTDIR_PRECALCULATED
+    :param articleNames:     the names of the articles (without the .tok extension) in OUTDIR_TOK_NGRAMS
+    :param order:            the maximum order of the ngrams
+    :param usePrecalculated: if True, the articles which already have the .ngrams file are skipped
+    :return: the list of the names of the .ngrams files
+    """
+    outputFiles = []
+    for name in articleNames:
+        outputFiles.append(path.OUTDIR_PRECALCULATED + name + ".ngrams")
+        if usePrecalculated and os.path.isfile(outputFiles[-1]):
+            continue
+        write_counts(count_ngrams(path.OUTDIR_TOK_NGRAMS + name + ".tok", order), outputFiles[-1])
+    return outputFiles
+
 
-    subprocess.call(["ngram-count", "-read", path.OUTDIR_NGRAMS+outputFile+".ngrams",
-                     "-lm", path.OUTDIR_NGRAMS+outputFile+".bo", "-kndiscount"])
+def read_counts(countFile):
+    """
+    Read the file written by write_counts (or ngram-count -write) line by line
+    :param countFile: the name of the file
+    :return: the generator of tuples (ngram as a tuple of words, count)
+    """
+    with io.open(countFile, encoding='utf-8') as file:
+        for line in file:
+            line = line.rstrip('\n').split('\t')
+            if len(line) < 2:
+                continue
+            count = float(line[1])
+            yield tuple(line[0].split(' ')), int(count) if count.is_integer() else count
+
+
+def merge_counts(countFiles, outputFile, maxOpenFiles=None, subtractFiles=()):
+    """
+    Merge the sorted count files into one in a single pass: the files are read at the same time, and the counts of equal
+    ngrams are summed. Only one line of every file is kept in memory. If there are more than maxOpenFiles files, the
+    groups of maxOpenFiles files are merged into temporary files in OUTDIR_TO_DELETE first (which are removed
+    afterwards)
+    :param countFiles:    the names of the sorted count files (see write_counts)
+    :param outputFile:    the name of the merged file. It can be one of countFiles, since it is only replaced when all
+    the files have been read
+    :param maxOpenFiles:  the maximum number of files read at once. By default, MAX_OPEN_FILES
+    :param subtractFiles: the names of the count files whose counts are subtracted instead of being added. The ngrams
+    whose count becomes zero are not written (see update_ngrams)
+    :return: None
+    """
+    if maxOpenFiles is None:
+        maxOpenFiles = MAX_OPEN_FILES
+    maxOpenFiles = max(2, maxOpenFiles)
+    countFiles = list(countFiles)
+    subtractFiles = list(subtractFiles)
+    temporary = []
+    try:
+        while len(countFiles) + len(subtractFiles) > maxOpenFiles:  # the first files of the longer list are merged
+            # into a temporary file, which is put at the end of the list. The files that are added and the files that
+            # are subtracted are never merged together, so the temporary files only contain positive counts
+            files = countFiles if len(countFiles) >= len(subtractFiles) else subtractFiles
+            name = path.OUTDIR_TO_DELETE + 'merge-' + str(os.getpid()) + '-' + str(len(temporary)) + '.ngrams'
+            merge_counts(files[:maxOpenFiles], name, maxOpenFiles)
+            temporary.append(name)
+            files[:maxOpenFiles] = []
+            files.append(name)
+        streams = [read_counts(countFile) for countFile in countFiles]
+        streams += [_negated(read_counts(countFile)) for countFile in subtractFiles]
+        negative = 0  # the number of ngrams that were subtracted more times than they were added
+        try:
+            with io.open(outputFile + '.tmp', 'w', encoding='utf-8') as file:
+                last = None  # the ngram that is being summed up
+                total = 0
+                for ngram, count in heapq.merge(*streams):
+                    if ngram != last:
+                        if (last is not None) and (total > 0):
+                            file.write(u' '.join(last) + u'\t' + str(total) + u'\n')
+                        negative += (last is not None) and (total < 0)
+                        last = ngram
+                        total = 0
+                    total += count
+                if (last is not None) and (total > 0):
+                    file.write(u' '.join(last) + u'\t' + str(total) + u'\n')
+                negative += (last is not None) and (total < 0)
+        finally:
+            for stream in streams:
+                stream.close()  # closes the file if the stream was not read to the end
+        if negative > 0:
+            print("WARNING: " + str(negative) + " ngrams in " + outputFile + " were subtracted more times than they "
+                  "were added. The subtracted count files do not match the ones that were merged")
+        os.rename(outputFile + '.tmp', outputFile)
+    finally:
+        for name in temporary:
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def _negated(stream):
+    """
+    :param stream: the generator returned by read_counts
+    :return: the generator of the same ngrams with negated counts
+    """
+    try:
+        for ngram, count in stream:
+            yield ngram, -count
+    finally:
+        stream.close()
+
+
+def read_manifest(manifestFile):
+    """
+    Read the list of the count files that were merged into a merged count file (see build_ngrams)
+    :param manifestFile: the name of the manifest. Every line is the name of a count file in OUTDIR_PRECALCULATED, its
+    size and the time it was modified when it was merged, separated by tabs
+    :return: the list of tuples (name, stamp) (see _file_stamp), or None if the manifest does not exist. The stamp is
+    None if the manifest was written without it
+    """
+    if not os.path.isfile(manifestFile):
+        return None
+    with io.open(manifestFile, encoding='utf-8') as file:
+        entries = [line.rstrip('\n').split('\t', 1) for line in file if line.strip()]
+    return [(entry[0], entry[1] if len(entry) > 1 else None) for entry in entries]
+
+
+def write_manifest(manifestFile, names):
+    """
+    Write the list of the count files that were merged into a merged count file together with their stamps (see
+    _file_stamp). The file is written under a temporary name and then renamed
+    :param manifestFile: the name of the manifest
+    :param names:        the names of the count files in OUTDIR_PRECALCULATED
+    :return: None
+    """
+    with io.open(manifestFile + '.tmp', 'w', encoding='utf-8') as file:
+        for name in names:
+            file.write(name + u'\t' + _file_stamp(path.OUTDIR_PRECALCULATED + name) + u'\n')
+    os.rename(manifestFile + '.tmp', manifestFile)
+
+
+def _file_stamp(filename):
+    """
+    :return: the string with the size of the file and the time it was modified, which tells whether the file was
+    written again (e.g. the article was counted again after it changed)
+    """
+    return u'%d\t%r' % (os.path.getsize(filename), os.path.getmtime(filename))
+
+
+def update_ngrams(countFile, manifestFile, names):
+    """
+    Bring the merged count file up to date with the given list of count files without merging all of them again: the
+    counts of the files that are not in the manifest are added to it, and the counts of the files that are in the
+    manifest but not in the list are subtracted from it. If any of the files in the manifest has changed since it was
+    merged, the merged counts cannot be corrected, so nothing is done
+    :param countFile:    the merged count file
+    :param manifestFile: the manifest of countFile (see read_manifest)
+    :param names:        the names of the count files in OUTDIR_PRECALCULATED that countFile should contain
+    :return: the tuple with the number of added and subtracted files, or None if countFile could not be updated (if the
+    manifest or one of the files does not exist, or if one of the merged files has changed), in which case all the
+    files should be merged again
+    """
+    merged = read_manifest(manifestFile)
+    if (merged is None) or not os.path.isfile(countFile):
+        return None
+    mergedSet = set(name for name, stamp in merged)
+    namesSet = set(names)
+    added = [name for name in names if name not in mergedSet]
+    removed = [name for name, stamp in merged if name not in namesSet]
+    for name in added + removed:
+        if not os.path.isfile(path.OUTDIR_PRECALCULATED + name):
+            print("Cannot update " + countFile + ": " + path.OUTDIR_PRECALCULATED + name + " does not exist")
+            return None
+    for name, stamp in merged:
+        if ((name in namesSet) or (name in removed)) and (stamp != _file_stamp(path.OUTDIR_PRECALCULATED + name)):
+            print("Cannot update " + countFile + ": " + path.OUTDIR_PRECALCULATED + name + " has changed since it "
+                  "was merged")
+            return None
+    if len(added) + len(removed) > 0:
+        merge_counts([countFile] + [path.OUTDIR_PRECALCULATED + name for name in added], countFile,
+                     subtractFiles=[path.OUTDIR_PRECALCULATED + name for name in removed])
+    write_manifest(manifestFile, names)
+    return len(added), len(removed)
+
+
+def _report_failures(failed):
+    """
+    Print the programs that failed
+    :param failed: the list of toolrunner.Jobs that failed
+    :return: True if there are no failures
+    """
+    for job in failed:
+        print("ERROR: " + str(job))
+    return len(failed) == 0
 
 
 def delete_pars_symbols():
@@ -170,43 +476,97 @@ def article_perplexity(articleName,lmName):
     "Perplexity is given with two different normalizations: counting all input tokens and excluding end-of-sentence tags"
     Both of these values are on the first line. Every one of the following lines represents a sentence and contains the
     probabilities for every word in this sentence given as the logarithms (base 10). If the probability is equal, to
-    MINUS_INFINITY value, the word is out of vocabulary.
+    MINUS_INFINITY value, the word is out of vocabulary. If PERPLEXITY_FORMAT = 'store', the same values are appended
+    to the store in OUTDIR_PERPLEX_STORE instead (see store.PerplexityStore). If SCORER = 'native', the probabilities
+    are calculated in this process, and the model is only loaded for the first article (see arpa.load)
     :param articleName: the name of the article to calculate perplexity
     :param lmName: the name of the language model (.bo extension), found in OUTDIR_NGRAMS.
     :return: the perplexity (as a tuple)
     """
+    if SCORER == 'native':
+        return _score_article(articleName, arpa.load(path.OUTDIR_NGRAMS + lmName))
     if is_py2:
-        ouput=subprocess.check_output(["ngram", "-lm", path.OUTDIR_NGRAMS + lmName, "-ppl", path.OUTDIR_TOK_NGRAMS +
-                                articleName, "-debug", "2"], shell=False).split('\n')
+        ouput=subprocess.check_output(_perplexity_command(articleName, lmName), shell=False)
     else:
-        ouput = subprocess.run(["ngram", "-lm", path.OUTDIR_NGRAMS + lmName, "-ppl", path.OUTDIR_TOK_NGRAMS +
-                                articleName, "-debug", "2"], stdout=subprocess.PIPE).stdout.decode('utf-8').split('\n')
+        ouput = subprocess.run(_perplexity_command(articleName, lmName), stdout=subprocess.PIPE).stdout.decode('utf-8')
+    return _write_perplexity(articleName, ouput)
+
+
+def _score_article(articleName, model):
+    """
+    Calculate the probability of each word in an article with the model loaded in this process and write it to a file
+    in perplexity folder in the same format as article_perplexity does
+    :param articleName: the name of the article to calculate perplexity
+    :param model: the arpa.LanguageModel
+    :return: the perplexity (as a tuple)
+    """
+    with io.open(path.OUTDIR_TOK_NGRAMS + articleName, encoding='utf-8') as file:
+        sentences = [line.split() for line in file if line.strip()]  # ngram skips the empty lines as well
+    scores = model.score(sentences)
+    perplexity = model.perplexity(scores)
+    if PERPLEXITY_FORMAT == 'store':
+        _perplexity_writer().write(articleName, scores, perplexity)
+        return perplexity
+    with open(path.OUTDIR_PERPLEX+articleName+".prob", 'w') as file:
+        file.write('%g %g\n' % perplexity)  # ngram prints the numbers with 6 significant digits
+        for sentence in scores:
+            file.write(' '.join(['%g' % value if value > -numpy.inf else MINUS_INFINITY for value in sentence])+'\n')
+    return perplexity
+
+
+def _perplexity_command(articleName, lmName):
+    """
+    :return: the ngram command that calculates the probability of each word in an article (see article_perplexity)
+    """
+    return ["ngram", "-lm", path.OUTDIR_NGRAMS + lmName, "-ppl", path.OUTDIR_TOK_NGRAMS + articleName, "-debug", "2"]
+
+
+def _write_perplexity(articleName, ouput):
+    """
+    Write the output of the ngram program to a file in perplexity folder (see article_perplexity)
+    :param articleName: the name of the article
+    :param ouput: the output of the command given by _perplexity_command
+    :return: the perplexity (as a tuple)
+    """
+    ouput = ouput.split('\n')
     with io.open(path.OUTDIR_TOK_NGRAMS + articleName) as file:
         lines = file.readlines()
         for i in range(len(lines)):
             lines[i] = lines[i].split(' ')
     i = 1
+    perplexity = ouput[-2].split(' ')
+    values = []  # the probabilities for every sentence as they were printed by ngram
+    for sent in range(len(lines)):
+        values.append([])
+        for word in range(len(lines[sent]) + 1):  # the last one is the probability of the end of the sentence
+            values[-1].append(ouput[i].split('\t=')[1].split(' ')[4])
+            i += 1
+        i += 4
+    if PERPLEXITY_FORMAT == 'store':
+        _perplexity_writer().write(articleName, [[float(value) for value in sentence] for sentence in values],
+                                   (float(perplexity[-3]), float(perplexity[-1])))
+        return float(perplexity[-3]), float(perplexity[-1])
     with open(path.OUTDIR_PERPLEX+articleName+".prob", 'w') as file:
-        perplexity = ouput[-2].split(' ')
         file.write(str(perplexity[-3]) + " " + str(perplexity[-1])+"\n")
-        for sent in range(len(lines)):
-            for word in range(len(lines[sent])):
-                value = ouput[i].split('\t=')[1].split(' ')[4]
-                if value == '-inf':  # replace -inf with MINUS_INFINITY
-                    file.write(MINUS_INFINITY+' ')
-                else:
-                    file.write(value+' ')
-                i += 1
-            value = ouput[i].split('\t=')[1].split(' ')[4]
-            if value == '-inf':  # replace -inf with MINUS_INFINITY
-                file.write(MINUS_INFINITY+'\n')
-            else:
-                file.write(value+'\n')
-            i += 5
+        for sentence in values:
+            file.write(' '.join([MINUS_INFINITY if value == '-inf' else value for value in sentence])+'\n')
+            # -inf is replaced with MINUS_INFINITY
     return float(perplexity[-3]), float(perplexity[-1])
 
+
+def _perplexity_writer():
+    """
+    :return: the store.PerplexityWriter of this process that writes to OUTDIR_PERPLEX_STORE
+    """
+    global _perplexityWriter
+    if (_perplexityWriter is None) or (_perplexityWriter.directory != path.OUTDIR_PERPLEX_STORE) or \
+            (_perplexityWriter.pid != os.getpid()):  # every process writes to its own shard
+        _perplexityWriter = store.PerplexityWriter(path.OUTDIR_PERPLEX_STORE)
+    return _perplexityWriter
+
+
 def calculate_all_perplexities(lmName, nToProcess=-1, levels=[0,1,2,3,4,5], mingrade=0, maxgrade=12, include = None,
-                 onlyEnglish = True):
+                 onlyEnglish = True, workers=toolrunner.WORKERS):
     """
     calculate perplexities for articles designated by adaptation level, grade, language or slug
     :param lmName: the name of the language model (.bo extension), found in OUTDIR_NGRAMS.
@@ -219,6 +579,9 @@ def calculate_all_perplexities(lmName, nToProcess=-1, levels=[0,1,2,3,4,5], ming
     The names should go in the same order as they are in metafile (that is in alphabetical order). If include = NONE,
     the perplexities will be calculated for the first nToProcess slugs
     :param onlyEnglish: If True, only english articles will be processed
+    :param workers: the number of ngram programs that run at once (see toolrunner). The perplexities of every article
+    are written as soon as its program finishes, and its output is not kept. If SCORER = 'native', the model is loaded
+    once and all the articles are scored in this process instead
     :return:
     """
     info = nutils.loadMetafile()
@@ -245,8 +608,21 @@ def calculate_all_perplexities(lmName, nToProcess=-1, levels=[0,1,2,3,4,5], ming
         included = []
         i_index = 1
 
-    average_perpl = (.0,.0)
-    num_of_files = .0
+    average_perpl = [.0,.0]
+    num_of_files = [.0]  # lists, so that _record can change them
+    lock = threading.Lock()  # the jobs finish in different threads of the runner
+
+    def _record(job):
+        """Write the perplexities of the article as soon as ngram finishes with it and forget the output"""
+        with lock:
+            curr_perpl = _write_perplexity(job.article, job.stdout)
+            job.stdout = None
+            num_of_files[0] += 1
+            average_perpl[0] += curr_perpl[0]
+            average_perpl[1] += curr_perpl[1]
+
+    runner = toolrunner.ToolRunner(workers)
+    articles = []  # the names of the articles for which the perplexities are calculated, in the same order as the jobs
 
     i = 0
     while (i < len(info)) and ((nToProcess == -1) or (nSlugs < nToProcess)):
@@ -268,9 +644,12 @@ def calculate_all_perplexities(lmName, nToProcess=-1, levels=[0,1,2,3,4,5], ming
                 if (grade < mingrade) or (grade > maxgrade):
                     continue
 
-                curr_perpl = article_perplexity(info[artLow + level]["filename"] + ".tok", lmName)
-                num_of_files += 1
-                average_perpl=(average_perpl[0]+curr_perpl[0], average_perpl[1]+curr_perpl[1])
+                articles.append(info[artLow + level]["filename"] + ".tok")
+                if SCORER == 'native':
+                    continue
+                job = toolrunner.Job(_perplexity_command(articles[-1], lmName))
+                job.article = articles[-1]
+                runner.submit(job, callback=_record)  # the articles are processed concurrently
 
             if nToProcess == -1:
                 print(
@@ -278,7 +657,15 @@ def calculate_all_perplexities(lmName, nToProcess=-1, levels=[0,1,2,3,4,5], ming
             else:
                 print("Processing slug... " + slug + ' ' + str(
                     round(nSlugs / float(nToProcess) * 100, 3)) + '% completed')
-    print(str(average_perpl[0]/num_of_files)+ " "+ str(average_perpl[1]/num_of_files))
+    if SCORER == 'native':
+        model = arpa.load(path.OUTDIR_NGRAMS + lmName)  # the model is read once for all the articles
+        for article in articles:
+            curr_perpl = _score_article(article, model)
+            num_of_files[0] += 1
+            average_perpl[0] += curr_perpl[0]
+            average_perpl[1] += curr_perpl[1]
+    _report_failures(runner.wait())
+    print(str(average_perpl[0]/num_of_files[0])+ " "+ str(average_perpl[1]/num_of_files[0]))
 
 if __name__ == "__main__":
     delete_pars_symbols()
@@ -1,27 +1,55 @@
 # Tokenize and Parse a bunch of newsela articles and write to stdout.
 
 import sys
+import multiprocessing
 import newselautil as nsla
 import classpaths as path
 import StanfordParse
 
-def all():
+TOKENIZER = 'stanford'  # 'stanford' - the files are tokenized by custom/Tokenizer (see StanfordParse.tokenize).
+# 'nltk' - the files are tokenized in this process by the NLTK tokenizers (see newselautil.tokenizeFile)
+
+
+def all(workers=0):
     """
     tokenize all articles
+    :param workers: the number of long-lived tokenizer processes to use (see StanfordParse.start_workers). If 0, a new
+    process is started for every file. If TOKENIZER = 'nltk', the number of processes in the pool that tokenize the
+    slugs (if workers > 1)
     :return: None
     """
     articles = nsla.loadMetafile()
-    i = 0
-    # process articles by slug
-    while i < len(articles):
-        slug = articles[i]['slug']
-        NOfLevels = 1
-        while (i < len(articles))and(articles[i+1]['slug'] == slug):
-            NOfLevels += 1
-            i += 1
-        processFile(slug, NOfLevels)
-        print ('Parsing:' + slug+' '+str(round(i/float(len(articles)), 5))+' of the task completed')
-        i += 1
+    slugs = sorted(articles.slugRanges.keys(), key=lambda slug: articles.slugRanges[slug][0])
+    tasks = [(slug, articles.slugRanges[slug][1] - articles.slugRanges[slug][0]) for slug in slugs]
+    if (TOKENIZER == 'nltk') and (workers > 1):
+        pool = multiprocessing.Pool(workers)
+        try:
+            done = 0
+            for slug in pool.imap_unordered(_process_task, tasks):
+                done += 1
+                print ('Parsing:' + slug+' '+str(round(done/float(len(tasks)), 5))+' of the task completed')
+        finally:
+            pool.close()
+            pool.join()
+        return
+    if (TOKENIZER == 'stanford') and (workers > 0):
+        StanfordParse.start_workers(workers)
+    try:
+        for i in range(len(tasks)):
+            processFile(tasks[i][0], tasks[i][1])
+            print ('Parsing:' + tasks[i][0]+' '+str(round(i/float(len(tasks)), 5))+' of the task completed')
+    finally:
+        StanfordParse.stop_workers()
+
+
+def _process_task(task):
+    """
+    tokenize the files with a given slug in a worker process of all
+    :param task: a tuple (slug, number of levels)
+    :return: the slug
+    """
+    processFile(task[0], task[1], 'nltk')
+    return task[0]
 
 def particular(needed):
     """
@@ -33,16 +61,29 @@ def particular(needed):
         processFile(slug)
 
 
-def processFile(slug,numberOfLevels = 6):
+def processFile(slug,numberOfLevels = 6, tokenizer=None):
     """
     tokenize the files with a given slug
     :param slug: the slug to tokenize
     :param numberOfLevels: specified number of Levels to process
+    :param tokenizer: 'stanford' or 'nltk' (see TOKENIZER). By default, TOKENIZER is used
     :return: None
     """
+    if tokenizer is None:
+        tokenizer = TOKENIZER
+    if tokenizer == 'nltk':
+        for i in range(numberOfLevels):
+            try:
+                nsla.tokenizeFile(path.BASEDIR + '/articles/' + slug + ".en." + str(i) + ".txt")
+            except:
+                print('ERROR while parsing %s' % (slug))
+        return
+    errors = StanfordParse.tokenize_many([path.BASEDIR + '/articles/' + slug + ".en." + str(i) + ".txt"
+                                          for i in range(numberOfLevels)])  # all levels at once if there are workers
     for i in range(numberOfLevels):
         try:
-            StanfordParse.tokenize(path.BASEDIR + '/articles/' + slug + ".en." + str(i) + ".txt")
+            if errors[i] is not None:
+                raise errors[i]
             with open(path.BASEDIR + '/articles/' + slug + ".en." + str(i) + ".txt.tok") as file:
                 lines = file.readlines()
                 for j in range(len(lines)):
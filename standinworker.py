@@ -0,0 +1,156 @@
+# A stand-in for custom/BatchTokenizer and custom/BatchParser that speaks the same batch protocol (see StanfordParse.py)
+# without Java and the Stanford models, so that the worker pool can be checked on any machine.
+#
+# python standinworker.py tokenizer - for every file name read from stdin, write textfile.tok with one sentence per line
+# (every line of the file split on whitespace) and print DONE_MARKER
+# python standinworker.py parser - for every file name, print one line "(ROOT word word ...)" per line of the file and
+# then DONE_MARKER
+# python standinworker.py check - start the pools with the stand-in workers and check the protocol: the output of the
+# parser, the .tok files, the files that cannot be processed and the workers that die. Prints the problems found
+#
+# If the file does not exist, FAILED_MARKER is printed instead of DONE_MARKER. If the first line of the file is
+# CRASH_LINE, the worker exits without answering, as if the JVM died.
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+import StanfordParse
+
+CRASH_LINE = '@@CRASH@@'  # the first line of the files that make the worker exit
+
+
+def serve(kind):
+    '''Process the files named on stdin until stdin is closed'''
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            return
+        textfile = line.rstrip('\r\n')
+        if not os.path.isfile(textfile):
+            _answer(StanfordParse.FAILED_MARKER + ' no such file: ' + textfile + '\n')
+            continue
+        with io.open(textfile, encoding='utf-8') as file:
+            lines = [text.split() for text in file.read().split('\n')]
+        if (len(lines) > 0) and (lines[0] == [CRASH_LINE]):
+            sys.exit(1)
+        lines = [words for words in lines if len(words) > 0]
+        if kind == 'tokenizer':
+            with io.open(textfile + '.tok', 'w', encoding='utf-8') as file:
+                for words in lines:
+                    file.write(u' '.join(words) + u'\n')
+            _answer(StanfordParse.DONE_MARKER + '\n')
+        else:
+            _answer(u''.join(u'(ROOT ' + u' '.join(words) + u')\n' for words in lines) + StanfordParse.DONE_MARKER +
+                    u'\n')
+
+
+def _answer(text):
+    '''Write the text to stdout as utf-8 and flush it, so that the pool receives it at once'''
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    out = sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout
+    out.write(text)
+    out.flush()
+
+
+def check(size=2):
+    '''
+    Run the pools of stand-in workers on temporary files and check that every path returns the same results
+    :param size: the number of workers of every kind
+    :return: the list of the problems found (empty if everything works)
+    '''
+    problems = []
+    directory = tempfile.mkdtemp(prefix='standin')
+    command = [sys.executable, os.path.abspath(__file__)]
+    try:
+        files = []
+        for i in range(6):
+            files.append(os.path.join(directory, 'article' + str(i) + '.txt'))
+            with io.open(files[-1], 'w', encoding='utf-8') as file:
+                file.write(u'first sentence of article ' + str(i) + u'\n\nsecond one é\n')
+        crash = os.path.join(directory, 'crash.txt')
+        with io.open(crash, 'w', encoding='utf-8') as file:
+            file.write(CRASH_LINE + u'\n')
+        missing = os.path.join(directory, 'missing.txt')
+
+        StanfordParse.start_workers(size, size, command + ['tokenizer'], command + ['parser'])
+        pooled = StanfordParse.parse_many(files)
+        if pooled != [StanfordParse.parse(name) for name in files]:
+            problems.append('parse_many and parse return different results')
+        for name, output in zip(files, pooled):
+            if not isinstance(output, type(u'')):
+                problems.append('the parser returned ' + repr(type(output)) + ' for ' + name)
+            elif output.count(u'(ROOT') != 2:
+                problems.append('wrong output for ' + name + ': ' + repr(output))
+        results = StanfordParse.tokenize_many(files + [missing, crash] + files)
+        for name, result in zip(files + [missing, crash] + files, results):
+            if (name in (missing, crash)) != isinstance(result, StanfordParse.WorkerError):
+                problems.append('wrong result for ' + name + ': ' + repr(result))
+            elif (result is None) and not os.path.isfile(name + '.tok'):
+                problems.append(name + '.tok was not written')
+        for name in (missing, crash):  # the worker that died is started again for the next file
+            try:
+                StanfordParse.parse(name)
+                problems.append('no error for ' + name)
+            except StanfordParse.WorkerError:
+                pass
+        if StanfordParse.parse(files[0]) != pooled[0]:
+            problems.append('the worker was not restarted after it died')
+        StanfordParse.stop_workers()
+
+        original = StanfordParse._command
+        StanfordParse._command = lambda kind, textfile: command + [kind + '-once', textfile]  # a process per file
+        try:
+            if [StanfordParse.parse(name) for name in files] != pooled:
+                problems.append('parse returns different results without the workers')
+            if StanfordParse.parse_many(files) != pooled:
+                problems.append('parse_many returns different results without the workers')
+        finally:
+            StanfordParse._command = original
+    finally:
+        StanfordParse.stop_workers()
+        shutil.rmtree(directory, ignore_errors=True)
+    return problems
+
+
+def main():
+    kind = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    if kind == 'check':
+        problems = check()
+        for problem in problems:
+            print('ERROR: ' + problem)
+        print('OK' if len(problems) == 0 else str(len(problems)) + ' problems found')
+        sys.exit(0 if len(problems) == 0 else 1)
+    if kind.endswith('-once'):  # the program that processes one file, as the commands started by _command do
+        output = io.BytesIO()
+        real = sys.stdout
+        sys.stdin = io.StringIO(sys.argv[2] + u'\n')
+        sys.stdout = _Capture(output)
+        try:
+            serve(kind[:-len('-once')])
+        finally:
+            sys.stdout = real
+        text = output.getvalue().decode('utf-8')
+        if StanfordParse.FAILED_MARKER in text:
+            sys.exit(1)
+        _answer(text.replace(StanfordParse.DONE_MARKER + '\n', ''))
+        return
+    serve(kind)
+
+
+class _Capture(object):
+
+    """ collects what serve writes instead of stdout """
+
+    def __init__(self, output):
+        self.buffer = output
+
+    def flush(self):
+        pass
+
+
+if __name__ == "__main__":
+    main()
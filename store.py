@@ -0,0 +1,475 @@
+"""
+This module allows to keep the results of the alignment in a few large binary files instead of two small text files per
+every pair of articles (see align.write_result). The results are appended to shards. A shard consists of two files:
+NAME.data contains the int32 arrays, and NAME.index contains one tab-separated line per every pair of articles that
+tells where the arrays for this pair are. Every process writes to its own shard, so that many processes can write at
+once. If the same pair of articles was written more than once, the latest record is used.
+
+For every pair of articles (slug, loLevel, hiLevel) the following arrays are stored one after another:
+    sInd0, sInd1    - sInd from align.py (the number of sentences that occur before every paragraph)
+    sentences       - all the sentence alignments. Every alignment is four numbers: the index of the paragraph and the
+                    index of the sentence within this paragraph for the first article, then same for the second one
+    blocks          - the number of alignments in every block of alignments. A block of alignments is a set of
+                    alignments that share sentences between them
+    parSizes        - for every paragraph alignment, the number of paragraphs from the first and from the second article
+    pars            - the indexes of these paragraphs (first the paragraphs from the first article, then the paragraphs
+                    from the second one, for every paragraph alignment)
+All the indexes are zero-based.
+
+AlignmentWriter(directory, shard=None) - appends the results to a shard:
+    write(slug, loLevel, hiLevel, sInd, result, parResult, parCounts) - appends the results for one pair of articles
+
+AlignmentStore(directory) - reads the results from all the shards in the directory. The data files are memory-mapped:
+    pairs(slug=None) - the list of (slug, loLevel, hiLevel) tuples available in the store
+    sentence_indexes(slug, loLevel, hiLevel) - returns sInd0 and sInd1
+    sentence_blocks(slug, loLevel, hiLevel) - returns the list of blocks of sentence alignments
+    paragraph_counts(slug, loLevel, hiLevel) - returns the number of paragraphs in both articles
+    paragraph_alignments(slug, loLevel, hiLevel) - returns the list of paragraph alignments
+    close() - forgets all the memory-mapped files
+
+The per-word probabilities calculated by ngram.py (see ngram.PERPLEXITY_FORMAT) are kept the same way. For every
+article the following arrays are stored:
+    offsets         - len(sentences) + 1 int32 numbers: where the probabilities for every sentence begin and end
+    probabilities   - the float32 log10 probabilities of all the words, sentence after sentence. Every sentence is
+                    followed by the probability of its end, -inf is used for the words that are out of vocabulary
+The perplexities of the article (ppl and ppl1) are kept in the index.
+
+PerplexityWriter(directory, shard=None) - appends the probabilities to a shard:
+    write(article, scores, perplexity) - appends the probabilities for one article
+
+PerplexityStore(directory) - reads the probabilities from all the shards in the directory:
+    articles() - the list of the articles available in the store
+    perplexity(article) - returns (ppl, ppl1)
+    sentence_offsets(article), probabilities(article) - return the arrays for the article
+    sentences(article) - returns the list of arrays of probabilities, one per sentence
+    close() - forgets all the memory-mapped files
+
+The similarities between all the sentences of a pair of articles (see align.SIMILARITY_STORE) are kept the same way.
+For every pair of articles (slug, loLevel, hiLevel) the following arrays are stored:
+    sInd0, sInd1    - sInd from align.py
+    similarities    - the float16 matrix of the similarities (sInd0[-1] rows, sInd1[-1] columns), row after row. Two
+                    values are packed into every int32 number, the last one is padded with zero if needed
+The hash of everything the similarities were calculated from is kept in the index, so that the similarities calculated
+from other articles or with other parameters are never used.
+
+SimilarityWriter(directory, shard=None) - appends the similarities to a shard:
+    write(slug, loLevel, hiLevel, inputHash, sInd, similarities) - appends the similarities for one pair of articles
+
+SimilarityStore(directory) - reads the similarities from all the shards in the directory:
+    pairs(slug=None) - the list of (slug, loLevel, hiLevel) tuples available in the store
+    input_hash(slug, loLevel, hiLevel) - the hash the similarities were written with
+    sentence_indexes(slug, loLevel, hiLevel) - returns sInd0 and sInd1
+    similarities(slug, loLevel, hiLevel) - returns the memory-mapped float16 matrix
+    lookup(slug, loLevel, hiLevel, inputHash) - returns the matrix if it was written with this hash, None otherwise
+    close() - forgets all the memory-mapped files
+"""
+
+import os
+import glob
+import socket
+import time
+import numpy
+
+DATA_EXTENSION = '.data'
+INDEX_EXTENSION = '.index'
+_FIELDS = 9  # the number of integer fields in the index line after slug, levels and time (see AlignmentWriter.write)
+_PERPLEXITY_FIELDS = 5  # same for the index line of PerplexityWriter.write: offset, the number of sentences, the
+# number of probabilities, ppl and ppl1
+_SIMILARITY_FIELDS = 6  # same for the index line of SimilarityWriter.write: the hash of the input, offset, the lengths
+# of sInd0 and sInd1, the number of rows and the number of columns
+
+
+class AlignmentWriter(object):
+
+    """ appends the results of the alignment to one shard of the store """
+
+    def __init__(self, directory, shard=None):
+        """
+        :param directory:   the directory with the store. It is created if it does not exist
+        :param shard:       the name of the shard. By default the name of the machine and the id of the process are used,
+        so that every process writes to its own shard
+        """
+        self.directory = directory
+        self.pid = os.getpid()  # the process that created the writer
+        self.dataFile, self.indexFile = _open_shard(directory, shard)
+
+    def write(self, slug, loLevel, hiLevel, sInd, result, parResult, parCounts):
+        """
+        Append the results of the alignment of one pair of articles. The data is written before the line in the index,
+        so the record will only be visible to the readers, if it was written completely
+        :param slug:        the slug of the articles
+        :param loLevel:     the lower one of two levels compared
+        :param hiLevel:     the higher one of two levels compared
+        :param sInd:        the tuple of two sInd arrays (see align.py)
+        :param result:      the list of blocks of sentence alignments. Every block is a list of alignments, and every
+        alignment is a tuple ((paragraph, sentence), (paragraph, sentence)) (see align.result)
+        :param parResult:   the list of paragraph alignments. Every alignment is a tuple of two lists of paragraph indexes
+        (see align.parResult)
+        :param parCounts:   the tuple with the number of paragraphs in the first and in the second article
+        :return:            None
+        """
+        sentences = numpy.array([[a[0][0], a[0][1], a[1][0], a[1][1]] for block in result for a in block],
+                                dtype=numpy.int32).reshape(-1, 4)
+        blocks = numpy.array([len(block) for block in result], dtype=numpy.int32)
+        parSizes = numpy.array([[len(a[0]), len(a[1])] for a in parResult], dtype=numpy.int32).reshape(-1, 2)
+        pars = numpy.array([p for a in parResult for p in list(a[0]) + list(a[1])], dtype=numpy.int32)
+        arrays = [numpy.asarray(sInd[0], dtype=numpy.int32), numpy.asarray(sInd[1], dtype=numpy.int32),
+                  sentences.ravel(), blocks, parSizes.ravel(), pars]
+        offset = _append_arrays(self.dataFile, arrays)
+        fields = [offset, len(arrays[0]), len(arrays[1]), len(sentences), len(blocks), len(parSizes), len(pars),
+                  parCounts[0], parCounts[1]]
+        _append_index(self.indexFile, [slug, str(loLevel), str(hiLevel)], list(map(str, fields)))
+
+
+class AlignmentStore(object):
+
+    """ reads the results of the alignment from all the shards in a directory """
+
+    def __init__(self, directory):
+        """
+        :param directory:   the directory with the store
+        """
+        self.directory = directory
+        self.records = {}  # for every (slug, loLevel, hiLevel) stores (shard, fields)
+        self.data = {}  # the memory-mapped data files of the shards. Opened when they are needed for the first time
+        for key, record in _read_index(directory, 3, _FIELDS).items():
+            self.records[(key[0], int(key[1]), int(key[2]))] = (record[0], list(map(int, record[1])))
+
+    def pairs(self, slug=None):
+        """
+        :param slug:    if given, only the pairs of articles with this slug are returned
+        :return:        the sorted list of (slug, loLevel, hiLevel) tuples available in the store
+        """
+        return sorted(key for key in self.records if (slug is None) or (key[0] == slug))
+
+    def _arrays(self, slug, loLevel, hiLevel):
+        """
+        :return: the list of arrays stored for the given pair of articles (see the description of the module)
+        """
+        shard, fields = self.records[(slug, loLevel, hiLevel)]
+        return _slice_arrays(self.directory, self.data, shard, fields[0],
+                             [fields[1], fields[2], 4 * fields[3], fields[4], 2 * fields[5], fields[6]])
+
+    def sentence_indexes(self, slug, loLevel, hiLevel):
+        """
+        :return: the tuple of two sInd arrays for the given pair of articles (see align.py)
+        """
+        arrays = self._arrays(slug, loLevel, hiLevel)
+        return arrays[0], arrays[1]
+
+    def sentence_blocks(self, slug, loLevel, hiLevel):
+        """
+        :return: the list of blocks of sentence alignments for the given pair of articles. Every block is an array of
+        shape (n, 4), every row is (paragraph, sentence, paragraph, sentence). The sentence index is relative to the
+        beginning of the paragraph
+        """
+        arrays = self._arrays(slug, loLevel, hiLevel)
+        sentences = arrays[2].reshape(-1, 4)
+        return numpy.split(sentences, numpy.cumsum(arrays[3])[:-1]) if len(arrays[3]) > 0 else []
+
+    def paragraph_counts(self, slug, loLevel, hiLevel):
+        """
+        :return: the tuple with the number of paragraphs in the first and in the second article
+        """
+        fields = self.records[(slug, loLevel, hiLevel)][1]
+        return fields[7], fields[8]
+
+    def paragraph_alignments(self, slug, loLevel, hiLevel):
+        """
+        :return: the list of paragraph alignments for the given pair of articles. Every alignment is a tuple of two
+        arrays of paragraph indexes
+        """
+        arrays = self._arrays(slug, loLevel, hiLevel)
+        sizes = arrays[4].reshape(-1, 2)
+        alignments = []
+        offset = 0
+        for size in sizes:
+            alignments.append((arrays[5][offset:offset + size[0]], arrays[5][offset + size[0]:offset + size[0] +
+                                                                             size[1]]))
+            offset += size[0] + size[1]
+        return alignments
+
+    def close(self):
+        """
+        Forget all the memory-mapped files. They are closed as soon as the arrays returned before are no longer used
+        """
+        self.data = {}  # the files are closed, when the arrays are no longer referenced
+
+
+class PerplexityWriter(object):
+
+    """ appends the per-word probabilities calculated by ngram.py to one shard of the store """
+
+    def __init__(self, directory, shard=None):
+        """
+        :param directory:   the directory with the store. It is created if it does not exist
+        :param shard:       the name of the shard (see AlignmentWriter)
+        """
+        self.directory = directory
+        self.pid = os.getpid()  # the process that created the writer
+        self.dataFile, self.indexFile = _open_shard(directory, shard)
+
+    def write(self, article, scores, perplexity):
+        """
+        Append the probabilities for one article
+        :param article:     the name of the article (the name of the tokenized file, e.g. slug.en.0.txt.tok)
+        :param scores:      the list with the log10 probabilities for every sentence. The last value for every sentence
+        is the probability of the end of the sentence. -inf is used for the words that are out of vocabulary
+        :param perplexity:  the tuple (ppl, ppl1) for the article
+        :return:            None
+        """
+        lengths = [len(sentence) for sentence in scores]
+        offsets = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int32)
+        values = numpy.concatenate([numpy.asarray(sentence, dtype=numpy.float32) for sentence in scores]) \
+            if len(scores) > 0 else numpy.zeros(0, dtype=numpy.float32)
+        offset = _append_arrays(self.dataFile, [offsets, values.astype(numpy.float32)])
+        _append_index(self.indexFile, [article], [str(offset), str(len(scores)), str(len(values)),
+                                                  repr(float(perplexity[0])), repr(float(perplexity[1]))])
+
+
+class PerplexityStore(object):
+
+    """ reads the per-word probabilities from all the shards in a directory """
+
+    def __init__(self, directory):
+        """
+        :param directory:   the directory with the store
+        """
+        self.directory = directory
+        self.records = {}  # for every article stores (shard, fields)
+        self.data = {}  # the memory-mapped data files of the shards. Opened when they are needed for the first time
+        for key, record in _read_index(directory, 1, _PERPLEXITY_FIELDS).items():
+            self.records[key[0]] = (record[0], list(map(int, record[1][:3])) + list(map(float, record[1][3:])))
+
+    def articles(self):
+        """
+        :return:    the sorted list of the names of the articles available in the store
+        """
+        return sorted(self.records)
+
+    def perplexity(self, article):
+        """
+        :return:    the tuple (ppl, ppl1) for the article (see ngram.article_perplexity)
+        """
+        fields = self.records[article][1]
+        return fields[3], fields[4]
+
+    def _arrays(self, article):
+        """
+        :return:    the sentence offsets (int32) and the probabilities (float32) of the article
+        """
+        shard, fields = self.records[article]
+        offsets, values = _slice_arrays(self.directory, self.data, shard, fields[0], [fields[1] + 1, fields[2]])
+        return offsets, values.view(numpy.float32)
+
+    def sentence_offsets(self, article):
+        """
+        :return:    the array of len(sentences) + 1 numbers. The probabilities for the sentence i are
+        probabilities(article)[offsets[i]:offsets[i + 1]]
+        """
+        return self._arrays(article)[0]
+
+    def probabilities(self, article):
+        """
+        :return:    the float32 array of the log10 probabilities of all the words in the article, sentence after
+        sentence. Every sentence is followed by the probability of its end. -inf is used for the words that are out of
+        vocabulary
+        """
+        return self._arrays(article)[1]
+
+    def sentences(self, article):
+        """
+        :return:    the list of float32 arrays, one per sentence (see probabilities)
+        """
+        offsets, values = self._arrays(article)
+        return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    def close(self):
+        """
+        Forget all the memory-mapped files. They are closed as soon as the arrays returned before are no longer used
+        """
+        self.data = {}
+
+
+class SimilarityWriter(object):
+
+    """ appends the similarities between the sentences calculated by align.py to one shard of the store """
+
+    def __init__(self, directory, shard=None):
+        """
+        :param directory:   the directory with the store. It is created if it does not exist
+        :param shard:       the name of the shard (see AlignmentWriter)
+        """
+        self.directory = directory
+        self.pid = os.getpid()  # the process that created the writer
+        self.dataFile, self.indexFile = _open_shard(directory, shard)
+
+    def write(self, slug, loLevel, hiLevel, inputHash, sInd, similarities):
+        """
+        Append the similarities between all the sentences of one pair of articles
+        :param slug:            the slug of the articles
+        :param loLevel:         the lower one of two levels compared
+        :param hiLevel:         the higher one of two levels compared
+        :param inputHash:       the hash of everything the similarities were calculated from (a string without tabs)
+        :param sInd:            the tuple of two sInd arrays (see align.py)
+        :param similarities:    the matrix with sInd[0][-1] rows and sInd[1][-1] columns
+        :return:                None
+        """
+        values = numpy.asarray(similarities, dtype=numpy.float16).ravel()
+        if len(values) % 2 == 1:
+            values = numpy.concatenate([values, numpy.zeros(1, dtype=numpy.float16)])
+        arrays = [numpy.asarray(sInd[0], dtype=numpy.int32), numpy.asarray(sInd[1], dtype=numpy.int32),
+                  values.view(numpy.int32)]
+        offset = _append_arrays(self.dataFile, arrays)
+        fields = [offset, len(arrays[0]), len(arrays[1]), similarities.shape[0], similarities.shape[1]]
+        _append_index(self.indexFile, [slug, str(loLevel), str(hiLevel)], [inputHash] + list(map(str, fields)))
+
+
+class SimilarityStore(object):
+
+    """ reads the similarities between the sentences from all the shards in a directory """
+
+    def __init__(self, directory):
+        """
+        :param directory:   the directory with the store
+        """
+        self.directory = directory
+        self.records = {}  # for every (slug, loLevel, hiLevel) stores (shard, the hash of the input, fields)
+        self.data = {}  # the memory-mapped data files of the shards. Opened when they are needed for the first time
+        for key, record in _read_index(directory, 3, _SIMILARITY_FIELDS).items():
+            self.records[(key[0], int(key[1]), int(key[2]))] = (record[0], record[1][0],
+                                                                 list(map(int, record[1][1:])))
+
+    def pairs(self, slug=None):
+        """
+        :param slug:    if given, only the pairs of articles with this slug are returned
+        :return:        the sorted list of (slug, loLevel, hiLevel) tuples available in the store
+        """
+        return sorted(key for key in self.records if (slug is None) or (key[0] == slug))
+
+    def input_hash(self, slug, loLevel, hiLevel):
+        """
+        :return: the hash the similarities for the given pair of articles were written with
+        """
+        return self.records[(slug, loLevel, hiLevel)][1]
+
+    def _arrays(self, slug, loLevel, hiLevel):
+        """
+        :return: sInd0, sInd1 and the similarities (as int32) for the given pair of articles
+        """
+        shard, inputHash, fields = self.records[(slug, loLevel, hiLevel)]
+        return _slice_arrays(self.directory, self.data, shard, fields[0],
+                             [fields[1], fields[2], (fields[3] * fields[4] + 1) // 2])
+
+    def sentence_indexes(self, slug, loLevel, hiLevel):
+        """
+        :return: the tuple of two sInd arrays for the given pair of articles (see align.py)
+        """
+        arrays = self._arrays(slug, loLevel, hiLevel)
+        return arrays[0], arrays[1]
+
+    def similarities(self, slug, loLevel, hiLevel):
+        """
+        :return: the read-only float16 matrix of the similarities between every sentence of the first article (rows)
+        and every sentence of the second one (columns)
+        """
+        fields = self.records[(slug, loLevel, hiLevel)][2]
+        values = self._arrays(slug, loLevel, hiLevel)[2].view(numpy.float16)
+        return values[:fields[3] * fields[4]].reshape(fields[3], fields[4])
+
+    def lookup(self, slug, loLevel, hiLevel, inputHash):
+        """
+        :return: the matrix returned by similarities if the store has the similarities for the given pair of articles
+        and they were written with the given hash, None otherwise
+        """
+        if self.records.get((slug, loLevel, hiLevel), (None, None))[1] != inputHash:
+            return None
+        return self.similarities(slug, loLevel, hiLevel)
+
+    def close(self):
+        """
+        Forget all the memory-mapped files. They are closed as soon as the arrays returned before are no longer used
+        """
+        self.data = {}
+
+
+def _open_shard(directory, shard=None):
+    """
+    Create the directory if it does not exist
+    :param directory:   the directory with the store
+    :param shard:       the name of the shard. By default the name of the machine and the id of the process are used
+    :return:            the names of the data file and the index file of the shard
+    """
+    if shard is None:
+        shard = socket.gethostname() + '-' + str(os.getpid())
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:  # another process has just created it
+            pass
+    return os.path.join(directory, shard + DATA_EXTENSION), os.path.join(directory, shard + INDEX_EXTENSION)
+
+
+def _append_arrays(dataFile, arrays):
+    """
+    Append the arrays of 4-byte numbers to the data file
+    :return:    the position of the first array in the file (in 4-byte numbers)
+    """
+    with open(dataFile, 'ab') as file:
+        file.seek(0, 2)
+        offset = file.tell() // 4
+        for array in arrays:
+            array.tofile(file)
+    return offset
+
+
+def _append_index(indexFile, key, fields):
+    """
+    Append the line for one record to the index. It should be called after the data was written, so the record will
+    only be visible to the readers, if it was written completely
+    :param key:     the list of strings that identify the record
+    :param fields:  the list of strings that tell where the data is
+    :return:        None
+    """
+    with open(indexFile, 'a') as file:
+        file.write('\t'.join(key + [repr(time.time())] + fields) + '\n')
+
+
+def _read_index(directory, nKeys, nFields):
+    """
+    Read the index files of all the shards in the directory. If the same key was written more than once, the latest
+    record is used
+    :param nKeys:   the number of strings in the key of every record
+    :param nFields: the number of fields in every record after the key and the time
+    :return:        the dictionary, where for every key (tuple of strings) (shard, fields) is stored. The fields are
+    strings
+    """
+    records = {}  # for every key stores (written, shard, fields), where written is the time the record was written
+    for indexFile in sorted(glob.glob(os.path.join(directory, '*' + INDEX_EXTENSION))):
+        shard = os.path.basename(indexFile)[:-len(INDEX_EXTENSION)]
+        with open(indexFile) as file:
+            for line in file:
+                line = line.rstrip('\n').split('\t')
+                if len(line) != nKeys + 1 + nFields:  # the line was not written completely
+                    continue
+                key = tuple(line[:nKeys])
+                record = (float(line[nKeys]), shard, line[nKeys + 1:])
+                if (key not in records) or (records[key][0] <= record[0]):
+                    records[key] = record
+    return dict((key, records[key][1:]) for key in records)
+
+
+def _slice_arrays(directory, data, shard, offset, lengths):
+    """
+    :param data:    the dictionary with the memory-mapped data files, the data file of the shard is added if needed
+    :param offset:  the position of the first array in the data file (in 4-byte numbers)
+    :param lengths: the lengths of the arrays that are stored one after another
+    :return:        the list of int32 arrays
+    """
+    if shard not in data:
+        data[shard] = numpy.memmap(os.path.join(directory, shard + DATA_EXTENSION), dtype=numpy.int32, mode='r')
+    arrays = []
+    for length in lengths:
+        arrays.append(data[shard][offset:offset + length])
+        offset += length
+    return arrays
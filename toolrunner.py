@@ -0,0 +1,205 @@
+"""
+This module runs external programs (ngram-count, ngram-merge, ngram, java) several at a time. The programs are started
+by a fixed number of threads, each of which waits for one program at a time, so the number of programs that run at once
+is bounded.
+
+Job(command, output=None, creates=None, timeout=None) - one call of an external program. If output is given, the
+standard output of the program is written to this file, otherwise it is kept in Job.stdout. creates is the file that
+the program writes itself (if any). If the program fails or times out, neither of these files is left behind
+
+ToolRunner(workers=WORKERS, timeout=None) - runs the jobs:
+    submit(command, output=None, creates=None, timeout=None, callback=None) - schedule a job and return it. If callback
+    is given, it is called with the job as soon as the job succeeds, so that its output can be processed and dropped
+    before the other jobs finish
+    wait() - wait for all the scheduled jobs, return the list of the jobs that failed
+    run(jobs) - submit the jobs (or commands) and wait for them
+
+run_all(commands, workers=WORKERS, timeout=None) - run the commands and return the list of jobs
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+is_py2 = sys.version[0] == '2'
+if is_py2:
+    import Queue as queue
+else:
+    import queue
+
+WORKERS = 4  # the default number of programs that run at once
+
+
+class Job(object):
+
+    """ one call of an external program """
+
+    def __init__(self, command, output=None, creates=None, timeout=None):
+        """
+        :param command: the program and its arguments (list of strings)
+        :param output:  the file to write the standard output to. If None, the output is kept in stdout
+        :param creates: the file the program writes itself. It is deleted if the program fails
+        :param timeout: the number of seconds after which the program is killed. If None, the program is not killed
+        """
+        self.command = command
+        self.output = output
+        self.creates = creates
+        self.timeout = timeout
+        self.returncode = None  # the exit code of the program, None if it was not started
+        self.stdout = None  # the standard output of the program (unless it was written to output)
+        self.stderr = None  # the standard error of the program
+        self.error = None  # the description of the failure, None if the job succeeded
+        self.timedOut = False
+        self.callback = None  # the function called with the job when it succeeds (see ToolRunner.submit)
+
+    def ok(self):
+        """
+        :return: True if the program finished with exit code 0 before the timeout
+        """
+        return (self.returncode == 0) and (self.error is None)
+
+    def run(self):
+        """
+        Run the program and wait for it. The output file is written under a temporary name first and renamed when the
+        program succeeds
+        :return: None
+        """
+        temporary = None
+        try:
+            if self.output is not None:
+                temporary = self.output + '.' + str(os.getpid()) + '.' + str(id(self))
+                out = open(temporary, 'wb')
+            else:
+                out = subprocess.PIPE
+            try:
+                process = subprocess.Popen(self.command, stdout=out, stderr=subprocess.PIPE, shell=False)
+                timer = None
+                if self.timeout is not None:
+                    timer = threading.Timer(self.timeout, self._kill, [process])
+                    timer.start()
+                try:
+                    stdout, stderr = process.communicate()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+            finally:
+                if temporary is not None:
+                    out.close()
+            self.returncode = process.returncode
+            self.stderr = stderr.decode('utf-8', 'replace')
+            if stdout is not None:
+                self.stdout = stdout.decode('utf-8')
+            if self.timedOut:
+                self.error = 'killed after ' + str(self.timeout) + ' seconds'
+            elif self.returncode != 0:
+                self.error = 'exit code ' + str(self.returncode) + ': ' + self.stderr.strip()
+        except Exception as e:  # the program could not be started
+            self.error = str(e)
+        if self.error is None:
+            if temporary is not None:
+                os.rename(temporary, self.output)
+            return
+        for name in [temporary, self.creates]:
+            if (name is not None) and os.path.exists(name):
+                os.remove(name)
+
+    def _kill(self, process):
+        """Kill the program when the timeout expires"""
+        self.timedOut = True
+        try:
+            process.kill()
+        except OSError:  # the program has just finished
+            pass
+
+    def __str__(self):
+        return ' '.join(self.command) + ('' if self.error is None else ' (' + self.error + ')')
+
+
+class ToolRunner(object):
+
+    """ runs jobs with at most workers programs at a time """
+
+    def __init__(self, workers=WORKERS, timeout=None):
+        """
+        :param workers: the maximum number of programs that run at once
+        :param timeout: the default timeout for the jobs (see Job)
+        """
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.jobs = queue.Queue()
+        self.submitted = []  # all the jobs submitted since the last call to wait
+        self.threads = []
+
+    def submit(self, command, output=None, creates=None, timeout=None, callback=None):
+        """
+        Schedule the program. It is started as soon as there is a free thread
+        :param command:  a Job or a list of strings (see Job)
+        :param callback: the function that is called with the job in the thread that ran it, as soon as the job
+        succeeds. Several callbacks might run at once. If the callback raises an exception, the job is reported as
+        failed
+        :return: the Job
+        """
+        if isinstance(command, Job):
+            job = command
+        else:
+            job = Job(command, output, creates, self.timeout if timeout is None else timeout)
+        if callback is not None:
+            job.callback = callback
+        self.submitted.append(job)
+        if len(self.threads) == 0:  # the threads are started with the first job and stop in wait
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.jobs.put(job)
+        return job
+
+    def _work(self):
+        """Run the jobs until None is received"""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            job.run()
+            if job.ok() and (job.callback is not None):
+                try:
+                    job.callback(job)
+                except Exception as e:
+                    job.error = 'the output could not be processed: ' + repr(e)
+
+    def wait(self):
+        """
+        Wait for all the submitted jobs to finish
+        :return: the list of the jobs that failed
+        """
+        for thread in self.threads:
+            self.jobs.put(None)  # every thread stops after it receives None
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        failed = [job for job in self.submitted if not job.ok()]
+        self.submitted = []
+        return failed
+
+    def run(self, jobs):
+        """
+        Run the jobs and wait for them
+        :param jobs: the list of Jobs or commands
+        :return: the list of the Jobs in the same order
+        """
+        jobs = [self.submit(job) for job in jobs]
+        self.wait()
+        return jobs
+
+
+def run_all(commands, workers=WORKERS, timeout=None):
+    """
+    Run the commands, at most workers at a time
+    :param commands: the list of Jobs or commands (lists of strings)
+    :param workers:  the maximum number of programs that run at once
+    :param timeout:  the timeout for every command
+    :return: the list of the Jobs in the same order
+    """
+    return ToolRunner(workers, timeout).run(commands)